@@ -0,0 +1,215 @@
+"""Incremental columnar export of loans, books and users for offline reporting.
+
+Each run streams the rows changed since the previous run out of the database in
+chunks and merges them into Parquet files partitioned by month, under
+ANALYTICS_EXPORT_DIR (default ./analytics):
+
+    analytics/loans/month=2024-05/part.parquet      (month the loan was issued)
+    analytics/books/month=2023-11/part.parquet      (month the book was added)
+    analytics/users/month=2024-01/part.parquet      (month the user registered)
+    analytics/_watermarks.json
+
+Every partition holds the latest exported version of each row, so the files can
+be queried directly by pyarrow, pandas, DuckDB or Spark. Reporting then runs on
+them instead of the production database:
+
+    python -m Phase-1.analytics export
+    python -m Phase-1.analytics popular-books --limit 10
+    python -m Phase-1.analytics loans-per-month
+
+Hard deletes are not seen by the watermark; `export --full` rewrites everything.
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import Boolean, DateTime, Integer, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+EXPORT_DIR = Path(os.getenv("ANALYTICS_EXPORT_DIR") or "analytics")
+
+# Rows fetched from the server-side cursor and written per delta file
+CHUNK_SIZE = 10000
+# Rows changed in the last minute wait for the next run, so a transaction that
+# commits late with an older timestamp is not skipped by the watermark
+SETTLE_SECONDS = 60
+
+WATERMARKS_FILE = "_watermarks.json"
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+class ExportSpec(NamedTuple):
+    model: type
+    partition_column: str
+    changed: object  # SQL expression of when a row last changed
+
+TABLES: Dict[str, ExportSpec] = {
+    "loans": ExportSpec(models.Loan, "issue_date", models.Loan.updated_at),
+    "books": ExportSpec(models.Book, "created_at", models.Book.updated_at),
+    # updated_at stays NULL until a user's first change
+    "users": ExportSpec(models.User, "created_at", func.coalesce(models.User.updated_at, models.User.created_at)),
+}
+
+def _arrow_type(column) -> pa.DataType:
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    return pa.string()
+
+def _schema(model) -> pa.Schema:
+    return pa.schema([(column.name, _arrow_type(column)) for column in model.__table__.columns])
+
+def _month(value: Optional[datetime.datetime]) -> str:
+    return value.strftime("%Y-%m") if value else "unknown"
+
+def _load_watermarks(export_dir: Path) -> Dict[str, str]:
+    path = export_dir / WATERMARKS_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def _save_watermarks(export_dir: Path, watermarks: Dict[str, str]):
+    tmp = export_dir / (WATERMARKS_FILE + ".tmp")
+    tmp.write_text(json.dumps(watermarks, indent=2))
+    os.replace(tmp, export_dir / WATERMARKS_FILE)
+
+def _latest_by_id(table: pa.Table) -> pa.Table:
+    """Keep the last occurrence of every id (later deltas win), ordered by id."""
+    names = table.column_names
+    table = table.append_column("_row", pa.array(range(len(table)), pa.int64()))
+    last = table.group_by("id").aggregate([("_row", "max")])
+    return table.take(last["_row_max"]).select(names).sort_by("id")
+
+def _compact(partition: Path, schema: pa.Schema):
+    """Merge a partition's pending delta files into its part.parquet."""
+    deltas = sorted(partition.glob(".delta-*.parquet"))
+    if not deltas:
+        return
+    base = partition / "part.parquet"
+    parts = ([pq.read_table(base, schema=schema)] if base.exists() else []) + [
+        pq.read_table(delta, schema=schema) for delta in deltas
+    ]
+    tmp = partition / ".part.parquet.tmp"
+    pq.write_table(_latest_by_id(pa.concat_tables(parts)), tmp, compression="zstd")
+    os.replace(tmp, base)
+    for delta in deltas:
+        delta.unlink()
+
+def export_table(db: Session, name: str, export_dir: Path, since: Optional[datetime.datetime],
+                 until: datetime.datetime) -> int:
+    """Write the rows of one table changed in [since, until) as delta files, then compact. Returns the rows read."""
+    spec = TABLES[name]
+    schema = _schema(spec.model)
+    query = select(*spec.model.__table__.columns).where(spec.changed < until).order_by(spec.model.id)
+    if since is not None:
+        query = query.where(spec.changed >= since)
+
+    table_dir = export_dir / name
+    run = time.time_ns()
+    touched = set()
+    exported = 0
+    # Server-side cursor: only one chunk is held in memory at a time
+    result = db.execute(query.execution_options(yield_per=CHUNK_SIZE))
+    for sequence, rows in enumerate(result.partitions()):
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[_month(getattr(row, spec.partition_column))].append(row)
+        for month, month_rows in by_month.items():
+            partition = table_dir / f"month={month}"
+            partition.mkdir(parents=True, exist_ok=True)
+            chunk = pa.Table.from_pylist([row._asdict() for row in month_rows], schema=schema)
+            pq.write_table(chunk, partition / f".delta-{run}-{sequence:06d}.parquet")
+            touched.add(partition)
+        exported += len(rows)
+
+    for partition in touched:
+        _compact(partition, schema)
+    return exported
+
+def export(export_dir: Path = EXPORT_DIR, full: bool = False) -> Dict[str, int]:
+    """Export every table's changes since its watermark. Returns the rows exported per table."""
+    export_dir.mkdir(parents=True, exist_ok=True)
+    if full:
+        _save_watermarks(export_dir, {})
+    watermarks = _load_watermarks(export_dir)
+    until = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=SETTLE_SECONDS)
+    counts = {}
+    with SessionLocal() as db:
+        for name in TABLES:
+            if full:
+                shutil.rmtree(export_dir / name, ignore_errors=True)
+            since = watermarks.get(name)
+            counts[name] = export_table(
+                db, name, export_dir, datetime.datetime.fromisoformat(since) if since else None, until
+            )
+            # Saved per table, so an interrupted run only repeats the tables it had not finished
+            watermarks[name] = until.isoformat()
+            _save_watermarks(export_dir, watermarks)
+    return counts
+
+# --- Local queries over the exported files ---
+
+def dataset(name: str, export_dir: Path = EXPORT_DIR) -> ds.Dataset:
+    """The exported table as a pyarrow dataset; filters on `month` only open matching partitions."""
+    return ds.dataset(export_dir / name, format="parquet", partitioning=PARTITIONING)
+
+def read(name: str, months: Optional[List[str]] = None, columns: Optional[List[str]] = None,
+         filter: Optional[pc.Expression] = None, export_dir: Path = EXPORT_DIR) -> pa.Table:
+    """Load an exported table, e.g. read("loans", months=["2024-05"], filter=pc.field("status") == "OVERDUE")."""
+    if months:
+        month_filter = pc.field("month").isin(months)
+        filter = month_filter if filter is None else month_filter & filter
+    return dataset(name, export_dir).to_table(columns=columns, filter=filter)
+
+def popular_books(limit: int = 10, months: Optional[List[str]] = None, export_dir: Path = EXPORT_DIR) -> pa.Table:
+    """Most borrowed books, like GET /api/stats/books/popular but from the export."""
+    loans = read("loans", months=months, columns=["id", "book_id"], export_dir=export_dir)
+    counts = loans.group_by("book_id").aggregate([("id", "count")])
+    counts = pa.table({"book_id": counts["book_id"], "borrow_count": counts["id_count"]})
+    books = read("books", columns=["id", "title", "author"], export_dir=export_dir)
+    books = pa.table({"book_id": books["id"], "title": books["title"], "author": books["author"]})
+    ranked = counts.join(books, "book_id").sort_by([("borrow_count", "descending"), ("book_id", "ascending")])
+    return ranked.slice(0, limit)
+
+def loans_per_month(export_dir: Path = EXPORT_DIR) -> pa.Table:
+    """Loans issued per month and status."""
+    loans = read("loans", columns=["id", "month", "status"], export_dir=export_dir)
+    counts = loans.group_by(["month", "status"]).aggregate([("id", "count")])
+    counts = pa.table({"month": counts["month"], "status": counts["status"], "loans": counts["id_count"]})
+    return counts.sort_by([("month", "ascending"), ("status", "ascending")])
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar analytics export of the library database")
+    parser.add_argument("--dir", type=Path, default=EXPORT_DIR, help="export directory (ANALYTICS_EXPORT_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="export rows changed since the last run")
+    export_parser.add_argument("--full", action="store_true", help="ignore the watermarks and rewrite everything")
+    popular_parser = commands.add_parser("popular-books", help="most borrowed books")
+    popular_parser.add_argument("--limit", type=int, default=10)
+    popular_parser.add_argument("--month", action="append", help="restrict to a month (YYYY-MM); repeatable")
+    commands.add_parser("loans-per-month", help="loans issued per month and status")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(json.dumps(export(args.dir, full=args.full)))
+    elif args.command == "popular-books":
+        rows = popular_books(args.limit, args.month, args.dir).to_pylist()
+        print("\n".join(json.dumps(row) for row in rows))
+    else:
+        print("\n".join(json.dumps(row) for row in loans_per_month(args.dir).to_pylist()))
+
+if __name__ == "__main__":
+    main()
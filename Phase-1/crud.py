@@ -1,9 +1,10 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, extract, case, text, or_
+from sqlalchemy import func, extract, case, text, or_, select, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from . import models, schemas
 from fastapi import HTTPException, status
 import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from sqlalchemy.orm import joinedload
 
 # --- User CRUD ---
@@ -25,6 +26,34 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
+def bulk_create_users(db: Session, users: List[schemas.UserCreate]) -> Dict[str, int]:
+    # One statement per chunk instead of a SELECT + INSERT + COMMIT per user.
+    # Returns {email: new user id} for the rows that were actually created.
+    rows = {}
+    for user in users:
+        rows.setdefault(user.email, {"name": user.name, "email": user.email, "role": user.role})
+    if not rows:
+        return {}
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(models.User).values(list(rows.values()))\
+            .on_conflict_do_nothing(index_elements=[models.User.email])\
+            .returning(models.User.email, models.User.id)
+        created = {email: user_id for email, user_id in db.execute(stmt)}
+    else:
+        # Fallback: a single set query for the emails that already exist
+        existing = set(db.scalars(select(models.User.email).where(models.User.email.in_(list(rows)))))
+        new_rows = [row for email, row in rows.items() if email not in existing]
+        created = {}
+        if new_rows:
+            result = db.execute(insert(models.User).returning(models.User.email, models.User.id), new_rows)
+            created = {email: user_id for email, user_id in result}
+
+    db.commit()
+    return created
+
 # Add update_user if needed (Consider adding a separate endpoint/schema for this)
 # def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
 #     db_user = get_user(db, user_id)
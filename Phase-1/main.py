@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from .database import engine, Base
 from .routers import users, books, loans, stats
 from . import models # Ensure models are imported so Base knows about them
+from . import query_budget
 
 
 # Create database tables
@@ -20,6 +21,10 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Per-route SQL statement budgets (QUERY_BUDGET_MODE=warn|raise)
+query_budget.instrument_engine(engine)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
 # Include routers
 app.include_router(users.router)
 app.include_router(books.router)
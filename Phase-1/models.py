@@ -41,6 +41,8 @@ class Loan(Base):
     return_date = Column(DateTime(timezone=True), nullable=True)
     status = Column(String, default="ACTIVE") # ACTIVE, RETURNED, OVERDUE
     extensions_count = Column(Integer, default=0)
+    # Watermark of the incremental analytics export (analytics.py)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
 
     user = relationship("User", back_populates="loans")
     book = relationship("Book", back_populates="loans") 
\ No newline at end of file
@@ -0,0 +1,129 @@
+import contextvars
+import logging
+import os
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger("query_budget")
+
+# Long SQL is truncated in reports
+MAX_STATEMENT_LENGTH = 300
+
+# off: no accounting; warn: log requests that go over budget with their statements
+# (staging); raise: fail them with QueryBudgetExceeded so tests catch regressions.
+# Read on every request so tests can switch it with monkeypatch.
+MODE = (os.getenv("QUERY_BUDGET_MODE") or "off").lower()
+
+class Budget(NamedTuple):
+    queries: int
+    outbound: int = 0
+
+# Allowed SQL statements per route template.
+# Routes not listed get DEFAULT_BUDGET; None exempts a route.
+DEFAULT_BUDGET = Budget(queries=3, outbound=0)
+ROUTE_BUDGETS: Dict[Tuple[str, str], Optional[Budget]] = {
+    # Includes reloading the book and user after commit to build the response
+    ("POST", "/api/loans"): Budget(queries=8),
+    ("POST", "/api/returns"): Budget(queries=7),
+    ("GET", "/api/loans/{user_id}"): Budget(queries=2),
+    ("GET", "/api/loans/overdue"): Budget(queries=2),
+    ("GET", "/api/stats/overview"): Budget(queries=8),
+    # Streaming import runs one statement per batch
+    ("POST", "/api/users/bulk"): None,
+}
+
+class QueryBudgetExceeded(AssertionError):
+    """A request or block ran more SQL statements or outbound calls than its budget allows."""
+
+class Tracker:
+    """Statements recorded while serving one request."""
+    __slots__ = ("statements", "outbound")
+
+    def __init__(self):
+        self.statements = []
+        self.outbound = []
+
+_current = contextvars.ContextVar("query_budget_tracker", default=None)
+
+def instrument_engine(engine):
+    """Record every SQL statement executed while a tracker is active."""
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        tracker = _current.get()
+        if tracker is not None:
+            tracker.statements.append(" ".join(statement.split())[:MAX_STATEMENT_LENGTH])
+
+def _report(label: str, budget: Budget, tracker: Tracker) -> Optional[str]:
+    if len(tracker.statements) <= budget.queries and len(tracker.outbound) <= budget.outbound:
+        return None
+    lines = [
+        f"{label} exceeded its budget: {len(tracker.statements)}/{budget.queries} SQL statements, "
+        f"{len(tracker.outbound)}/{budget.outbound} outbound calls"
+    ]
+    # Repeated statements are listed first: they are usually the N+1
+    for statement, count in Counter(tracker.statements).most_common():
+        lines.append(f"  {count}x {statement}")
+    for call, count in Counter(tracker.outbound).most_common():
+        lines.append(f"  {count}x {call}")
+    return "\n".join(lines)
+
+@contextmanager
+def query_budget(queries: int, outbound: int = 0, label: str = "block"):
+    """Fail with QueryBudgetExceeded if the enclosed code goes over budget.
+
+    Intended for tests, e.g. ``with query_budget(2): crud.get_user_loans(db, 1)``.
+    """
+    tracker = Tracker()
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+    report = _report(label, Budget(queries, outbound), tracker)
+    if report:
+        raise QueryBudgetExceeded(report)
+
+def _route_report(scope, tracker: Tracker) -> Optional[str]:
+    """The report for a request that went over its route's budget, if it did."""
+    route = getattr(scope.get("route"), "path", None)
+    if route is None:
+        return None
+    budget = ROUTE_BUDGETS.get((scope["method"], route), DEFAULT_BUDGET)
+    return budget and _report(f"{scope['method']} {route}", budget, tracker)
+
+class QueryBudgetMiddleware:
+    """ASGI middleware enforcing ROUTE_BUDGETS according to QUERY_BUDGET_MODE."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if MODE == "off" or scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        tracker = Tracker()
+
+        async def send_within_budget(message):
+            if message["type"] == "http.response.start" and MODE == "raise":
+                # Fail the request while it can still get a 500
+                report = _route_report(scope, tracker)
+                if report:
+                    raise QueryBudgetExceeded(report)
+            await send(message)
+
+        token = _current.set(tracker)
+        try:
+            await self.app(scope, receive, send_within_budget)
+        finally:
+            _current.reset(token)
+
+        # In raise mode only statements run after the response started (streamed
+        # bodies) get here over budget; they can no longer fail the request
+        report = _route_report(scope, tracker)
+        if report:
+            logger.warning(report)
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from .. import crud, models, schemas
+from .. import bulk, crud, models, schemas
 from ..database import get_db
 
 router = APIRouter(
@@ -17,6 +18,19 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # crud.create_user handles email uniqueness check
     return crud.create_user(db=db, user=user)
 
+@router.post("/bulk", response_model=schemas.BulkUserSummary)
+async def bulk_create_users(
+    request: Request,
+    format: Optional[str] = Query(None, description="'csv' or 'ndjson'; defaults to the request Content-Type"),
+    batch_size: int = Query(1000, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """Register many users from a streamed CSV/NDJSON body."""
+    # Emails are validated per row, duplicates are resolved per chunk with ON CONFLICT
+    fmt = bulk.detect_format(format, request.headers.get("content-type"))
+    counts, results = await bulk.import_users(db, request.stream(), fmt, batch_size)
+    return StreamingResponse(bulk.summary_body(counts, results), media_type="application/json")
+
 @router.get("/{user_id}", response_model=schemas.User)
 def read_user(user_id: int, db: Session = Depends(get_db)):
     """Fetch user profile by ID."""
@@ -109,6 +109,21 @@ class LoanExtended(Loan):
     original_due_date: datetime.datetime
     extended_due_date: datetime.datetime
 
+# Schemas for bulk user registration
+class BulkUserResult(BaseModel):
+    line: int
+    email: Optional[str] = None
+    status: str # "created", "duplicate" or "invalid"
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkUserSummary(BaseModel):
+    received: int
+    created: int
+    duplicates: int
+    invalid: int
+    results: List[BulkUserResult]
+
 # Schemas for Statistics
 class PopularBookStat(BaseModel):
     book_id: int
@@ -0,0 +1,176 @@
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, models, schemas
+from .database import SessionLocal
+
+# Columns written by the export and understood by the import (extra columns are ignored)
+EXPORT_FIELDS = ["id", "title", "author", "isbn", "genre", "copies", "available_copies", "created_at", "updated_at"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Only the first few bad rows are echoed back so the response stays small for huge files
+MAX_REPORTED_ERRORS = 100
+
+def detect_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    """Pick the import format from the explicit query parameter or the Content-Type header."""
+    if fmt:
+        fmt = fmt.lower()
+    elif content_type and "csv" in content_type:
+        fmt = "csv"
+    elif content_type and ("ndjson" in content_type or "jsonl" in content_type or "json" in content_type):
+        fmt = "ndjson"
+
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported format. Use 'csv' or 'ndjson'."
+        )
+    return fmt
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split an incoming byte stream into text lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Dict]]:
+    """Yield (line number, raw record) pairs parsed incrementally from a CSV or NDJSON stream."""
+    header = None
+    record_text = ""
+    record_line = 0
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_no, None
+                continue
+            yield line_no, record if isinstance(record, dict) else None
+            continue
+
+        # CSV: a quoted field may span lines, so keep reading until the quotes balance
+        if not record_text:
+            record_line = line_no
+            record_text = line
+        else:
+            record_text += "\n" + line
+        if record_text.count('"') % 2:
+            continue
+        text, record_text = record_text, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield record_line, {
+            key: (value if value != "" else None)
+            for key, value in zip(header, values)
+        }
+
+    if record_text:
+        # Unterminated quote at end of input
+        yield record_line, None
+
+async def import_books(db, chunks: AsyncIterator[bytes], fmt: str, batch_size: int) -> Dict:
+    """Stream books from the request body into the catalog in multi-row batches."""
+    result = {"received": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "errors": []}
+    batch: List[schemas.BookCreate] = []
+
+    def report(line_no: int, detail: str):
+        result["invalid"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line_no, "detail": detail})
+
+    async def flush():
+        inserted = await run_in_threadpool(crud.bulk_create_books, db, batch)
+        result["inserted"] += inserted
+        result["duplicates"] += len(batch) - inserted
+        batch.clear()
+
+    async for line_no, record in iter_records(chunks, fmt):
+        result["received"] += 1
+        if record is None:
+            report(line_no, "Malformed record")
+            continue
+        try:
+            book = schemas.BookCreate(**record)
+        except ValidationError as e:
+            report(line_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        if book.copies < 0 or (book.available_copies is not None and not 0 <= book.available_copies <= book.copies):
+            report(line_no, "Available copies must be between 0 and total copies")
+            continue
+        batch.append(book)
+        if len(batch) >= batch_size:
+            await flush()
+
+    if batch:
+        await flush()
+    return result
+
+def _value(book: models.Book, field: str):
+    # Sharded (hot) books report the sum of their inventory shards, as the read API does
+    if field == "available_copies" and book.sharded_available is not None:
+        return book.sharded_available
+    return getattr(book, field)
+
+def _format_csv(books: List[models.Book]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for book in books:
+        writer.writerow([
+            "" if _value(book, field) is None else _value(book, field)
+            for field in EXPORT_FIELDS
+        ])
+    return buffer.getvalue()
+
+def _format_ndjson(books: List[models.Book]) -> str:
+    return "".join(
+        json.dumps({field: _value(book, field) for field in EXPORT_FIELDS}, default=str) + "\n"
+        for book in books
+    )
+
+def export_books(fmt: str, chunk_size: int = 1000) -> Iterator[str]:
+    """Stream the whole catalog as CSV or NDJSON using a server-side cursor.
+
+    The generator owns its session because the response body is produced
+    after the request dependencies have already been torn down.
+    """
+    db = SessionLocal()
+    try:
+        if fmt == "csv":
+            header = io.StringIO()
+            csv.writer(header).writerow(EXPORT_FIELDS)
+            yield header.getvalue()
+        formatter = _format_csv if fmt == "csv" else _format_ndjson
+
+        query = select(models.Book).order_by(models.Book.id).execution_options(yield_per=chunk_size)
+        for books in db.scalars(query).partitions():
+            yield formatter(books)
+            db.expunge_all()
+    finally:
+        db.close()
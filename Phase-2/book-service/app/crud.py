@@ -1,20 +1,37 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import delete, or_, select, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from fastapi import HTTPException, status
-from . import models, schemas
+from typing import List, Optional
+from . import events, facets, inventory, models, schemas
+from .singleflight import SingleFlight
 
 def get_book(db: Session, book_id: int):
     return db.query(models.Book).filter(models.Book.id == book_id).first()
 
+_book_lookups = SingleFlight("get_book")
+
+def get_book_coalesced(db: Session, book_id: int) -> Optional[schemas.Book]:
+    """Like get_book, but concurrent lookups of the same book share a single query."""
+    def load():
+        db_book = get_book(db, book_id=book_id)
+        return None if db_book is None else schemas.Book.model_validate(db_book)
+    return _book_lookups.do(book_id, load)
+
+def get_books_by_ids(db: Session, book_ids: List[int]) -> List[models.Book]:
+    if not book_ids:
+        return []
+    return db.query(models.Book).filter(models.Book.id.in_(book_ids)).all()
+
 def get_book_by_isbn(db: Session, isbn: str):
     return db.query(models.Book).filter(models.Book.isbn == isbn).first()
 
-def get_books(db: Session, search: str = None, skip: int = 0, limit: int = 10):
-    query = db.query(models.Book)
-    
+def get_books(db: Session, search: str = None, skip: int = 0, limit: int = 10, include_facets: bool = False):
+    search = facets.normalize(search)
+    conditions = []
     if search:
         search_term = f"%{search}%"
-        query = query.filter(
+        conditions.append(
             or_(
                 models.Book.title.ilike(search_term),
                 models.Book.author.ilike(search_term),
@@ -22,15 +39,19 @@ def get_books(db: Session, search: str = None, skip: int = 0, limit: int = 10):
                 models.Book.genre.ilike(search_term)
             )
         )
-    
-    total = query.count()
+    query = db.query(models.Book).filter(*conditions)
+
+    # The facet statement also counts the matches
+    counts = facets.get_counts(db, search, conditions) if include_facets else None
+    total = query.count() if counts is None else counts["total"]
     books = query.offset(skip).limit(limit).all()
     
     return {
         "books": books,
         "total": total,
         "page": skip // limit + 1 if limit > 0 else 1,
-        "per_page": limit
+        "per_page": limit,
+        "facets": None if counts is None else {"genres": counts["genres"], "authors": counts["authors"]}
     }
 
 def create_book(db: Session, book: schemas.BookCreate):
@@ -49,10 +70,54 @@ def create_book(db: Session, book: schemas.BookCreate):
     
     db_book = models.Book(**book_dict)
     db.add(db_book)
+    db.flush()
+    events.catalog_changed(db, [db_book.id])
     db.commit()
     db.refresh(db_book)
     return db_book
 
+def bulk_create_books(db: Session, books: List[schemas.BookCreate]) -> int:
+    """Insert a batch of books with one multi-row INSERT, skipping ISBNs that already exist.
+
+    Returns the number of rows actually inserted.
+    """
+    # Dedupe within the batch first; the first occurrence of an ISBN wins
+    rows = {}
+    for book in books:
+        if book.isbn in rows:
+            continue
+        book_dict = book.dict()
+        if book_dict.get("available_copies") is None:
+            book_dict["available_copies"] = book_dict["copies"]
+        rows[book.isbn] = book_dict
+    if not rows:
+        return 0
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (
+            dialect_insert(models.Book)
+            .values(list(rows.values()))
+            .on_conflict_do_nothing(index_elements=[models.Book.isbn])
+            .returning(models.Book.id)
+        )
+        new_ids = db.scalars(stmt).all()
+    else:
+        # Generic fallback: one set query for existing ISBNs, then a plain multi-row INSERT
+        existing = set(db.scalars(select(models.Book.isbn).where(models.Book.isbn.in_(list(rows)))))
+        new_rows = [row for isbn, row in rows.items() if isbn not in existing]
+        new_ids = []
+        if new_rows:
+            db.execute(insert(models.Book), new_rows)
+            new_ids = db.scalars(
+                select(models.Book.id).where(models.Book.isbn.in_([row["isbn"] for row in new_rows]))
+            ).all()
+
+    events.catalog_changed(db, new_ids)
+    db.commit()
+    return len(new_ids)
+
 def update_book(db: Session, book_id: int, book_update: schemas.BookUpdate):
     db_book = get_book(db, book_id=book_id)
     if not db_book:
@@ -73,6 +138,12 @@ def update_book(db: Session, book_id: int, book_update: schemas.BookUpdate):
                 detail="ISBN already registered"
             )
     
+    if ("copies" in update_data or "available_copies" in update_data) and db_book.sharded_available is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Book uses sharded inventory; set its shards to 0 before changing copies"
+        )
+
     # Ensure available_copies doesn't exceed copies
     if "copies" in update_data and update_data["copies"] < db_book.available_copies:
         if "available_copies" not in update_data:
@@ -80,6 +151,10 @@ def update_book(db: Session, book_id: int, book_update: schemas.BookUpdate):
     
     for key, value in update_data.items():
         setattr(db_book, key, value)
+    if "copies" in update_data or "available_copies" in update_data:
+        events.availability_changed(db, book_id)
+    if update_data.keys() & {"title", "author", "isbn", "genre"}:
+        events.catalog_changed(db, [book_id])
     
     db.commit()
     db.refresh(db_book)
@@ -93,32 +168,67 @@ def update_availability(db: Session, book_id: int, update: schemas.AvailabilityU
             detail="Book not found"
         )
     
+    if update.operation not in ("increment", "decrement"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid operation. Use 'increment' or 'decrement'."
+        )
+
+    # Sent once one of the paths below commits
+    events.availability_changed(db, book_id)
+
+    # Hot books spread their copies over inventory shards instead of this row
+    if inventory.adjust(db, book_id, update.operation, update.count):
+        db.refresh(db_book)
+        return db_book
+
     if update.operation == "increment":
         # Check that we don't exceed the total copies
-        if db_book.available_copies >= db_book.copies:
+        if db_book.available_copies + update.count > db_book.copies:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Available copies cannot exceed total copies"
             )
-        db_book.available_copies += 1
-    elif update.operation == "decrement":
+        db_book.available_copies += update.count
+    else:
         # Check that we have available copies
-        if db_book.available_copies <= 0:
+        if db_book.available_copies < update.count:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No available copies to borrow"
             )
-        db_book.available_copies -= 1
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid operation. Use 'increment' or 'decrement'."
-        )
+        db_book.available_copies -= update.count
     
     db.commit()
     db.refresh(db_book)
     return db_book
 
+def get_inventory(db: Session, book_id: int):
+    db_book = get_book(db, book_id=book_id)
+    if not db_book:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+    shards = inventory.get_shards(db, book_id)
+    return {
+        "book_id": db_book.id,
+        "copies": db_book.copies,
+        "available_copies": db_book.sharded_available if shards else db_book.available_copies,
+        "sharded": bool(shards),
+        "shards": shards
+    }
+
+def set_inventory(db: Session, book_id: int, update: schemas.InventoryUpdate):
+    db_book = get_book(db, book_id=book_id)
+    if not db_book:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+    inventory.configure(db, db_book, update.shards)
+    return get_inventory(db, book_id)
+
 def delete_book(db: Session, book_id: int):
     db_book = get_book(db, book_id=book_id)
     if not db_book:
@@ -131,6 +241,9 @@ def delete_book(db: Session, book_id: int):
     # as that's managed by a different service. The Loan service should ensure
     # it doesn't leave dangling references.
     
+    db.execute(delete(models.InventoryShard).where(models.InventoryShard.book_id == book_id))
     db.delete(db_book)
+    events.availability_changed(db, book_id)
+    events.catalog_changed(db, [book_id])
     db.commit()
     return True 
\ No newline at end of file
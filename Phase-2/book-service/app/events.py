@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import select as select_module
+import threading
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import func, select
+from starlette.concurrency import run_in_threadpool
+
+from . import facets, metrics, models, suggest
+from .database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Live availability for catalog clients, as Server-Sent Events. Writes only record
+# which books changed; the committing session announces them (PostgreSQL NOTIFY on
+# the same transaction, so every worker and replica hears about it; in-process
+# otherwise). Each worker then re-reads the changed books that somebody is
+# watching once per COALESCE_INTERVAL, in one query however many clients are
+# connected, and pushes the new value to their streams. A burst of borrows and
+# returns on one book reaches clients as a single event with the latest value.
+CHANNEL = "book_availability"
+# Books added, deleted or edited, for the typeahead index (suggest.py) and the
+# facet counts (facets.py)
+CATALOG_CHANNEL = "book_catalog"
+# Book ids per catalog NOTIFY (payloads are limited to 8000 bytes)
+IDS_PER_NOTIFY = 500
+
+COALESCE_INTERVAL = 0.25
+# Seconds between keep-alive comments on idle streams (proxies drop silent connections)
+HEARTBEAT_INTERVAL = 15.0
+# Most books one stream can watch
+MAX_BOOKS_PER_STREAM = 100
+
+def availability_changed(db, book_id: int):
+    """Announce a change to book_id's availability when db's transaction commits."""
+    db.info.setdefault("changed_books", set()).add(book_id)
+
+def catalog_changed(db, book_ids: Iterable[int]):
+    """Announce new, edited or deleted books to the typeahead index and facet cache when db's transaction commits."""
+    db.info.setdefault("changed_catalog", set()).update(book_ids)
+
+@sa_event.listens_for(SessionLocal, "before_commit")
+def _notify_changed(session):
+    if engine.dialect.name != "postgresql":
+        return
+    for book_id in session.info.pop("changed_books", ()):
+        session.execute(select(func.pg_notify(CHANNEL, str(book_id))))
+    catalog = sorted(session.info.pop("changed_catalog", ()))
+    for start in range(0, len(catalog), IDS_PER_NOTIFY):
+        payload = ",".join(map(str, catalog[start:start + IDS_PER_NOTIFY]))
+        session.execute(select(func.pg_notify(CATALOG_CHANNEL, payload)))
+
+@sa_event.listens_for(SessionLocal, "after_commit")
+def _deliver_changed(session):
+    # Not discarded on rollback: a spurious change only triggers a re-read
+    for book_id in session.info.pop("changed_books", ()):
+        hub.mark_changed(book_id)
+    catalog = session.info.pop("changed_catalog", None)
+    if catalog:
+        suggest.indexer.mark_changed(catalog)
+        facets.cache.invalidate()
+
+class Subscriber:
+    """One stream's view: the latest unsent value per watched book."""
+    __slots__ = ("book_ids", "pending", "ready")
+
+    def __init__(self, book_ids: Set[int]):
+        self.book_ids = book_ids
+        self.pending: Dict[int, Optional[int]] = {}
+        self.ready = asyncio.Event()
+
+    def offer(self, book_id: int, available: Optional[int]):
+        # Overwrites a value the client has not been sent yet
+        self.pending[book_id] = available
+        self.ready.set()
+
+class Hub:
+    """Per-worker fan-out from changed books to the streams watching them.
+
+    Everything but mark_changed runs on the worker's event loop.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.watchers: Dict[int, Set[Subscriber]] = {}
+        self.changed: Set[int] = set()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.flusher: Optional[asyncio.Task] = None
+
+    def subscribe(self, book_ids: Set[int]) -> Subscriber:
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.wakeup = asyncio.Event()
+        if self.flusher is None or self.flusher.done():
+            self.flusher = self.loop.create_task(self._flush())
+        subscriber = Subscriber(book_ids)
+        for book_id in book_ids:
+            self.watchers.setdefault(book_id, set()).add(subscriber)
+        metrics.AVAILABILITY_STREAMS.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        for book_id in subscriber.book_ids:
+            watchers = self.watchers.get(book_id)
+            if watchers is not None:
+                watchers.discard(subscriber)
+                if not watchers:
+                    del self.watchers[book_id]
+        metrics.AVAILABILITY_STREAMS.dec()
+
+    def mark_changed(self, book_id: int):
+        """Safe to call from any thread; a no-op until a stream has connected."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._mark, book_id)
+
+    def _mark(self, book_id: int):
+        if book_id in self.watchers:
+            self.changed.add(book_id)
+            self.wakeup.set()
+
+    async def _flush(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(COALESCE_INTERVAL)
+            self.wakeup.clear()
+            book_ids, self.changed = self.changed, set()
+            try:
+                values = await run_in_threadpool(read_availability, book_ids)
+            except Exception:
+                logger.exception("Could not read availability of %d book(s)", len(book_ids))
+                continue
+            for book_id in book_ids:
+                for subscriber in self.watchers.get(book_id, ()):
+                    # None: the book was deleted
+                    subscriber.offer(book_id, values.get(book_id))
+
+hub = Hub()
+
+def read_availability(book_ids: Iterable[int]) -> Dict[int, int]:
+    """Current available copies per book, sharded or not; deleted books are left out."""
+    table = models.Book
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(table.id, table.available_copies, table.sharded_available).where(table.id.in_(list(book_ids)))
+        ).all()
+    return {row.id: row.available_copies if row.sharded_available is None else row.sharded_available for row in rows}
+
+def format_event(book_id: int, available: Optional[int]) -> str:
+    if available is None:
+        return f"event: deleted\ndata: {json.dumps({'book_id': book_id})}\n\n"
+    return f"event: availability\ndata: {json.dumps({'book_id': book_id, 'available_copies': available})}\n\n"
+
+async def stream(book_ids: List[int]) -> AsyncIterator[str]:
+    """Server-Sent Events: the current availability of each book, then every change."""
+    subscriber = hub.subscribe(set(book_ids))
+    try:
+        # Subscribed first, so a change committed meanwhile is sent again rather than lost
+        current = await run_in_threadpool(read_availability, book_ids)
+        for book_id in book_ids:
+            yield format_event(book_id, current.get(book_id))
+        last = dict(current)
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            subscriber.ready.clear()
+            pending, subscriber.pending = subscriber.pending, {}
+            for book_id, available in pending.items():
+                # A borrow and a return inside one window cancel out
+                if book_id in last and last[book_id] == available:
+                    continue
+                last[book_id] = available
+                yield format_event(book_id, available)
+    finally:
+        hub.unsubscribe(subscriber)
+
+class NotifyListener:
+    """Background thread relaying PostgreSQL NOTIFY messages to this worker's hub, typeahead index and facet cache."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if engine.dialect.name != "postgresql" or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="availability-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                # A dedicated connection outside the pool, in autocommit mode for LISTEN
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}; LISTEN {CATALOG_CHANNEL}")
+                while not self._stop.is_set():
+                    if select_module.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        if notify.channel == CATALOG_CHANNEL:
+                            suggest.indexer.mark_changed(int(book_id) for book_id in notify.payload.split(","))
+                            facets.cache.invalidate()
+                        else:
+                            hub.mark_changed(int(notify.payload))
+            except Exception:
+                logger.exception("Availability listener failed; reconnecting")
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+listener = NotifyListener()
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, literal_column, null, select, union_all
+from sqlalchemy.orm import Session
+
+from . import metrics, models
+
+# Facet counts for catalog searches (GET /api/books/?facets=true): books per
+# genre and the top authors among everything the search matches. Both come from
+# one statement that also yields the total, so a faceted search costs the same
+# two queries as a plain one. The search condition is evaluated once, into a
+# CTE that both groupings read (materialized by PostgreSQL and SQLite since it
+# is used twice).
+#
+# Each worker caches the counts per normalized search, least recently used
+# first out past FACET_CACHE_SIZE searches; a cached faceted search runs only
+# the page query. The whole cache is dropped when a book is created, deleted
+# or changes title, author, ISBN or genre (events.catalog_changed, which
+# reaches every worker over NOTIFY on PostgreSQL). Entries also expire after
+# FACET_CACHE_TTL seconds, in case the catalog is edited outside the service.
+TOP_GENRES = 20
+TOP_AUTHORS = 10
+CACHE_SIZE = int(os.getenv("FACET_CACHE_SIZE") or 1024)
+CACHE_TTL = float(os.getenv("FACET_CACHE_TTL") or 300.0)
+
+def normalize(search: Optional[str]) -> str:
+    """The search as matched and cached: lower case, single spaces ("" for no search)."""
+    return " ".join((search or "").split()).lower()
+
+class FacetCache:
+    """Per-worker LRU of facet counts by normalized search, invalidated as a whole."""
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Bumped by every invalidation, so counts read before a write are not stored after it
+        self.generation = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                metrics.FACET_CACHE_LOOKUPS.labels("hit").inc()
+                return entry[1]
+        metrics.FACET_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def put(self, key: str, counts: dict, generation: int):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, counts)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """Safe to call from any thread."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+cache = FacetCache()
+
+def _ranked(column, facet: str, with_total: bool):
+    count = func.count()
+    return (
+        select(
+            literal_column(f"'{facet}'").label("facet"),
+            column.label("value"),
+            count.label("count"),
+            (func.sum(count).over() if with_total else null()).label("total"),
+            # NULL (books without a genre) counts towards the total, but ranks last
+            func.row_number().over(order_by=(column.is_(None), count.desc(), column)).label("rank"),
+        )
+        .group_by(column)
+    )
+
+def count_facets(db: Session, conditions: List) -> Dict:
+    """Total matches, books per genre and top authors for a search, in one statement."""
+    book = models.Book
+    matches = select(book.genre, book.author).where(*conditions).cte("matches")
+    genres = _ranked(matches.c.genre, "genre", True).subquery("genres")
+    authors = _ranked(matches.c.author, "author", False).subquery("authors")
+    stmt = union_all(
+        select(genres.c.facet, genres.c.value, genres.c["count"], genres.c.total).where(genres.c.rank <= TOP_GENRES),
+        select(authors.c.facet, authors.c.value, authors.c["count"], authors.c.total).where(authors.c.rank <= TOP_AUTHORS),
+    )
+    counts = {"total": 0, "genres": [], "authors": []}
+    for row in db.execute(stmt):
+        if row.total is not None:
+            counts["total"] = int(row.total)
+        if row.value is not None:
+            counts[f"{row.facet}s"].append({"value": row.value, "count": row.count})
+    for facet in ("genres", "authors"):
+        counts[facet].sort(key=lambda item: (-item["count"], item["value"]))
+    return counts
+
+def get_counts(db: Session, search: str, conditions: List) -> Dict:
+    """count_facets for a normalized search, from the cache when possible."""
+    counts = cache.get(search)
+    if counts is None:
+        generation = cache.generation
+        counts = count_facets(db, conditions)
+        cache.put(search, counts, generation)
+    return counts
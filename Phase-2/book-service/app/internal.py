@@ -0,0 +1,81 @@
+from typing import Any, Dict
+
+import msgpack
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+from .database import get_db
+
+# Service-to-service API used by the Loan Service when INTERNAL_TRANSPORT=binary.
+# Bodies are MessagePack maps with the same fields as the public JSON API; errors
+# keep FastAPI's JSON {"detail": ...} body. nginx only proxies /api/*, so these
+# routes are reachable on the service network only.
+MEDIA_TYPE = "application/msgpack"
+
+# Largest batch lookup accepted in one request
+MAX_BATCH = 1000
+
+router = APIRouter(prefix="/internal/books", include_in_schema=False)
+
+class MsgpackResponse(Response):
+    media_type = MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+async def msgpack_body(request: Request) -> Dict[str, Any]:
+    """Decode a MessagePack map request body."""
+    try:
+        body = msgpack.unpackb(await request.body())
+    except (ValueError, msgpack.UnpackException):
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Request body must be a MessagePack map"
+        )
+    return body
+
+def _dump(book) -> Dict[str, Any]:
+    return schemas.Book.model_validate(book).model_dump(mode="json")
+
+@router.get("/{book_id}")
+def get_book(book_id: int, db: Session = Depends(get_db)):
+    book = crud.get_book_coalesced(db, book_id=book_id)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return MsgpackResponse(book.model_dump(mode="json"))
+
+@router.post("/batch")
+def get_books(body: Dict[str, Any] = Depends(msgpack_body), db: Session = Depends(get_db)):
+    """Look up several books in one query; unknown ids are left out of the result."""
+    book_ids = body.get("ids")
+    if not isinstance(book_ids, list) or not all(isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in book_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'ids' must be a list of integers"
+        )
+    if len(book_ids) > MAX_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH} ids per batch"
+        )
+    return MsgpackResponse({"books": [_dump(book) for book in crud.get_books_by_ids(db, book_ids)]})
+
+@router.post("/{book_id}/availability")
+def update_availability(book_id: int, body: Dict[str, Any] = Depends(msgpack_body), db: Session = Depends(get_db)):
+    operation = body.get("operation")
+    if not isinstance(operation, str):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid operation. Use 'increment' or 'decrement'."
+        )
+    count = body.get("count", 1)
+    if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'count' must be a positive integer"
+        )
+    update = schemas.AvailabilityUpdate(available_copies=0, operation=operation, count=count)
+    return MsgpackResponse(_dump(crud.update_availability(db, book_id=book_id, update=update)))
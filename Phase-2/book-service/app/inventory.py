@@ -0,0 +1,164 @@
+import random
+from typing import List
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Hot books can spread their available copies over several inventory_shards rows.
+# Each borrow or return updates one randomly chosen shard with a conditional
+# UPDATE, so concurrent borrows of the same title lock different rows instead of
+# queueing on books.available_copies. The book's availability is the sum of
+# its shards (models.Book.sharded_available).
+MAX_SHARDS = 64
+
+def _split(total: int, parts: int) -> List[int]:
+    """Spread total as evenly as possible, larger parts first."""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+def _write_shards(db: Session, book_id: int, current: List[models.InventoryShard], shards: int,
+                  available: int, capacity: int):
+    """Rewrite a book's shards in place (rows are updated, not replaced, so concurrent
+    borrows waiting on a locked shard still find it afterwards)."""
+    existing = {row.shard: row for row in current}
+    # Splitting both totals the same way keeps available <= capacity in every shard
+    for shard, (shard_available, shard_capacity) in enumerate(zip(_split(available, shards), _split(capacity, shards))):
+        row = existing.pop(shard, None)
+        if row is None:
+            db.add(models.InventoryShard(
+                book_id=book_id, shard=shard, available=shard_available, capacity=shard_capacity
+            ))
+        else:
+            row.available, row.capacity = shard_available, shard_capacity
+    for row in existing.values():
+        db.delete(row)
+
+def _lock_shards(db: Session, book_id: int) -> List[models.InventoryShard]:
+    """Lock a book's shards before rewriting them from their current values.
+
+    A no-op UPDATE rather than SELECT ... FOR UPDATE: it takes the row locks on
+    PostgreSQL and the write lock on SQLite (which ignores FOR UPDATE), so a
+    borrow committed between the read and the rewrite cannot be lost.
+    """
+    table = models.InventoryShard
+    db.execute(
+        update(table).where(table.book_id == book_id).values(available=table.available),
+        execution_options={"synchronize_session": False},
+    )
+    return list(db.scalars(select(table).where(table.book_id == book_id).order_by(table.shard)))
+
+def get_shards(db: Session, book_id: int) -> List[models.InventoryShard]:
+    return list(db.scalars(
+        select(models.InventoryShard)
+        .where(models.InventoryShard.book_id == book_id)
+        .order_by(models.InventoryShard.shard)
+    ))
+
+def configure(db: Session, db_book: models.Book, shards: int):
+    """Spread a book's availability over `shards` rows, or fold it back into the book row (0 or 1)."""
+    if not 0 <= shards <= MAX_SHARDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Shard count must be between 0 and {MAX_SHARDS}"
+        )
+    current = _lock_shards(db, db_book.id)
+    available = sum(shard.available for shard in current) if current else db_book.available_copies
+
+    if shards <= 1:
+        db.execute(delete(models.InventoryShard).where(models.InventoryShard.book_id == db_book.id))
+        db_book.available_copies = available
+    else:
+        _write_shards(db, db_book.id, current, shards, available, db_book.copies)
+        # The book row keeps the value at sharding time; reads use the shard sum
+        db_book.available_copies = available
+    db.commit()
+    db.refresh(db_book)
+
+def rebalance(db: Session, book_id: int):
+    """Even out availability across a book's shards after one of them ran dry."""
+    current = _lock_shards(db, book_id)
+    if len(current) > 1:
+        _write_shards(
+            db, book_id, current, len(current),
+            sum(shard.available for shard in current),
+            sum(shard.capacity for shard in current),
+        )
+    db.commit()
+
+def adjust(db: Session, book_id: int, operation: str, count: int = 1) -> bool:
+    """Borrow or return `count` copies of a sharded book.
+
+    Returns False when the book is not sharded so the caller can update the
+    book row instead.
+    """
+    table = models.InventoryShard
+    shards = db.execute(
+        select(table.shard, table.available, table.capacity).where(table.book_id == book_id)
+    ).all()
+    if not shards:
+        return False
+
+    if operation == "decrement":
+        condition, change = table.available >= count, table.available - count
+        candidates = [row for row in shards if row.available >= count]
+        room = sum(row.available for row in shards)
+    else:
+        condition, change = table.available + count <= table.capacity, table.available + count
+        candidates = [row for row in shards if row.available + count <= row.capacity]
+        room = sum(row.capacity - row.available for row in shards)
+
+    # Candidates come from an unlocked read, so the UPDATE re-checks the condition
+    # and the next shard is tried if a concurrent request got there first
+    random.shuffle(candidates)
+    for row in candidates:
+        result = db.execute(
+            update(table)
+            .where(table.book_id == book_id, table.shard == row.shard, condition)
+            .values(available=change)
+        )
+        if result.rowcount:
+            db.commit()
+            total = sum(shard.available for shard in shards) - count
+            if operation == "decrement" and row.available == count and total >= len(shards):
+                # This shard just ran dry while the others still hold plenty
+                rebalance(db, book_id)
+            return True
+
+    db.rollback()
+    if count > 1 and room >= count:
+        # No single shard can take the whole batch: spread it under the shard lock
+        _spread(db, book_id, operation, count)
+        return True
+    raise _out_of_room(operation)
+
+def _spread(db: Session, book_id: int, operation: str, count: int):
+    """Apply a batched update across as many shards as it needs."""
+    remaining = count
+    for row in _lock_shards(db, book_id):
+        if operation == "decrement":
+            step = min(remaining, row.available)
+            row.available -= step
+        else:
+            step = min(remaining, row.capacity - row.available)
+            row.available += step
+        remaining -= step
+        if not remaining:
+            break
+    if remaining:
+        # Concurrent updates used up the room seen before taking the lock
+        db.rollback()
+        raise _out_of_room(operation)
+    db.commit()
+
+def _out_of_room(operation: str) -> HTTPException:
+    if operation == "decrement":
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No available copies to borrow"
+        )
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Available copies cannot exceed total copies"
+    )
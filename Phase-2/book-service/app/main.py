@@ -1,18 +1,68 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from . import crud, models, schemas
+from . import bulk, crud, database, events, internal, metrics, models, openapi, query_budget, schemas, suggest, tracing
 from .database import engine, get_db
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="Smart Library System - Book Service",
     description="Microservice for managing library books",
     version="1.0.0",
 )
 
+# Pre-generated OpenAPI document (OPENAPI_FILE, see app/openapi.py)
+openapi.load(app)
+
+_tables_created = False
+
+def create_tables():
+    """Create missing tables, once per process (gunicorn workers inherit it from the master, see gunicorn.conf.py)."""
+    global _tables_created
+    if database.CREATE_TABLES and not _tables_created:
+        models.Base.metadata.create_all(bind=engine)
+    _tables_created = True
+
+# First database contact, before the worker accepts requests (see database.py)
+@app.on_event("startup")
+def prepare_database():
+    create_tables()
+    database.warm_up([engine])
+
+# Prometheus metrics: per-route latency, SQL statements per request and pool waits
+metrics.instrument_engine(engine)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
+
+# Distributed tracing: continue the caller's traceparent, with a span per SQL statement
+tracing.instrument_engine(engine)
+app.add_middleware(tracing.TracingMiddleware)
+
+# Per-route SQL statement budgets (QUERY_BUDGET_MODE=warn|raise)
+query_budget.instrument_engine(engine)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+# MessagePack API for the Loan Service (INTERNAL_TRANSPORT=binary), not proxied by nginx
+app.include_router(internal.router)
+
+# On PostgreSQL, relay availability NOTIFYs from every worker and replica to this worker's streams
+@app.on_event("startup")
+def start_availability_listener():
+    events.listener.start()
+
+@app.on_event("shutdown")
+def stop_availability_listener():
+    events.listener.stop()
+
+# Build this worker's typeahead index in the background and keep it current
+@app.on_event("startup")
+def start_suggest_indexer():
+    suggest.indexer.start()
+
+@app.on_event("shutdown")
+def stop_suggest_indexer():
+    suggest.indexer.stop()
+
 @app.get("/", tags=["Root"])
 def read_root():
     return {"message": "Welcome to the Book Service API"}
@@ -27,18 +77,77 @@ def read_books(
     search: Optional[str] = Query(None, description="Search for books by title, author, ISBN, or genre"),
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    facets: bool = Query(False, description="Also count the matching books per genre and top author"),
     db: Session = Depends(get_db)
 ):
     """Search for books by title, author, ISBN, or keyword, with pagination."""
-    return crud.get_books(db, search=search, skip=skip, limit=limit)
+    return crud.get_books(db, search=search, skip=skip, limit=limit, include_facets=facets)
+
+@app.post("/api/books/batch", response_model=schemas.BookBatch)
+def read_books_by_ids(lookup: schemas.BatchLookup, db: Session = Depends(get_db)):
+    """Look up several books by id in one query; unknown ids are left out."""
+    return {"books": crud.get_books_by_ids(db, lookup.ids)}
+
+@app.post("/api/books/bulk", response_model=schemas.BulkImportResult)
+async def bulk_import_books(
+    request: Request,
+    format: Optional[str] = Query(None, description="'csv' or 'ndjson'; defaults to the request Content-Type"),
+    batch_size: int = Query(1000, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """Stream a CSV/NDJSON catalog into the Book Service, skipping ISBNs that are already registered."""
+    fmt = bulk.detect_format(format, request.headers.get("content-type"))
+    return await bulk.import_books(db, request.stream(), fmt, batch_size)
+
+@app.get("/api/books/export")
+def export_books(format: str = Query("ndjson", pattern="^(csv|ndjson)$")):
+    """Stream the whole catalog as CSV or NDJSON."""
+    return StreamingResponse(
+        bulk.export_books(format),
+        media_type=bulk.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=books.{format}"}
+    )
+
+@app.get("/api/books/suggest", response_model=List[schemas.BookSuggestion])
+async def suggest_books(
+    q: str = Query(..., min_length=1, max_length=100, description="What the user has typed so far"),
+    limit: int = Query(8, ge=1, le=suggest.MAX_LIMIT),
+):
+    """Typeahead: books whose title, author or ISBN starts with q, from memory (no database query)."""
+    if not suggest.index.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Suggestion index is still being built",
+            headers={"Retry-After": "1"}
+        )
+    return suggest.index.suggest(q, limit)
+
+@app.get("/api/books/availability/stream")
+def stream_availability(ids: str = Query(..., description="Comma-separated IDs of the books to watch")):
+    """Server-Sent Events with the available copies of the given books, pushed as they change."""
+    try:
+        book_ids = list(dict.fromkeys(int(book_id) for book_id in ids.split(",") if book_id.strip()))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+    if not book_ids or len(book_ids) > events.MAX_BOOKS_PER_STREAM:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Watch between 1 and {events.MAX_BOOKS_PER_STREAM} books per stream"
+        )
+    return StreamingResponse(
+        events.stream(book_ids),
+        media_type="text/event-stream",
+        # Keep nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/books/{book_id}", response_model=schemas.Book)
 def read_book(book_id: int, db: Session = Depends(get_db)):
     """Retrieve detailed information about a specific book."""
-    db_book = crud.get_book(db, book_id=book_id)
-    if db_book is None:
+    book = crud.get_book_coalesced(db, book_id=book_id)
+    if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    return db_book
+    return book
 
 @app.put("/api/books/{book_id}", response_model=schemas.Book)
 def update_book(book_id: int, book: schemas.BookUpdate, db: Session = Depends(get_db)):
@@ -50,6 +159,16 @@ def update_book_availability(book_id: int, update: schemas.AvailabilityUpdate, d
     """Update a book's available copies (used internally by Loan Service during issue/return)."""
     return crud.update_availability(db=db, book_id=book_id, update=update)
 
+@app.get("/api/books/{book_id}/inventory", response_model=schemas.InventoryStatus)
+def read_book_inventory(book_id: int, db: Session = Depends(get_db)):
+    """Show whether a book's availability is sharded, and its shards."""
+    return crud.get_inventory(db, book_id=book_id)
+
+@app.put("/api/books/{book_id}/inventory", response_model=schemas.InventoryStatus)
+def update_book_inventory(book_id: int, update: schemas.InventoryUpdate, db: Session = Depends(get_db)):
+    """Spread a hot book's available copies over several shards (0 or 1 shards turns sharding off)."""
+    return crud.set_inventory(db, book_id=book_id, update=update)
+
 @app.delete("/api/books/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_book(book_id: int, db: Session = Depends(get_db)):
     """Remove a book from the catalog."""
@@ -0,0 +1,187 @@
+import contextvars
+import os
+import sys
+import time
+import types
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR and
+# /metrics aggregates them; without it the default in-process registry is used.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Phase-2/colocated.py runs all three services in one process. Metrics they all
+# define (same name, labels and buckets) are registered by the first service
+# loaded and shared by the others, so /metrics reports the whole process. They
+# are looked up by name in one table per process, kept as a module of its own so
+# every service's copy of this file sees the same one.
+_COLLECTORS = sys.modules.setdefault("library_metrics_collectors", types.ModuleType("library_metrics_collectors"))
+
+def _shared(metric_class, name: str, *args, **kwargs):
+    collector = getattr(_COLLECTORS, name, None)
+    if collector is None:
+        collector = metric_class(name, *args, **kwargs)
+        setattr(_COLLECTORS, name, collector)
+    return collector
+
+REQUEST_LATENCY = _shared(
+    Histogram,
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = _shared(
+    Gauge,
+    "http_requests_in_progress",
+    "Requests currently being served",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+DB_QUERY_LATENCY = _shared(
+    Histogram,
+    "db_query_duration_seconds",
+    "Duration of individual SQL statements",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+DB_QUERIES_PER_REQUEST = _shared(
+    Histogram,
+    "db_queries_per_request",
+    "Number of SQL statements executed while serving one request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+DB_TIME_PER_REQUEST = _shared(
+    Histogram,
+    "db_time_per_request_seconds",
+    "Total time spent in SQL statements while serving one request",
+    ["route"],
+)
+DB_POOL_CHECKOUT_WAIT = _shared(
+    Histogram,
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+SINGLEFLIGHT_CALLS = _shared(
+    Counter,
+    "singleflight_calls_total",
+    "Coalesced lookups; role=shared calls reused a result already in flight (hit ratio = shared / all)",
+    ["group", "role"],
+)
+AVAILABILITY_STREAMS = _shared(
+    Gauge,
+    "availability_streams",
+    "Connected availability Server-Sent Events streams",
+    multiprocess_mode="livesum",
+)
+FACET_CACHE_LOOKUPS = _shared(
+    Counter,
+    "facet_cache_lookups_total",
+    "Facet count lookups for catalog searches by result (hit or miss)",
+    ["result"],
+)
+SUGGEST_INDEX_KEYS = _shared(
+    Gauge,
+    "suggest_index_keys",
+    "Keys in the worker's typeahead prefix index",
+    multiprocess_mode="livemax",
+)
+
+class RequestStats:
+    """Per-request counters filled in by the SQLAlchemy hooks."""
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+_current_request = contextvars.ContextVar("metrics_request_stats", default=None)
+
+def current_request_stats():
+    return _current_request.get()
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+def instrument_engine(engine):
+    """Time every SQL statement and attribute it to the request being served."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_LATENCY.labels(operation).observe(elapsed)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    # Unmatched paths are grouped together to keep label cardinality bounded
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight requests and DB cost per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = [500]
+        started = time.perf_counter()
+        in_progress = REQUESTS_IN_PROGRESS.labels(scope["method"])
+        in_progress.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            _current_request.reset(token)
+            route = _route_template(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status_code[0])).observe(time.perf_counter() - started)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.db_seconds)
+
+def metrics_endpoint(request: Request) -> Response:
+    """Expose all metrics in the Prometheus text format."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
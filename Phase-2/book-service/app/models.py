@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
+from sqlalchemy import Column, Integer, String, DateTime, func, select
+from sqlalchemy.orm import column_property
 from .database import Base
 
 class Book(Base):
@@ -12,4 +13,22 @@ class Book(Base):
     copies = Column(Integer, default=1)
     available_copies = Column(Integer, default=1)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) 
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class InventoryShard(Base):
+    """A slice of a hot book's available copies (see inventory.py)."""
+    __tablename__ = "inventory_shards"
+
+    book_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    available = Column(Integer, nullable=False)
+    capacity = Column(Integer, nullable=False)
+
+# Available copies of a sharded book (NULL for books using the single row),
+# loaded with the book in the same query
+Book.sharded_available = column_property(
+    select(func.sum(InventoryShard.available))
+    .where(InventoryShard.book_id == Book.id)
+    .correlate_except(InventoryShard)
+    .scalar_subquery()
+)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, StrictInt, model_validator
 from typing import Optional, List
 import datetime
 
@@ -23,6 +23,7 @@ class BookUpdate(BaseModel):
 class AvailabilityUpdate(BaseModel):
     available_copies: int
     operation: str  # "increment" or "decrement"
+    count: int = Field(1, ge=1)  # copies returned or borrowed at once (batched updates)
 
 class Book(BookBase):
     id: int
@@ -34,8 +35,70 @@ class Book(BookBase):
     class Config:
         from_attributes = True
 
+    @model_validator(mode="before")
+    @classmethod
+    def use_sharded_availability(cls, data):
+        """Sharded (hot) books report the sum of their inventory shards."""
+        sharded = getattr(data, "sharded_available", None)
+        if sharded is None:
+            return data
+        values = {field: getattr(data, field) for field in cls.model_fields}
+        values["available_copies"] = sharded
+        return values
+
+class BatchLookup(BaseModel):
+    ids: List[StrictInt] = Field(..., max_length=1000)
+
+class BookBatch(BaseModel):
+    books: List[Book]  # unknown ids are left out
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class Facets(BaseModel):
+    genres: List[FacetCount]
+    authors: List[FacetCount]  # the most frequent ones
+
 class PaginatedBooks(BaseModel):
     books: List[Book]
     total: int
     page: int
-    per_page: int 
\ No newline at end of file
+    per_page: int
+    facets: Optional[Facets] = None
+
+class BookSuggestion(BaseModel):
+    id: int
+    title: str
+    author: str
+    isbn: str
+    match: str  # "title", "author" or "isbn"
+
+class BulkImportError(BaseModel):
+    line: int
+    detail: str
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    duplicates: int
+    invalid: int
+    errors: List[BulkImportError] = []
+
+class InventoryUpdate(BaseModel):
+    shards: int  # 0 or 1 folds the copies back into the book row
+
+class InventoryShard(BaseModel):
+    shard: int
+    available: int
+    capacity: int
+
+    class Config:
+        from_attributes = True
+
+class InventoryStatus(BaseModel):
+    book_id: int
+    copies: int
+    available_copies: int
+    sharded: bool
+    shards: List[InventoryShard]
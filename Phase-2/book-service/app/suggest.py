@@ -0,0 +1,259 @@
+import logging
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from . import metrics, models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Typeahead for the catalog search box, answered from memory without touching
+# the database. Every worker keeps a prefix index over titles, authors and
+# ISBNs: one sorted array of normalized keys (case-folded, accents and
+# punctuation dropped) with the book and the kind of match next to each key,
+# searched with bisect. A title or author is indexed from its start and from
+# the start of its next SUGGEST_MAX_WORDS words, so "pragmatic" finds "The
+# Pragmatic Programmer"; keys are cut to SUGGEST_MAX_KEY_LENGTH characters.
+# That bounds the index to a few keys of a few dozen bytes per book (about
+# 0.75 KB per book in all, see benchmarks/suggest.py).
+#
+# The index is built at startup by a background thread from a streamed scan
+# (suggestions answer 503 until it is ready). Catalog writes record which books
+# changed (events.catalog_changed); the thread re-reads them every
+# COALESCE_INTERVAL and patches the index in place, or merges a large batch
+# (a bulk import) into a fresh copy.
+MAX_WORDS = int(os.getenv("SUGGEST_MAX_WORDS") or 3)
+MAX_KEY_LENGTH = int(os.getenv("SUGGEST_MAX_KEY_LENGTH") or 24)
+# Keys looked at per query: suggestions come from the first matches in key order
+MAX_SCAN = 256
+MAX_LIMIT = 20
+COALESCE_INTERVAL = 0.25
+BUILD_BATCH_SIZE = 5000
+# Changed books above which an update copies the index instead of patching it
+PATCH_LIMIT = 256
+
+# Match kinds, best first
+TITLE, AUTHOR, ISBN, TITLE_WORD, AUTHOR_WORD = range(5)
+FIELDS = ("title", "author", "isbn", "title", "author")
+
+# A book's display fields are kept as one string (a third of the memory of a tuple)
+SEPARATOR = "\x1f"
+
+_WORD = re.compile(r"\w+")
+_NOT_ALNUM = re.compile(r"[\W_]+")
+
+def _fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def normalize(text: str) -> str:
+    """Words of text, case-folded and without accents, separated by single spaces."""
+    return " ".join(_WORD.findall(_fold(text)))
+
+def compact(text: str) -> str:
+    """text without separators, as ISBNs are indexed ("978-0-13" -> "978013")."""
+    return _NOT_ALNUM.sub("", _fold(text))
+
+class Entry(NamedTuple):
+    key: str
+    kind: int
+    book_id: int
+
+def entries(book_id: int, title: str, author: str, isbn: str) -> List[Entry]:
+    found = set()
+    for whole, word, text in ((TITLE, TITLE_WORD, title), (AUTHOR, AUTHOR_WORD, author)):
+        words = _WORD.findall(_fold(text or ""))
+        for start in range(min(len(words), MAX_WORDS + 1)):
+            found.add(Entry(" ".join(words[start:])[:MAX_KEY_LENGTH], whole if start == 0 else word, book_id))
+    key = compact(isbn or "")[:MAX_KEY_LENGTH]
+    if key:
+        found.add(Entry(key, ISBN, book_id))
+    return sorted(found)
+
+class PrefixIndex:
+    """Sorted keys with parallel book ids and match kinds, plus each book's display fields."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.keys: List[str] = []
+        self.book_ids = array("q")
+        self.kinds = bytearray()
+        # id -> title, author and isbn joined by SEPARATOR
+        self.books: Dict[int, str] = {}
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def load(self, rows: Iterable[Tuple[int, str, str, str]]):
+        """Replace the whole index with the given (id, title, author, isbn) rows."""
+        books = {}
+        found: List[Entry] = []
+        for book_id, title, author, isbn in rows:
+            books[book_id] = SEPARATOR.join((title, author, isbn))
+            found.extend(entries(book_id, title, author, isbn))
+        found.sort()
+        self._swap(found, books)
+        self.ready = True
+
+    def apply(self, rows: Iterable[Tuple[int, str, str, str]], book_ids: Set[int]):
+        """Re-index book_ids from their current rows; ids without a row were deleted."""
+        current = {row[0]: SEPARATOR.join(row[1:]) for row in rows}
+        changed = {book_id for book_id in book_ids if self.books.get(book_id) != current.get(book_id)}
+        if not changed:
+            return
+        old = [
+            entry for book_id in changed if book_id in self.books
+            for entry in entries(book_id, *self.books[book_id].split(SEPARATOR))
+        ]
+        new = sorted(
+            entry for book_id in changed if book_id in current
+            for entry in entries(book_id, *current[book_id].split(SEPARATOR))
+        )
+        if len(changed) > PATCH_LIMIT:
+            books = {book_id: fields for book_id, fields in self.books.items() if book_id not in changed}
+            books.update((book_id, current[book_id]) for book_id in changed if book_id in current)
+            kept = (
+                Entry(key, kind, book_id)
+                for key, kind, book_id in zip(self.keys, self.kinds, self.book_ids)
+                if book_id not in changed
+            )
+            self._swap(list(merge(kept, new)), books)
+            return
+        with self._lock:
+            for entry in old:
+                position = self._find(entry)
+                if position is not None:
+                    del self.keys[position], self.book_ids[position], self.kinds[position]
+            for entry in new:
+                position = bisect_left(self.keys, entry.key)
+                self.keys.insert(position, entry.key)
+                self.book_ids.insert(position, entry.book_id)
+                self.kinds.insert(position, entry.kind)
+            for book_id in changed:
+                if book_id in current:
+                    self.books[book_id] = current[book_id]
+                else:
+                    self.books.pop(book_id, None)
+        metrics.SUGGEST_INDEX_KEYS.set(len(self.keys))
+
+    def _find(self, entry: Entry) -> Optional[int]:
+        position = bisect_left(self.keys, entry.key)
+        while position < len(self.keys) and self.keys[position] == entry.key:
+            if self.book_ids[position] == entry.book_id and self.kinds[position] == entry.kind:
+                return position
+            position += 1
+        return None
+
+    def _swap(self, found: List[Entry], books: Dict[int, str]):
+        keys = [entry.key for entry in found]
+        book_ids = array("q", (entry.book_id for entry in found))
+        kinds = bytearray(entry.kind for entry in found)
+        with self._lock:
+            self.keys, self.book_ids, self.kinds, self.books = keys, book_ids, kinds, books
+        metrics.SUGGEST_INDEX_KEYS.set(len(keys))
+
+    def suggest(self, query: str, limit: int) -> List[dict]:
+        """Books with a title, author or ISBN starting with query, best kind of match first."""
+        best: Dict[int, Tuple[int, str]] = {}
+        prefixes = {normalize(query), compact(query)} - {""}
+        with self._lock:
+            for prefix in prefixes:
+                prefix = prefix[:MAX_KEY_LENGTH]
+                start = bisect_left(self.keys, prefix)
+                for position in range(start, min(start + MAX_SCAN, len(self.keys))):
+                    key = self.keys[position]
+                    if not key.startswith(prefix):
+                        break
+                    book_id, match = self.book_ids[position], (self.kinds[position], key)
+                    if match < best.get(book_id, (len(FIELDS), "")):
+                        best[book_id] = match
+            ranked = sorted(best.items(), key=lambda item: (item[1], item[0]))[:limit]
+            books = [self.books[book_id].split(SEPARATOR) for book_id, _ in ranked]
+        return [
+            {"id": book_id, "title": title, "author": author, "isbn": isbn, "match": FIELDS[kind]}
+            for (book_id, (kind, _)), (title, author, isbn) in zip(ranked, books)
+        ]
+
+index = PrefixIndex()
+
+def _columns():
+    book = models.Book
+    return select(book.id, book.title, book.author, book.isbn)
+
+class Indexer:
+    """Background thread building the index, then applying catalog changes to it."""
+
+    def __init__(self, prefix_index: PrefixIndex):
+        self.index = prefix_index
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._changed: Set[int] = set()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="suggest-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def mark_changed(self, book_ids: Iterable[int]):
+        """Safe to call from any thread; changes made before the build finishes are applied after it."""
+        with self._lock:
+            self._changed.update(book_ids)
+        self._wakeup.set()
+
+    def _build(self):
+        with SessionLocal() as db:
+            result = db.execute(_columns().execution_options(yield_per=BUILD_BATCH_SIZE))
+            self.index.load(tuple(row) for row in result)
+        logger.info("Suggestion index built: %d books, %d keys", len(self.index.books), len(self.index))
+
+    def _run(self):
+        while not self.index.ready and not self._stop.is_set():
+            try:
+                self._build()
+            except Exception:
+                logger.exception("Could not build the suggestion index; retrying")
+                self._stop.wait(5.0)
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            self._stop.wait(COALESCE_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                book_ids, self._changed = self._changed, set()
+            if not book_ids:
+                continue
+            try:
+                ids = sorted(book_ids)
+                with SessionLocal() as db:
+                    rows = [
+                        tuple(row)
+                        for start in range(0, len(ids), BUILD_BATCH_SIZE)
+                        for row in db.execute(_columns().where(models.Book.id.in_(ids[start:start + BUILD_BATCH_SIZE])))
+                    ]
+                self.index.apply(rows, book_ids)
+            except Exception:
+                logger.exception("Could not update the suggestion index for %d book(s)", len(book_ids))
+                self.mark_changed(book_ids)
+                self._stop.wait(1.0)
+
+indexer = Indexer(index)
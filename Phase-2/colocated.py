@@ -0,0 +1,90 @@
+"""Co-located deployment: the User, Book and Loan services in one process.
+
+Small installations do not need three deployments talking HTTP to each other.
+This module loads the three service packages side by side (each ships as a
+package called ``app``, so they are imported as ``user_service_app``,
+``book_service_app`` and ``loan_service_app``) and serves them as one ASGI app:
+requests are dispatched to a service by path prefix, and the Loan Service's
+clients call the User and Book services' CRUD functions directly
+(``INTERNAL_TRANSPORT=local``, see ``service_clients.colocate``).
+
+    cd Phase-2
+    uvicorn colocated:app --port 8000
+    WEB_CONCURRENCY=4 gunicorn colocated:app -k uvicorn.workers.UvicornWorker -w 4
+
+Each service keeps its own database (``USER_DATABASE_URL``, ``BOOK_DATABASE_URL``,
+``LOAN_DATABASE_URL``), tables, startup hooks and background workers. ``/``,
+``/docs`` and ``/openapi.json`` are the Loan Service's; ``/metrics`` covers the
+whole process. Running each service on its own with
+``uvicorn app.main:app`` (HTTP between services) is unchanged.
+"""
+import importlib
+import importlib.util
+import sys
+import traceback
+from pathlib import Path
+
+PHASE2_ROOT = Path(__file__).resolve().parent
+
+# Path prefixes owned by the User and Book services; everything else is the Loan Service's
+ROUTES = (
+    (("/api/users", "/internal/users"), "user-service"),
+    (("/api/books", "/internal/books"), "book-service"),
+)
+DEFAULT_SERVICE = "loan-service"
+
+def load(service: str):
+    """Import ``<service>/app`` as ``<service>_app`` and return the package."""
+    package = service.replace("-", "_") + "_app"
+    if package not in sys.modules:
+        app_dir = PHASE2_ROOT / service / "app"
+        spec = importlib.util.spec_from_file_location(
+            package, app_dir / "__init__.py", submodule_search_locations=[str(app_dir)]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[package] = module
+        spec.loader.exec_module(module)
+    importlib.import_module(f"{package}.main")
+    return sys.modules[package]
+
+class CoLocated:
+    """ASGI app dispatching by path prefix to the services' apps and running all their startup hooks."""
+
+    def __init__(self, services: dict, routes=ROUTES, default: str = DEFAULT_SERVICE):
+        self.apps = {name: package.main.app for name, package in services.items()}
+        self.routes = [(prefixes, self.apps[name]) for prefixes, name in routes]
+        self.default = self.apps[default]
+
+    def app_for(self, path: str):
+        for prefixes, app in self.routes:
+            if path.startswith(prefixes):
+                return app
+        return self.default
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        await self.app_for(scope["path"])(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        # Each app's own lifespan would only start when it receives a request,
+        # so the startup and shutdown hooks are run here for all of them
+        apps = list(self.apps.values())
+        await receive()
+        try:
+            for app in apps:
+                await app.router.startup()
+        except Exception:
+            await send({"type": "lifespan.startup.failed", "message": traceback.format_exc()})
+            return
+        await send({"type": "lifespan.startup.complete"})
+        await receive()
+        for app in reversed(apps):
+            await app.router.shutdown()
+        await send({"type": "lifespan.shutdown.complete"})
+
+services = {name: load(name) for name in ("user-service", "book-service", "loan-service")}
+services["loan-service"].service_clients.colocate(services["user-service"], services["book-service"])
+
+app = CoLocated(services)
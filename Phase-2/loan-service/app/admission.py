@@ -0,0 +1,166 @@
+import os
+import re
+import time
+from typing import List, Optional, Pattern, Set, Tuple
+
+from starlette.responses import JSONResponse
+
+from . import metrics
+
+# Admission control (ADMISSION_CONTROL=off to disable). Requests are sorted into
+# route classes, and each class may only have so many requests in flight in this
+# worker. A request over its class's limit gets a 503 with Retry-After at once.
+# It does not queue behind requests that are already slow, so when the database
+# or the Book Service slows down the worker keeps answering instead of timing
+# everything out together.
+#
+# The limits adapt every ADMISSION_WINDOW seconds (additive increase,
+# multiplicative decrease). The worker is congested when connections waited on
+# average more than ADMISSION_POOL_WAIT_TARGET seconds for the database pool, or
+# when a class's average latency went over its target. It then cuts by BACKOFF the
+# limit of the first class in shedding order that is still above its floor:
+# stats (loan histories, the overdue listing and recommendations) first, then
+# other reads, then writes (borrowing, returns, extensions, holds). A slow class
+# only sheds itself and the classes before it. A class that filled its limit in a
+# healthy window gets one more slot, up to its maximum, where every class starts.
+MODE = (os.getenv("ADMISSION_CONTROL") or "on").lower()
+WINDOW = float(os.getenv("ADMISSION_WINDOW") or 0.5)
+POOL_WAIT_TARGET = float(os.getenv("ADMISSION_POOL_WAIT_TARGET") or 0.1)
+BACKOFF = 0.75
+
+class RouteClass:
+    """A group of routes sharing an adaptive concurrency limit."""
+
+    def __init__(self, name: str, maximum: int, minimum: int, target: float, retry_after: int):
+        self.name = name
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target = target  # average latency in seconds above which the worker is congested
+        self.retry_after = retry_after
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.reset_window()
+        metrics.ADMISSION_LIMIT.labels(name).set(maximum)
+
+    def reset_window(self):
+        self.peak = self.in_flight
+        self.latency_sum = 0.0
+        self.completed = 0
+
+    def latency(self) -> float:
+        return self.latency_sum / self.completed if self.completed else 0.0
+
+# In shedding order
+CLASSES = [
+    RouteClass("stats", maximum=16, minimum=1, target=1.0, retry_after=5),
+    RouteClass("reads", maximum=32, minimum=2, target=0.5, retry_after=2),
+    RouteClass("writes", maximum=32, minimum=4, target=1.0, retry_after=1),
+]
+
+# (methods or None for any, path pattern, class name or None for no limit); first match wins,
+# and paths outside /api (/, /metrics, the docs) are never limited
+ROUTES: List[Tuple[Optional[Set[str]], Pattern, Optional[str]]] = [
+    # Long-lived Server-Sent Events streams
+    ({"GET"}, re.compile(r"/api/holds/events"), None),
+    ({"GET", "HEAD"}, re.compile(r"/api/(stats|loans/user/|loans/overdue|recommendations/)"), "stats"),
+    ({"GET", "HEAD"}, re.compile(r"/api/"), "reads"),
+    (None, re.compile(r"/api/"), "writes"),
+]
+
+class AdmissionController:
+    """Per-worker AIMD limits; only used from the event loop, so it needs no locks."""
+
+    def __init__(self, classes: List[RouteClass], window: float = WINDOW, pool_wait_target: float = POOL_WAIT_TARGET):
+        self.order = classes
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.window = window
+        self.pool_wait_target = pool_wait_target
+        self._window_end = time.monotonic() + window
+        self._pool_totals = metrics.POOL_WAITS.totals()
+
+    def classify(self, method: str, path: str) -> Optional[RouteClass]:
+        for methods, pattern, name in ROUTES:
+            if (methods is None or method in methods) and pattern.match(path):
+                return self.classes[name] if name else None
+        return None
+
+    def try_acquire(self, route_class: RouteClass) -> bool:
+        self._adjust()
+        if route_class.in_flight >= int(route_class.limit):
+            return False
+        route_class.in_flight += 1
+        route_class.peak = max(route_class.peak, route_class.in_flight)
+        return True
+
+    def release(self, route_class: RouteClass, seconds: float):
+        route_class.in_flight -= 1
+        route_class.latency_sum += seconds
+        route_class.completed += 1
+        self._adjust()
+
+    def _pool_wait(self) -> float:
+        """Average wait per pooled connection checkout since the last window."""
+        checkouts, seconds = metrics.POOL_WAITS.totals()
+        previous_checkouts, previous_seconds = self._pool_totals
+        self._pool_totals = (checkouts, seconds)
+        if checkouts == previous_checkouts:
+            return 0.0
+        return (seconds - previous_seconds) / (checkouts - previous_checkouts)
+
+    def _adjust(self):
+        now = time.monotonic()
+        if now < self._window_end:
+            return
+        self._window_end = now + self.window
+        if self._pool_wait() > self.pool_wait_target:
+            # The database is the bottleneck: every class may be shed, in order
+            sheddable = len(self.order)
+        else:
+            slow = [position for position, route_class in enumerate(self.order) if route_class.latency() > route_class.target]
+            sheddable = max(slow) + 1 if slow else 0
+        if sheddable:
+            for route_class in self.order[:sheddable]:
+                if route_class.limit > route_class.minimum:
+                    route_class.limit = max(route_class.minimum, route_class.limit * BACKOFF)
+                    break
+        else:
+            for route_class in self.order:
+                if route_class.peak >= int(route_class.limit):
+                    route_class.limit = min(route_class.maximum, route_class.limit + 1)
+        for route_class in self.order:
+            metrics.ADMISSION_LIMIT.labels(route_class.name).set(int(route_class.limit))
+            route_class.reset_window()
+
+controller = AdmissionController(CLASSES)
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting requests within their route class's limit and rejecting the rest with 503."""
+
+    def __init__(self, app, admission: AdmissionController = controller):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if MODE == "off" or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = self.admission.classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not self.admission.try_acquire(route_class):
+            metrics.ADMISSION_REJECTED.labels(route_class.name).inc()
+            response = JSONResponse(
+                {"detail": f"Loan Service is overloaded ({route_class.name} requests); retry later"},
+                status_code=503,
+                headers={"Retry-After": str(route_class.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(route_class, time.perf_counter() - started)
@@ -0,0 +1,110 @@
+import datetime
+import logging
+import os
+import threading
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import metrics, models, sharding
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# `loans` only keeps open loans and recent returns, so the hot queries (open
+# loans, overdue flagging, today's loans) and their indexes stay the size of
+# the current circulation. A background archiver in every worker moves loans
+# returned more than LOAN_ARCHIVE_AFTER_DAYS ago to `loans_archive` in batches,
+# one transaction each. The archive is insert-only (archived loans can no
+# longer change) with a single (user_id, issue_date) index, so it needs almost
+# no vacuuming however long the history grows. Reads that need the whole
+# history (a user's loans, a loan by id, recommendations) go through
+# `history()` or fall back to the archive. With sharding (app.sharding) every
+# shard archives its own loans.
+ENABLED = (os.getenv("LOAN_ARCHIVER") or "on").lower() != "off"
+ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS") or 90)
+INTERVAL = float(os.getenv("LOAN_ARCHIVE_INTERVAL") or 3600.0)
+BATCH_SIZE = int(os.getenv("LOAN_ARCHIVE_BATCH_SIZE") or 1000)
+
+COLUMNS = [column.name for column in models.Loan.__table__.columns]
+
+def history(name: str = "loan_history"):
+    """Every loan, live and archived, as a subquery with the columns of `loans`."""
+    live, archived = models.Loan.__table__, models.LoanArchive.__table__
+    return (
+        select(*(live.c[column] for column in COLUMNS))
+        .union_all(select(*(archived.c[column] for column in COLUMNS)))
+        .subquery(name)
+    )
+
+def archive_once(db: Session, shard: int = sharding.HOME) -> int:
+    """Move one batch of a shard's long-returned loans to its archive. Returns the loans moved."""
+    loan, on_shard = models.Loan, sharding.on_shard(shard)
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+    ids = db.scalars(
+        select(loan.id)
+        .where(loan.status == "RETURNED", loan.return_date < cutoff)
+        .order_by(loan.id)
+        .limit(BATCH_SIZE)
+        .with_for_update(skip_locked=True),
+        bind_arguments=on_shard,
+    ).all()
+    if not ids:
+        db.rollback()
+        return 0
+    try:
+        db.execute(
+            insert(models.LoanArchive).from_select(
+                COLUMNS, select(*(loan.__table__.c[column] for column in COLUMNS)).where(loan.id.in_(ids))
+            ),
+            bind_arguments=on_shard,
+        )
+    except IntegrityError:
+        # Another worker moved the same batch first (SQLite has no SKIP LOCKED)
+        db.rollback()
+        return 0
+    db.execute(
+        delete(loan).where(loan.id.in_(ids)),
+        execution_options={"synchronize_session": False},
+        bind_arguments=on_shard,
+    )
+    db.commit()
+    metrics.LOANS_ARCHIVED.inc(len(ids))
+    return len(ids)
+
+class Archiver:
+    """Background thread archiving long-returned loans every INTERVAL seconds."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="loan-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            backlog = False
+            for shard in sharding.SHARDS:
+                try:
+                    with SessionLocal() as db:
+                        backlog |= archive_once(db, shard) == BATCH_SIZE
+                except Exception:
+                    logger.exception("Loan archiving failed on shard %d", shard)
+            # A full batch means more is waiting: go again straight away
+            if not backlog:
+                self._stop.wait(INTERVAL)
+
+archiver = Archiver()
@@ -1,59 +1,69 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import DateTime, and_, case, func, select, update
 from fastapi import HTTPException, status
-from . import models, schemas
+from . import archive, holds, models, outbox, recommendations, schemas, sharding, tracing
+from .database import SessionLocal
 from .service_clients import UserServiceClient, BookServiceClient, ServiceError
 import datetime
+import heapq
+import itertools
+from typing import Optional
 
 user_client = UserServiceClient()
 book_client = BookServiceClient()
 
 def get_loan(db: Session, loan_id: int):
-    return db.query(models.Loan).filter(models.Loan.id == loan_id).first()
+    # Tried first on the shard that created the loan. Loans returned long ago
+    # have moved to the (read-only) archive
+    for shard in sharding.shards_for_loan(loan_id):
+        for model in (models.Loan, models.LoanArchive):
+            db_loan = db.get(model, loan_id, identity_token=shard)
+            if db_loan is not None:
+                return db_loan
+    return None
 
 def get_user_loans(db: Session, user_id: int, active_only: bool = False, skip: int = 0, limit: int = 100):
-    """Get all loans for a specific user."""
-    query = db.query(models.Loan).filter(models.Loan.user_id == user_id)
-    
+    """Get all loans for a specific user, archived ones included."""
     if active_only:
-        query = query.filter(models.Loan.status == "ACTIVE")
+        # Only returned loans are archived
+        loans_table = models.Loan.__table__
+        query = select(loans_table).where(loans_table.c.user_id == user_id, loans_table.c.status == "ACTIVE")
+    else:
+        loans_table = archive.history()
+        query = select(loans_table).where(loans_table.c.user_id == user_id)
     
-    total = query.count()
-    loans = query.order_by(models.Loan.issue_date.desc()).offset(skip).limit(limit).all()
+    shard = sharding.on_shard(sharding.shard_for_user(user_id))
+    total = db.scalar(select(func.count()).select_from(query.subquery()), bind_arguments=shard)
+    loans = db.execute(
+        query.order_by(loans_table.c.issue_date.desc()).offset(skip).limit(limit), bind_arguments=shard
+    ).all()
     
-    # Enrich with book details - in a real system this would be optimized
+    # Enrich with book details: one batched lookup for the page
+    books = book_client.get_books(loan.book_id for loan in loans)
     enriched_loans = []
     for loan in loans:
-        try:
-            book_details = book_client.get_book(loan.book_id)
-            loan_dict = {
-                "id": loan.id,
-                "book": {
-                    "id": book_details["id"],
-                    "title": book_details["title"],
-                    "author": book_details["author"]
-                },
-                "issue_date": loan.issue_date,
-                "due_date": loan.due_date,
-                "return_date": loan.return_date,
-                "status": loan.status
+        book_details = books.get(loan.book_id)
+        if book_details is not None:
+            book = {
+                "id": book_details["id"],
+                "title": book_details["title"],
+                "author": book_details["author"]
             }
-            enriched_loans.append(loan_dict)
-        except (HTTPException, ServiceError):
+        else:
             # If book service is down, still show basic loan info
-            loan_dict = {
-                "id": loan.id,
-                "book": {
-                    "id": loan.book_id,
-                    "title": "Book details unavailable",
-                    "author": "Author details unavailable"
-                },
-                "issue_date": loan.issue_date,
-                "due_date": loan.due_date,
-                "return_date": loan.return_date,
-                "status": loan.status
+            book = {
+                "id": loan.book_id,
+                "title": "Book details unavailable",
+                "author": "Author details unavailable"
             }
-            enriched_loans.append(loan_dict)
+        enriched_loans.append({
+            "id": loan.id,
+            "book": book,
+            "issue_date": loan.issue_date,
+            "due_date": loan.due_date,
+            "return_date": loan.return_date,
+            "status": loan.status
+        })
     
     return {
         "loans": enriched_loans,
@@ -111,21 +121,36 @@ def create_loan(db: Session, loan: schemas.LoanCreate):
             detail=f"User service unavailable: {e.message}"
         )
     
-    # Then check book exists and has available copies via Book Service
-    try:
-        book = book_client.get_book(loan.book_id)
-        if book["available_copies"] <= 0:
+    # A copy set aside for the user's ready hold was already taken from the Book Service.
+    # The hold is at home and the loan on the user's shard, so the hold is locked in a
+    # session of its own and only fulfilled once the loan has committed (see _fulfil_hold)
+    with SessionLocal() as home:
+        hold = holds.claim(home, loan.user_id, loan.book_id)
+        if hold is None:
+            home.rollback()
+        db_loan = _issue_loan(db, loan, hold)
+        if hold is not None:
+            _fulfil_hold(db, home, hold, db_loan)
+    return db_loan
+
+def _issue_loan(db: Session, loan: schemas.LoanCreate, hold: Optional[models.Hold]) -> models.Loan:
+    """Commit the loan, taking a copy from the Book Service unless a ready hold already set one aside."""
+    if hold is None:
+        # Then check book exists and has available copies via Book Service
+        try:
+            book = book_client.get_book(loan.book_id)
+            if book["available_copies"] <= 0:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Book with ID {loan.book_id} has no available copies; place a hold with POST /api/holds/"
+                )
+        except HTTPException as e:
+            raise e  # Pass through the 404 if book not found
+        except ServiceError as e:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Book with ID {loan.book_id} has no available copies"
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Book service unavailable: {e.message}"
             )
-    except HTTPException as e:
-        raise e  # Pass through the 404 if book not found
-    except ServiceError as e:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Book service unavailable: {e.message}"
-        )
     
     # Create the loan record
     db_loan = models.Loan(
@@ -135,23 +160,44 @@ def create_loan(db: Session, loan: schemas.LoanCreate):
         status="ACTIVE"
     )
     
-    # Update book availability
-    try:
-        book_client.update_availability(loan.book_id, "decrement")
-    except (HTTPException, ServiceError) as e:
-        # Roll back by not committing the loan
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Failed to update book availability: {str(e)}"
-        )
+    if hold is None:
+        # Update book availability
+        try:
+            book_client.update_availability(loan.book_id, "decrement")
+        except (HTTPException, ServiceError) as e:
+            # Roll back by not committing the loan
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Failed to update book availability: {str(e)}"
+            )
     
     # Commit the loan
-    db.add(db_loan)
-    db.commit()
-    db.refresh(db_loan)
+    with tracing.start_span("commit loan", root=False):
+        db.add(db_loan)
+        db.commit()
+        db.refresh(db_loan)
     
     return db_loan
 
+def _fulfil_hold(db: Session, home: Session, hold: models.Hold, db_loan: models.Loan):
+    """Mark a hold fulfilled by a loan that has committed, deleting the loan again if that fails.
+
+    The two are on different databases and cannot commit atomically. Until the hold commits,
+    its copy is still set aside for the user, so undoing the loan puts things back as they were.
+    """
+    hold.status = "FULFILLED"
+    hold.loan_id = db_loan.id
+    try:
+        home.commit()
+    except Exception:
+        home.rollback()
+        db.delete(db_loan)
+        db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to fulfil the hold; the loan was not issued"
+        )
+
 def return_book(db: Session, return_data: schemas.ReturnCreate):
     """Process a book return."""
     db_loan = get_loan(db, loan_id=return_data.loan_id)
@@ -168,15 +214,252 @@ def return_book(db: Session, return_data: schemas.ReturnCreate):
     db_loan.status = "RETURNED"
     db_loan.return_date = datetime.datetime.now(datetime.timezone.utc)
     
-    # Update book availability
-    try:
-        book_client.update_availability(db_loan.book_id, "increment")
-    except (HTTPException, ServiceError) as e:
-        # Continue with the return process even if book service fails
-        # This is a business decision - you might want to handle differently
-        pass
+    # The increment commits with the return, on the loan's shard. The outbox
+    # dispatcher gives the copy to the next hold in line, or hands it back to the
+    # Book Service
+    outbox.enqueue(db, db_loan.book_id, "increment", shard=sharding.shard_of(db_loan))
     
+    with tracing.start_span("commit return", root=False):
+        db.commit()
+        db.refresh(db_loan)
+    
+    return db_loan 
+
+OPEN_STATUSES = ("ACTIVE", "OVERDUE")
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _aware(value: datetime.datetime) -> datetime.datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+def _plus_days(db: Session, column, days: int):
+    """SQL expression for `column + days` (SQLite has no interval arithmetic)."""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.datetime(column, f"+{days} days", type_=DateTime)
+    return column + datetime.timedelta(days=days)
+
+def extend_loan(db: Session, loan_id: int, extend_info: schemas.LoanExtend):
+    """Push back the due date of one open loan."""
+    db_loan = get_loan(db, loan_id=loan_id)
+    if not db_loan:
+        raise HTTPException(status_code=404, detail="Loan not found")
+
+    if db_loan.status == "RETURNED":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot extend a returned loan"
+        )
+
+    original_due_date = db_loan.due_date
+    new_due_date = original_due_date + datetime.timedelta(days=extend_info.extension_days)
+    db_loan.due_date = new_due_date
+    db_loan.extensions_count = (db_loan.extensions_count or 0) + 1
+    # An overdue loan that is no longer past due becomes active again
+    if db_loan.status == "OVERDUE" and _aware(new_due_date) >= _utcnow():
+        db_loan.status = "ACTIVE"
     db.commit()
     db.refresh(db_loan)
-    
-    return db_loan 
\ No newline at end of file
+
+    return schemas.LoanExtended(
+        id=db_loan.id,
+        user_id=db_loan.user_id,
+        book_id=db_loan.book_id,
+        issue_date=db_loan.issue_date,
+        due_date=db_loan.due_date,
+        return_date=db_loan.return_date,
+        status=db_loan.status,
+        extensions_count=db_loan.extensions_count,
+        original_due_date=original_due_date,
+        extended_due_date=db_loan.due_date
+    )
+
+def extend_loans(db: Session, extend_info: schemas.LoanBulkExtend) -> int:
+    """Extend every matching open loan with one UPDATE. Returns the number of loans extended."""
+    new_due_date = _plus_days(db, models.Loan.due_date, extend_info.extension_days)
+    stmt = (
+        update(models.Loan)
+        .where(models.Loan.status.in_(OPEN_STATUSES))
+        .values(
+            due_date=new_due_date,
+            extensions_count=func.coalesce(models.Loan.extensions_count, 0) + 1,
+            status=case(
+                (and_(models.Loan.status == "OVERDUE", new_due_date >= _utcnow()), "ACTIVE"),
+                else_=models.Loan.status
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if extend_info.user_id is not None:
+        stmt = stmt.where(models.Loan.user_id == extend_info.user_id)
+    if extend_info.book_id is not None:
+        stmt = stmt.where(models.Loan.book_id == extend_info.book_id)
+    if extend_info.user_id is not None:
+        shards = [sharding.shard_for_user(extend_info.user_id)]
+    else:
+        shards = sharding.SHARDS
+    extended = sum(db.execute(stmt, bind_arguments=sharding.on_shard(shard)).rowcount for shard in shards)
+    db.commit()
+    return extended
+
+def _merged_page(db: Session, query, key, skip: int, limit: int):
+    """A page of an ordered query over every shard: each shard's first skip + limit rows, merged."""
+    if len(sharding.SHARDS) == 1:
+        return db.scalars(query.offset(skip).limit(limit), bind_arguments=sharding.on_shard(sharding.HOME)).all()
+    pages = [
+        db.scalars(query.limit(skip + limit), bind_arguments=sharding.on_shard(shard)).all()
+        for shard in sharding.SHARDS
+    ]
+    return list(itertools.islice(heapq.merge(*pages, key=key), skip, skip + limit))
+
+def get_overdue_loans(db: Session, skip: int = 0, limit: int = 100):
+    """Page through overdue loans, oldest due date first, with user and book details."""
+    now = _utcnow()
+    # Flag loans that have become overdue (one UPDATE over the status/due_date index
+    # on every shard)
+    flag = (
+        update(models.Loan)
+        .where(models.Loan.status == "ACTIVE", models.Loan.due_date < now)
+        .values(status="OVERDUE")
+        .execution_options(synchronize_session=False)
+    )
+    for shard in sharding.SHARDS:
+        db.execute(flag, bind_arguments=sharding.on_shard(shard))
+    db.commit()
+
+    query = select(models.Loan).where(models.Loan.status == "OVERDUE")
+    total = sum(
+        db.scalar(select(func.count()).select_from(query.subquery()), bind_arguments=sharding.on_shard(shard))
+        for shard in sharding.SHARDS
+    )
+    loans = _merged_page(db, query.order_by(models.Loan.due_date, models.Loan.id),
+                         lambda loan: (_aware(loan.due_date), loan.id), skip, limit)
+
+    users = user_client.get_users(loan.user_id for loan in loans)
+    books = book_client.get_books(loan.book_id for loan in loans)
+    overdue = []
+    for loan in loans:
+        user = users.get(loan.user_id) or {"id": loan.user_id, "name": "User details unavailable", "email": ""}
+        book = books.get(loan.book_id) or {"id": loan.book_id, "title": "Book details unavailable", "author": ""}
+        overdue.append({
+            "id": loan.id,
+            "user": {"id": user["id"], "name": user["name"], "email": user["email"]},
+            "book": {"id": book["id"], "title": book["title"], "author": book["author"]},
+            "issue_date": loan.issue_date,
+            "due_date": loan.due_date,
+            "days_overdue": max(0, (now - _aware(loan.due_date)).days)
+        })
+
+    return {
+        "loans": overdue,
+        "total": total
+    }
+
+def _hold_response(db: Session, db_hold: models.Hold) -> schemas.Hold:
+    result = schemas.Hold.model_validate(db_hold)
+    result.position = holds.position(db, db_hold)
+    return result
+
+def create_hold(db: Session, hold: schemas.HoldCreate):
+    """Queue a user for a book that has no copies left."""
+    try:
+        user = user_client.get_user(hold.user_id)
+    except ServiceError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"User service unavailable: {e.message}"
+        )
+    try:
+        book = book_client.get_book(hold.book_id)
+    except ServiceError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Book service unavailable: {e.message}"
+        )
+    if book["available_copies"] > 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Book with ID {hold.book_id} has available copies; borrow it instead"
+        )
+
+    existing = db.query(models.Hold).filter(
+        models.Hold.user_id == hold.user_id,
+        models.Hold.book_id == hold.book_id,
+        models.Hold.status.in_(holds.OPEN_STATUSES)
+    ).first()
+    if existing:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User already has a hold on this book"
+        )
+
+    db_hold = models.Hold(
+        user_id=hold.user_id,
+        book_id=hold.book_id,
+        priority=holds.priority_for(user.get("role")),
+        status="WAITING"
+    )
+    db.add(db_hold)
+    db.commit()
+    db.refresh(db_hold)
+    return _hold_response(db, db_hold)
+
+def get_hold(db: Session, hold_id: int):
+    db_hold = db.query(models.Hold).filter(models.Hold.id == hold_id).first()
+    if not db_hold:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    return _hold_response(db, db_hold)
+
+def get_user_holds(db: Session, user_id: int, open_only: bool = True):
+    query = db.query(models.Hold).filter(models.Hold.user_id == user_id)
+    if open_only:
+        query = query.filter(models.Hold.status.in_(holds.OPEN_STATUSES))
+    user_holds = query.order_by(models.Hold.id).all()
+    places = holds.positions(db, [db_hold for db_hold in user_holds if db_hold.status == "WAITING"])
+    results = []
+    for db_hold in user_holds:
+        result = schemas.Hold.model_validate(db_hold)
+        result.position = places.get(db_hold.id)
+        results.append(result)
+    return results
+
+def cancel_hold(db: Session, hold_id: int):
+    """Cancel a hold; a copy already set aside passes to the next hold or back to the Book Service."""
+    book_id = db.scalar(select(models.Hold.book_id).where(models.Hold.id == hold_id))
+    if book_id is None:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    # A waiting hold must not be cancelled while a return is allocating its copy
+    holds.lock_queue(db, book_id)
+    db_hold = db.query(models.Hold).filter(models.Hold.id == hold_id).with_for_update().first()
+    if db_hold.status not in holds.OPEN_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Hold is already {db_hold.status.lower()}"
+        )
+    if holds.release(db, db_hold, "CANCELLED"):
+        outbox.enqueue(db, db_hold.book_id, "increment")
+    db.commit()
+    db.refresh(db_hold)
+    return _hold_response(db, db_hold)
+
+def _recommended_books(rows):
+    books = book_client.get_books(book_id for book_id, _, _ in rows)
+    recommended = []
+    for book_id, score, readers in rows:
+        book = books.get(book_id) or {"id": book_id, "title": "Book details unavailable", "author": ""}
+        recommended.append({
+            "book": {"id": book["id"], "title": book["title"], "author": book["author"]},
+            "score": round(score, 6),
+            "readers": readers
+        })
+    return recommended
+
+def get_book_recommendations(db: Session, book_id: int, limit: int = 10):
+    """Books most often borrowed by this book's readers, from the precomputed top-k list."""
+    rows = recommendations.for_book(db, book_id, limit)
+    return _recommended_books([(row.recommended_book_id, row.score, row.readers) for row in rows])
+
+def get_user_recommendations(db: Session, user_id: int, limit: int = 10):
+    """Books borrowed by readers of the user's recent books that the user has not borrowed yet."""
+    return _recommended_books(recommendations.for_user(db, user_id, limit))
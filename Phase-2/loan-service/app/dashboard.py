@@ -0,0 +1,98 @@
+import asyncio
+import datetime
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models, sharding
+from .crud import book_client, user_client
+from .service_clients import ServiceError
+
+# Everything a user's dashboard shows, in one response (GET /api/dashboard/users/{id}):
+# profile, open loans with book details, and open and overdue loan counts. A
+# client on a slow link pays one round trip instead of one per loan. The profile
+# lookup runs concurrently with the loans query and the book lookup that follows
+# it, which is one batched call. If the
+# User or Book Service fails, the dashboard is still returned without those
+# details, and `partial` names the sections that are missing them.
+#
+# At most DASHBOARD_MAX_LOANS open loans are listed, earliest due date first; the
+# counts cover all of them.
+MAX_LOANS = int(os.getenv("DASHBOARD_MAX_LOANS") or 50)
+OPEN_STATUSES = ("ACTIVE", "OVERDUE")
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _aware(value: datetime.datetime) -> datetime.datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+def _profile(user_id: int) -> Optional[dict]:
+    """The user from the User Service; None if it cannot be reached (a missing user raises 404)."""
+    try:
+        return user_client.get_user(user_id)
+    except ServiceError:
+        return None
+
+def _open_loans(db: Session, user_id: int, now: datetime.datetime) -> Tuple[List[models.Loan], Dict[str, int], Dict[int, dict]]:
+    """The user's open loans (from their shard), their counts and the loaned books' details."""
+    loan = models.Loan
+    shard = sharding.on_shard(sharding.shard_for_user(user_id))
+    conditions = (loan.user_id == user_id, loan.status.in_(OPEN_STATUSES))
+    loans = db.scalars(
+        select(loan).where(*conditions).order_by(loan.due_date, loan.id).limit(MAX_LOANS), bind_arguments=shard
+    ).all()
+    if len(loans) < MAX_LOANS:
+        counts = {
+            "open_loans": len(loans),
+            "overdue_loans": sum(1 for db_loan in loans if _aware(db_loan.due_date) < now),
+        }
+    else:
+        total, overdue = db.execute(
+            select(func.count(), func.count(case((loan.due_date < now, 1)))).where(*conditions),
+            bind_arguments=shard,
+        ).one()
+        counts = {"open_loans": total, "overdue_loans": overdue}
+    books = book_client.get_books(db_loan.book_id for db_loan in loans)
+    return loans, counts, books
+
+async def get_dashboard(db: Session, user_id: int) -> Dict[str, Any]:
+    now = _utcnow()
+    # Both branches finish before any error is raised, so the session is not
+    # closed under a thread still using it
+    profile, loans = await asyncio.gather(
+        run_in_threadpool(_profile, user_id),
+        run_in_threadpool(_open_loans, db, user_id, now),
+        return_exceptions=True,
+    )
+    for result in (profile, loans):
+        if isinstance(result, BaseException):
+            raise result
+    loans, counts, books = loans
+
+    partial = []
+    if profile is None:
+        partial.append("user")
+    if any(db_loan.book_id not in books for db_loan in loans):
+        partial.append("books")
+    return {
+        "user": profile,
+        "loans": [
+            {
+                "id": db_loan.id,
+                "book_id": db_loan.book_id,
+                "book": books.get(db_loan.book_id),
+                "issue_date": db_loan.issue_date,
+                "due_date": db_loan.due_date,
+                "status": db_loan.status,
+                "days_overdue": max(0, (now - _aware(db_loan.due_date)).days),
+            }
+            for db_loan in loans
+        ],
+        "counts": counts,
+        "partial": partial,
+    }
@@ -1,8 +1,14 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterable
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from . import sharding
+from .metrics import TimedQueuePool
 
 load_dotenv()
 
@@ -11,8 +17,63 @@ DATABASE_URL3 = os.getenv("LOAN_DATABASE_URL") or "postgresql://neondb_owner:pOh
 if not DATABASE_URL3:
     raise ValueError("No LOAN_DATABASE_URL found in environment variables")
 
-engine = create_engine(DATABASE_URL3)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pools are per worker process, so the total connections opened by a
+# replica is WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW). When only a
+# connection budget is given (DB_MAX_CONNECTIONS), split it evenly across workers.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY") or 1)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW") or 10)
+if os.getenv("DB_POOL_SIZE"):
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE"))
+elif os.getenv("DB_MAX_CONNECTIONS"):
+    DB_POOL_SIZE = max(1, int(os.getenv("DB_MAX_CONNECTIONS")) // WEB_CONCURRENCY - DB_MAX_OVERFLOW)
+else:
+    DB_POOL_SIZE = 5
+
+def _create_engine(url: str):
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT") or 30),
+    )
+
+engine = _create_engine(DATABASE_URL3)
+# Loan shards (see app.sharding); every pool above is per shard
+shard_engines = {sharding.HOME: engine}
+shard_engines.update((shard, _create_engine(url)) for shard, url in enumerate(sharding.SHARD_URLS, start=1))
+# Nothing here connects: the database is first contacted when a worker starts
+# (main.py). It then creates missing tables, unless DB_CREATE_TABLES=off (the
+# schema is managed elsewhere, so new replicas skip those round trips), and opens
+# DB_WARMUP_CONNECTIONS pooled connections in parallel so its first requests do
+# not pay for the connection setup. The warm-up gives up after DB_WARMUP_TIMEOUT
+# seconds; connections not open by then are opened on first use.
+CREATE_TABLES = (os.getenv("DB_CREATE_TABLES") or "on").lower() != "off"
+WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS") or 0)
+WARMUP_TIMEOUT = float(os.getenv("DB_WARMUP_TIMEOUT") or 5.0)
+
+def _release(future):
+    if future.exception() is None:
+        future.result().close()
+
+def warm_up(engines: Iterable[Engine], connections: int = WARMUP_CONNECTIONS, timeout: float = WARMUP_TIMEOUT) -> int:
+    """Open up to `connections` pooled connections per engine at once. Returns how many opened in time."""
+    targets = [target for target in engines for _ in range(min(connections, target.pool.size()))]
+    if not targets:
+        return 0
+    executor = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="db-warm-up")
+    futures = [executor.submit(target.connect) for target in targets]
+    done, _ = wait(futures, timeout)
+    # All held until now so that each is a separate connection; late ones go back to the pool when they open
+    for future in futures:
+        future.add_done_callback(_release)
+    executor.shutdown(wait=False)
+    opened = sum(1 for future in done if future.exception() is None)
+    if opened < len(targets):
+        logging.getLogger(__name__).warning("Opened %d of %d database connections while warming up", opened, len(targets))
+    return opened
+
+SessionLocal = sessionmaker(class_=sharding.LoanSession, shards=shard_engines, autocommit=False, autoflush=False)
 Base = declarative_base()
 
 # Dependency to get the database session
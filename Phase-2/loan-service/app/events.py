@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import select as select_module
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+# Push notifications for Server-Sent Events streams. Events are published inside the
+# database transaction that caused them and delivered only if it commits. On
+# PostgreSQL they travel through NOTIFY, so a client connected to any worker or
+# replica receives them; elsewhere (SQLite in development) delivery stays within
+# the publishing process.
+CHANNEL = "library_events"
+
+# Seconds between keep-alive comments on idle streams (proxies drop silent connections)
+HEARTBEAT_INTERVAL = 15.0
+# Events buffered per slow subscriber before new ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class Subscriber:
+    __slots__ = ("topic", "loop", "queue")
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+def _offer(queue: asyncio.Queue, payload: Dict[str, Any]):
+    if not queue.full():
+        queue.put_nowait(payload)
+
+class Broker:
+    """Fans events out to the streams connected to this process, by topic."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+
+    def subscribe(self, topic: str) -> Subscriber:
+        subscriber = Subscriber(topic)
+        with self.lock:
+            self.subscribers.setdefault(topic, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            topic_subscribers = self.subscribers.get(subscriber.topic)
+            if topic_subscribers is not None:
+                topic_subscribers.discard(subscriber)
+                if not topic_subscribers:
+                    del self.subscribers[subscriber.topic]
+
+    def deliver(self, topic: str, payload: Dict[str, Any]):
+        """Hand an event to local subscribers; safe to call from any thread."""
+        with self.lock:
+            targets = list(self.subscribers.get(topic, ()))
+        for subscriber in targets:
+            subscriber.loop.call_soon_threadsafe(_offer, subscriber.queue, payload)
+
+broker = Broker()
+
+def _uses_notify(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+def publish(db: Session, topic: str, event_type: str, data: Dict[str, Any]):
+    """Publish an event when db's current transaction commits."""
+    message = {"topic": topic, "event": {"type": event_type, "data": data}}
+    if _uses_notify(db):
+        db.execute(select(func.pg_notify(CHANNEL, json.dumps(message, default=str))))
+    else:
+        db.info.setdefault("pending_events", []).append(message)
+
+@sa_event.listens_for(Session, "after_commit")
+def _deliver_pending(session):
+    for message in session.info.pop("pending_events", ()):
+        broker.deliver(message["topic"], message["event"])
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop("pending_events", None)
+
+def format_event(event_type: str, data: Dict[str, Any]) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream(topic: str, initial: Optional[Callable[[], Awaitable[List[tuple]]]] = None) -> AsyncIterator[str]:
+    """Server-Sent Events for one topic.
+
+    `initial` returns (type, data) events describing the current state. It runs
+    after subscribing, so nothing published in between is lost (at worst an
+    event is sent twice).
+    """
+    subscriber = broker.subscribe(topic)
+    try:
+        for event_type, data in (await initial() if initial else ()):
+            yield format_event(event_type, data)
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(payload["type"], payload["data"])
+    finally:
+        broker.unsubscribe(subscriber)
+
+class NotifyListener:
+    """Background thread relaying PostgreSQL NOTIFY messages to this process's broker."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if engine.dialect.name != "postgresql" or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                # A dedicated connection outside the pool, in autocommit mode for LISTEN
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}")
+                while not self._stop.is_set():
+                    if select_module.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        message = json.loads(dbapi_connection.notifies.pop(0).payload)
+                        broker.deliver(message["topic"], message["event"])
+            except Exception:
+                logger.exception("Event listener failed; reconnecting")
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+listener = NotifyListener()
@@ -0,0 +1,162 @@
+import datetime
+import os
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import events, models
+
+# Holds on a book are served by priority, then in arrival order. Users whose role
+# is listed in HOLD_PRIORITY_ROLES get priority 0, everyone else 1. The next hold
+# is the first entry of ix_holds_queue, so picking it is one index lookup however
+# long the queue is. Returned copies reach the queue through the outbox
+# dispatcher (app.outbox), since the loan can live on another shard; copies freed
+# by cancelled or expired holds pass on at once. Allocating a copy and cancelling
+# a hold first lock the book's queue (lock_queue), so copies are handed out
+# strictly in queue order.
+PRIORITY_ROLES = {
+    role.strip().lower() for role in (os.getenv("HOLD_PRIORITY_ROLES") or "faculty").split(",") if role.strip()
+}
+# How long a copy set aside for a ready hold waits to be borrowed
+PICKUP_HOURS = float(os.getenv("HOLD_PICKUP_HOURS") or 72)
+
+OPEN_STATUSES = ("WAITING", "READY")
+
+# First key of the PostgreSQL advisory locks taken by lock_queue (the second is the book id)
+QUEUE_LOCK_NAMESPACE = 0x686F6C64
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def priority_for(role: Optional[str]) -> int:
+    return 0 if (role or "").lower() in PRIORITY_ROLES else 1
+
+def user_topic(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def positions(db: Session, waiting: List[models.Hold]) -> Dict[int, int]:
+    """1-based places of waiting holds in their books' queues, in one query."""
+    if not waiting:
+        return {}
+    table = models.Hold
+    queue = (
+        select(
+            table.id,
+            func.row_number().over(partition_by=table.book_id, order_by=(table.priority, table.id)).label("place"),
+        )
+        .where(table.book_id.in_({hold.book_id for hold in waiting}), table.status == "WAITING")
+        .subquery()
+    )
+    return dict(db.execute(select(queue.c.id, queue.c.place).where(queue.c.id.in_([hold.id for hold in waiting]))).all())
+
+def position(db: Session, hold: models.Hold) -> Optional[int]:
+    """1-based place of a waiting hold in its book's queue."""
+    if hold.status != "WAITING":
+        return None
+    table = models.Hold
+    ahead = db.scalar(
+        select(func.count(table.id)).where(
+            table.book_id == hold.book_id,
+            table.status == "WAITING",
+            or_(table.priority < hold.priority, and_(table.priority == hold.priority, table.id < hold.id)),
+        )
+    )
+    return ahead + 1
+
+def ready_event(hold: models.Hold) -> Dict[str, Any]:
+    return {"hold_id": hold.id, "book_id": hold.book_id, "expires_at": hold.expires_at}
+
+def ready_events(db: Session, user_id: int) -> List[tuple]:
+    """hold_ready events for the user's current ready holds (sent when a stream connects)."""
+    table = models.Hold
+    ready = db.scalars(select(table).where(table.user_id == user_id, table.status == "READY").order_by(table.id))
+    return [("hold_ready", ready_event(hold)) for hold in ready]
+
+def lock_queue(db: Session, book_id: int):
+    """Lock a book's hold queue until the caller's transaction ends.
+
+    Taken before any waiting hold of the book changes, so the head of the queue
+    cannot be allocated or cancelled between being read and being updated. On
+    PostgreSQL it is an advisory lock on the book; SQLite, which ignores FOR
+    UPDATE, takes its write lock with a no-op UPDATE.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(QUEUE_LOCK_NAMESPACE, book_id)))
+        return
+    table = models.Hold
+    db.execute(
+        update(table).where(table.book_id == book_id, table.status == "WAITING").values(status=table.status),
+        execution_options={"synchronize_session": False},
+    )
+
+def allocate(db: Session, book_id: int, source: Optional[str] = None) -> bool:
+    """Set a copy aside for the book's next waiting hold, in the caller's transaction.
+
+    `source` names the outbox row the copy came from (see app.outbox). Returns
+    False when nobody is waiting, so the copy goes back to the Book Service.
+    """
+    table = models.Hold
+    # A concurrent return of the same book waits here until this one commits, then
+    # reads the queue after it (locking just the head row and skipping it when
+    # locked would hand the copy to the second in line)
+    lock_queue(db, book_id)
+    hold = db.scalars(
+        select(table)
+        .where(table.book_id == book_id, table.status == "WAITING")
+        .order_by(table.priority, table.id)
+        .limit(1)
+        .with_for_update()
+    ).first()
+    if hold is None:
+        return False
+    now = _utcnow()
+    hold.status = "READY"
+    hold.source = source
+    hold.ready_at = now
+    hold.expires_at = now + datetime.timedelta(hours=PICKUP_HOURS)
+    events.publish(db, user_topic(hold.user_id), "hold_ready", ready_event(hold))
+    return True
+
+def claim(db: Session, user_id: int, book_id: int) -> Optional[models.Hold]:
+    """The user's ready hold on a book, locked so the caller can fulfil it."""
+    table = models.Hold
+    return db.scalars(
+        select(table)
+        .where(table.user_id == user_id, table.book_id == book_id, table.status == "READY")
+        .limit(1)
+        .with_for_update()
+    ).first()
+
+def release(db: Session, hold: models.Hold, status: str) -> bool:
+    """Close an open hold. Returns True when its set-aside copy must go back to the Book Service."""
+    was_ready = hold.status == "READY"
+    hold.status = status
+    return was_ready and not allocate(db, hold.book_id)
+
+def expire_ready(db: Session, limit: int = 100) -> List[int]:
+    """Expire ready holds nobody picked up. Returns the book ids whose copies go back to the Book Service."""
+    table = models.Hold
+    now = _utcnow()
+    candidates = db.execute(
+        select(table.id, table.book_id)
+        .where(table.status == "READY", table.expires_at < now)
+        .order_by(table.expires_at)
+        .limit(limit)
+    ).all()
+    freed = []
+    for hold_id, book_id in candidates:
+        # Queue first, then the hold, in the order cancel_hold takes them; a hold
+        # claimed or cancelled meanwhile no longer matches
+        lock_queue(db, book_id)
+        hold = db.scalars(
+            select(table)
+            .where(table.id == hold_id, table.status == "READY", table.expires_at < now)
+            .with_for_update()
+        ).first()
+        if hold is None:
+            continue
+        events.publish(db, user_topic(hold.user_id), "hold_expired", {"hold_id": hold.id, "book_id": hold.book_id})
+        if release(db, hold, "EXPIRED"):
+            freed.append(hold.book_id)
+    return freed
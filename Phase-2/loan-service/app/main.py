@@ -1,19 +1,82 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
-from . import crud, models, schemas
-from .database import engine, get_db
+from . import admission, archive, crud, dashboard, database, events, holds, metrics, models, openapi, outbox, query_budget, recommendations, reshard, resilience, schemas, tracing
+from .database import SessionLocal, engine, get_db, shard_engines
 from .service_clients import ServiceError
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="Smart Library System - Loan Service",
     description="Microservice for managing library loans",
     version="1.0.0",
 )
 
+# Pre-generated OpenAPI document (OPENAPI_FILE, see app/openapi.py)
+openapi.load(app)
+
+_tables_created = False
+
+def create_tables():
+    """Create missing tables, once per process (gunicorn workers inherit it from the master, see gunicorn.conf.py).
+
+    Loan shards get the loans tables and their own id range.
+    """
+    global _tables_created
+    if database.CREATE_TABLES and not _tables_created:
+        models.Base.metadata.create_all(bind=engine)
+        reshard.prepare_shards()
+    _tables_created = True
+
+# First database contact, before the worker accepts requests (see database.py)
+@app.on_event("startup")
+def prepare_database():
+    create_tables()
+    database.warm_up(shard_engines.values())
+
+# Prometheus metrics: per-route latency, SQL statements and outbound calls per request
+for shard_engine in shard_engines.values():
+    metrics.instrument_engine(shard_engine)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
+
+# Distributed tracing: continue the caller's traceparent, with spans per SQL statement and outbound call
+for shard_engine in shard_engines.values():
+    tracing.instrument_engine(shard_engine)
+app.add_middleware(tracing.TracingMiddleware)
+
+# Per-route SQL statement and outbound call budgets (QUERY_BUDGET_MODE=warn|raise)
+for shard_engine in shard_engines.values():
+    query_budget.instrument_engine(shard_engine)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+# Deadline for outbound calls, from REQUEST_TIMEOUT or the caller's X-Request-Timeout header
+app.add_middleware(resilience.DeadlineMiddleware)
+
+# Adaptive concurrency limits per route class, shedding stats and history before
+# loans and returns (ADMISSION_CONTROL=off to disable). Outermost, so a rejected
+# request costs nothing else
+app.add_middleware(admission.AdmissionMiddleware)
+
+# Every worker drains the availability outbox filled by returns (OUTBOX_DISPATCHER=off to disable),
+# folds new loans into the recommendations (RECOMMENDATIONS_UPDATER=off to disable),
+# archives long-returned loans (LOAN_ARCHIVER=off to disable)
+# and, on PostgreSQL, relays NOTIFY events to its Server-Sent Events streams
+@app.on_event("startup")
+def start_background_workers():
+    outbox.dispatcher.start()
+    recommendations.updater.start()
+    archive.archiver.start()
+    events.listener.start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    outbox.dispatcher.stop()
+    recommendations.updater.stop()
+    archive.archiver.stop()
+    events.listener.stop()
+
 @app.get("/", tags=["Root"])
 def read_root():
     return {"message": "Welcome to the Loan Service API"}
@@ -60,6 +123,26 @@ def read_user_loans(
     """Get a user's loan history (active and returned books)."""
     return crud.get_user_loans(db, user_id=user_id, active_only=active_only, skip=skip, limit=limit)
 
+@app.get("/api/loans/overdue", response_model=schemas.PaginatedOverdueLoans)
+def read_overdue_loans(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """List overdue loans, oldest due date first."""
+    return crud.get_overdue_loans(db, skip=skip, limit=limit)
+
+@app.post("/api/loans/extend", response_model=schemas.LoanBulkExtendResult)
+def extend_loans(extend_info: schemas.LoanBulkExtend, db: Session = Depends(get_db)):
+    """Extend all open loans of a user and/or book (or every open loan) in one update."""
+    extended = crud.extend_loans(db, extend_info=extend_info)
+    return {"extended": extended, "extension_days": extend_info.extension_days}
+
+@app.put("/api/loans/{loan_id}/extend", response_model=schemas.LoanExtended)
+def extend_loan(loan_id: int, extend_info: schemas.LoanExtend, db: Session = Depends(get_db)):
+    """Extend the due date of a loan."""
+    return crud.extend_loan(db, loan_id=loan_id, extend_info=extend_info)
+
 @app.get("/api/loans/{loan_id}", response_model=schemas.LoanWithDetails)
 def read_loan(loan_id: int, db: Session = Depends(get_db)):
     """Get details of a specific loan."""
@@ -72,4 +155,58 @@ def read_loan(loan_id: int, db: Session = Depends(get_db)):
         raise HTTPException(
             status_code=e.status_code,
             detail=e.message
-        )
\ No newline at end of file
+        )
+
+@app.get("/api/dashboard/users/{user_id}", response_model=schemas.UserDashboard)
+async def read_user_dashboard(user_id: int, db: Session = Depends(get_db)):
+    """A user's profile, open loans with book details and loan counts in one response; sections
+    whose service failed are listed in `partial`."""
+    return await dashboard.get_dashboard(db, user_id=user_id)
+
+@app.post("/api/holds/", response_model=schemas.Hold, status_code=status.HTTP_201_CREATED)
+def create_hold(hold: schemas.HoldCreate, db: Session = Depends(get_db)):
+    """Join the queue for a book with no available copies."""
+    return crud.create_hold(db=db, hold=hold)
+
+@app.get("/api/holds/events")
+async def hold_events(user_id: int = Query(..., description="User whose hold notifications to stream")):
+    """Server-Sent Events stream of hold_ready / hold_expired notifications for a user."""
+    def ready_holds():
+        with SessionLocal() as db:
+            return holds.ready_events(db, user_id)
+
+    return StreamingResponse(
+        events.stream(holds.user_topic(user_id), initial=lambda: run_in_threadpool(ready_holds)),
+        media_type="text/event-stream",
+        # nginx must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/holds/user/{user_id}", response_model=List[schemas.Hold])
+def read_user_holds(
+    user_id: int,
+    open_only: bool = Query(True, description="If True, return only waiting and ready holds"),
+    db: Session = Depends(get_db)
+):
+    """List a user's holds with their queue positions."""
+    return crud.get_user_holds(db, user_id=user_id, open_only=open_only)
+
+@app.get("/api/holds/{hold_id}", response_model=schemas.Hold)
+def read_hold(hold_id: int, db: Session = Depends(get_db)):
+    """Get a hold and its position in the queue."""
+    return crud.get_hold(db, hold_id=hold_id)
+
+@app.delete("/api/holds/{hold_id}", response_model=schemas.Hold)
+def cancel_hold(hold_id: int, db: Session = Depends(get_db)):
+    """Cancel a hold; a copy already set aside for it goes to the next hold in line."""
+    return crud.cancel_hold(db, hold_id=hold_id)
+
+@app.get("/api/recommendations/books/{book_id}", response_model=List[schemas.RecommendedBook])
+def read_book_recommendations(book_id: int, limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+    """Readers of this book also borrowed..."""
+    return crud.get_book_recommendations(db, book_id=book_id, limit=limit)
+
+@app.get("/api/recommendations/users/{user_id}", response_model=List[schemas.RecommendedBook])
+def read_user_recommendations(user_id: int, limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+    """Books read by readers of the user's recent books, excluding ones the user has borrowed."""
+    return crud.get_user_recommendations(db, user_id=user_id, limit=limit)
@@ -1,6 +1,10 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
+import datetime
+from sqlalchemy import Column, Integer, Float, String, DateTime, Index, func
 from .database import Base
 
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
 class Loan(Base):
     __tablename__ = "loans"
 
@@ -11,4 +15,98 @@ class Loan(Base):
     due_date = Column(DateTime(timezone=True), nullable=False)
     return_date = Column(DateTime(timezone=True), nullable=True)
     status = Column(String, default="ACTIVE")  # ACTIVE, RETURNED, OVERDUE
-    extensions_count = Column(Integer, default=0) 
\ No newline at end of file
+    extensions_count = Column(Integer, default=0)
+
+    # Overdue listing and bulk extensions filter on status and range-scan due_date.
+    # Ids are never reused on SQLite either, since archived loans keep theirs
+    __table_args__ = (
+        Index("ix_loans_status_due_date", "status", "due_date"),
+        {"sqlite_autoincrement": True},
+    )
+
+class LoanArchive(Base):
+    """A loan returned long ago, moved out of `loans` by app.archive. Never updated."""
+    __tablename__ = "loans_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer)
+    book_id = Column(Integer)
+    issue_date = Column(DateTime(timezone=True))
+    due_date = Column(DateTime(timezone=True), nullable=False)
+    return_date = Column(DateTime(timezone=True), nullable=True)
+    status = Column(String)
+    extensions_count = Column(Integer)
+
+    # A user's history, newest first, is a range of this index
+    __table_args__ = (Index("ix_loans_archive_user_issue_date", "user_id", "issue_date"),)
+
+class Hold(Base):
+    """A user's place in the queue for a book with no copies left."""
+    __tablename__ = "holds"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    book_id = Column(Integer, nullable=False)
+    priority = Column(Integer, nullable=False)  # lower is served first (see app.holds)
+    status = Column(String, nullable=False, default="WAITING")  # WAITING, READY, FULFILLED, CANCELLED, EXPIRED
+    created_at = Column(DateTime(timezone=True), default=_utcnow, nullable=False)
+    ready_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    # "<shard>:<id>" of the outbox row whose returned copy it was given (see app.outbox)
+    source = Column(String, nullable=True, unique=True)
+    # The loan that fulfilled it; loans live on their user's shard (see app.crud.create_loan)
+    loan_id = Column(Integer, nullable=True)
+
+    # The next hold for a book is the first entry of this index: (book_id, 'WAITING', priority, id)
+    __table_args__ = (Index("ix_holds_queue", "book_id", "status", "priority", "id"),)
+
+class AvailabilityOutbox(Base):
+    """Book availability updates committed with a loan change, on the loan's shard, and sent later by app.outbox."""
+    __tablename__ = "availability_outbox"
+    # Rows are named by id in holds.source, so SQLite must not reuse the ids either
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # increment, decrement
+    created_at = Column(DateTime(timezone=True), default=_utcnow, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), default=_utcnow, nullable=False, index=True)
+    last_error = Column(String, nullable=True)
+
+class BookPair(Base):
+    """Item-item co-occurrence of the loan history (see app.recommendations).
+
+    readers counts the users who borrowed both books; the diagonal
+    (book_id == other_book_id) counts the book's readers.
+    """
+    __tablename__ = "book_pairs"
+
+    book_id = Column(Integer, primary_key=True)
+    other_book_id = Column(Integer, primary_key=True)
+    readers = Column(Integer, nullable=False)
+
+class BookRecommendation(Base):
+    """A book's precomputed top-k "readers also borrowed" list."""
+    __tablename__ = "book_recommendations"
+
+    book_id = Column(Integer, primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    recommended_book_id = Column(Integer, nullable=False)
+    readers = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+
+class RecommendationCursor(Base):
+    """The last loan folded into book_pairs (a row per loan shard, id shard + 1)."""
+    __tablename__ = "recommendation_cursor"
+
+    id = Column(Integer, primary_key=True)
+    last_loan_id = Column(Integer, nullable=False)
+
+class RecommendationGap(Base):
+    """A loan id below a recommendation cursor that was not committed when the cursor passed it."""
+    __tablename__ = "recommendation_gaps"
+
+    cursor_id = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, primary_key=True)
+    noticed_at = Column(DateTime(timezone=True), default=_utcnow, nullable=False)
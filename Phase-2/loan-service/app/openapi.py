@@ -0,0 +1,46 @@
+"""The service's OpenAPI document, generated ahead of time.
+
+FastAPI builds the document the first time /docs or /openapi.json is requested.
+The Docker image generates it at build time instead:
+
+    python -m app.openapi openapi.json
+
+With OPENAPI_FILE pointing at that file, the service serves it as is. Without
+OPENAPI_FILE, or if the file is missing, the document is built on first use
+as before.
+"""
+import json
+import logging
+import os
+import sys
+
+from fastapi import FastAPI
+
+logger = logging.getLogger(__name__)
+
+OPENAPI_FILE = os.getenv("OPENAPI_FILE")
+
+def load(app: FastAPI):
+    """Serve OPENAPI_FILE as app's OpenAPI document, if given."""
+    if not OPENAPI_FILE:
+        return
+    try:
+        with open(OPENAPI_FILE) as document:
+            app.openapi_schema = json.load(document)
+    except OSError:
+        logger.warning("OPENAPI_FILE %s not found; building the OpenAPI document on first use", OPENAPI_FILE)
+
+def main():
+    from .main import app
+
+    # Always from the routes, never from a previously generated file
+    app.openapi_schema = None
+    document = json.dumps(app.openapi())
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as output:
+            output.write(document)
+    else:
+        print(document)
+
+if __name__ == "__main__":
+    main()
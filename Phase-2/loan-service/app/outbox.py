@@ -0,0 +1,183 @@
+import datetime
+import logging
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import holds, metrics, models, sharding
+from .database import SessionLocal
+from .service_clients import BookServiceClient, ServiceError
+
+logger = logging.getLogger(__name__)
+
+# Returns commit an availability_outbox row with the loan instead of calling the
+# Book Service, on the loan's shard (app.sharding), so the two always commit
+# together. A background dispatcher in every worker drains every shard's outbox.
+# It claims due rows (SKIP LOCKED, so workers and replicas never send the same
+# row), and first gives returned copies to the books' waiting holds, which live
+# on the home database: the hold is committed there with the row's "<shard>:<id>"
+# in holds.source, and the row is deleted afterwards. A row found already given
+# away (the deletion failed) is just deleted. The rest are folded into one update
+# per book and operation, and deleted once the Book Service accepts the call. An
+# update the Book Service refuses (400/404) is sent again row by row, and only
+# the rows refused on their own are dropped. Delivery is at least once: a call
+# that succeeds but times out on the way back is sent again.
+ENABLED = (os.getenv("OUTBOX_DISPATCHER") or "on").lower() != "off"
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL") or 1.0)
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE") or 500)
+MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF") or 60.0)
+
+book_client = BookServiceClient()
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _aware(value: datetime.datetime) -> datetime.datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+def enqueue(db: Session, book_id: int, operation: str, shard: int = sharding.HOME):
+    """Queue an availability update on a shard; it becomes visible to the dispatcher when the caller commits."""
+    db.execute(
+        insert(models.AvailabilityOutbox).values(book_id=book_id, operation=operation),
+        bind_arguments=sharding.on_shard(shard),
+    )
+
+def _retry_at(attempts: int) -> datetime.datetime:
+    return _utcnow() + datetime.timedelta(seconds=min(MAX_BACKOFF, POLL_INTERVAL * 2 ** attempts))
+
+def dispatch_once(db: Session) -> int:
+    """Send one batch of due updates per shard, one call per book and operation. Returns the rows claimed."""
+    return sum(_dispatch_shard(db, shard) for shard in sharding.SHARDS)
+
+def _dispatch_shard(db: Session, shard: int) -> int:
+    table = models.AvailabilityOutbox
+    rows = db.scalars(
+        select(table)
+        .where(table.next_attempt_at <= _utcnow())
+        .order_by(table.id)
+        .limit(BATCH_SIZE)
+        .with_for_update(skip_locked=True),
+        bind_arguments=sharding.on_shard(shard),
+    ).all()
+
+    held = _give_to_holds(shard, [row for row in rows if row.operation == "increment"])
+    if held:
+        _delete(db, held, "held", shard)
+    held_ids = {row.id for row in held}
+    groups: Dict[Tuple[int, str], List[models.AvailabilityOutbox]] = {}
+    for row in rows:
+        if row.id not in held_ids:
+            groups.setdefault((row.book_id, row.operation), []).append(row)
+
+    for (book_id, operation), group in groups.items():
+        _dispatch(db, book_id, operation, group, shard)
+    db.commit()
+    return len(rows)
+
+def _give_to_holds(shard: int, increments: List[models.AvailabilityOutbox]) -> List[models.AvailabilityOutbox]:
+    """Give returned copies to waiting holds, committed on the home database before the
+    caller deletes the rows. Returns the rows given away, now or by an earlier attempt."""
+    if not increments:
+        return []
+    sources = {f"{shard}:{row.id}": row for row in increments}
+    # A separate session, so the holds commit while the rows stay claimed
+    with SessionLocal() as home:
+        given = set(home.scalars(select(models.Hold.source).where(models.Hold.source.in_(sources))).all())
+        for source, row in sources.items():
+            if source not in given and holds.allocate(home, row.book_id, source=source):
+                given.add(source)
+        home.commit()
+    return [sources[source] for source in given]
+
+def _dispatch(db: Session, book_id: int, operation: str, rows: List[models.AvailabilityOutbox], shard: int):
+    """Send rows as one update. If the Book Service refuses it, send them one at a time,
+    so only the rows it refuses are dropped."""
+    try:
+        book_client.update_availability(book_id, operation, count=len(rows))
+    except HTTPException as e:
+        # A missing book fails every row the same way
+        if len(rows) > 1 and e.status_code != 404:
+            for row in rows:
+                _dispatch(db, book_id, operation, [row], shard)
+            return
+        # 400/404 will not succeed later either (e.g. the book was deleted)
+        logger.warning("Dropping %d outbox %s(s) for book %d: %s", len(rows), operation, book_id, e.detail)
+        _delete(db, rows, "dropped", shard)
+    except ServiceError as e:
+        for row in rows:
+            row.attempts += 1
+            row.next_attempt_at = _retry_at(row.attempts)
+            row.last_error = e.message[:500]
+        metrics.OUTBOX_DISPATCHED.labels("retry").inc(len(rows))
+    else:
+        _delete(db, rows, "sent", shard)
+
+def _delete(db: Session, rows: List[models.AvailabilityOutbox], result: str, shard: int):
+    table = models.AvailabilityOutbox
+    db.execute(
+        delete(table).where(table.id.in_([row.id for row in rows])),
+        execution_options={"synchronize_session": False},
+        bind_arguments=sharding.on_shard(shard),
+    )
+    metrics.OUTBOX_DISPATCHED.labels(result).inc(len(rows))
+
+def expire_holds(db: Session):
+    """Expire ready holds nobody collected; their copies pass on or go back to the Book Service."""
+    for book_id in holds.expire_ready(db):
+        enqueue(db, book_id, "increment")
+    db.commit()
+
+def observe_backlog(db: Session):
+    table = models.AvailabilityOutbox
+    depth, oldest = 0, None
+    for shard in sharding.SHARDS:
+        count, created_at = db.execute(
+            select(func.count(table.id), func.min(table.created_at)), bind_arguments=sharding.on_shard(shard)
+        ).one()
+        depth += count
+        if created_at is not None:
+            oldest = min(oldest, _aware(created_at)) if oldest else _aware(created_at)
+    metrics.OUTBOX_DEPTH.set(depth)
+    metrics.OUTBOX_LAG.set((_utcnow() - oldest).total_seconds() if oldest else 0)
+
+class Dispatcher:
+    """Background thread draining the outbox (and expiring uncollected holds) every POLL_INTERVAL seconds."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = 0
+            try:
+                with SessionLocal() as db:
+                    expire_holds(db)
+                    claimed = dispatch_once(db)
+                    observe_backlog(db)
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+            # A full batch means more is waiting: go again straight away
+            if claimed < BATCH_SIZE:
+                self._stop.wait(POLL_INTERVAL)
+
+dispatcher = Dispatcher()
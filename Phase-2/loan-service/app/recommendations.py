@@ -0,0 +1,392 @@
+import datetime
+import heapq
+import logging
+import math
+import os
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, desc, exists, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from . import archive, models, sharding
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# "Readers also borrowed". book_pairs holds the item-item co-occurrence matrix of
+# the loan history: entry (a, b) counts the users who borrowed both books and the
+# diagonal (a, a) counts a's readers. A full rebuild computes it in the database
+# with one GROUP BY over the distinct (user, book) pairs. After that, a background
+# updater in every worker folds in new loans every RECOMMENDATIONS_INTERVAL
+# seconds and re-ranks only the books they touched. Requests never compute
+# anything: they read the top-k lists kept in book_recommendations, ranked by
+# cosine similarity (a, b) / sqrt((a, a) * (b, b)) so that merely popular books
+# do not top every list. A new reader of b also shifts b's score in the lists of
+# books not re-ranked in that run; a periodic `python -m app.recommendations`
+# (full rebuild) evens that out. Loan shards (app.sharding) have a cursor each
+# and are folded in one at a time: a user's loans all live on one shard, so the
+# shards' counts simply add up.
+ENABLED = (os.getenv("RECOMMENDATIONS_UPDATER") or "on").lower() != "off"
+INTERVAL = float(os.getenv("RECOMMENDATIONS_INTERVAL") or 30.0)
+TOP_K = int(os.getenv("RECOMMENDATIONS_TOP_K") or 20)
+# Books borrowed together by fewer readers are not recommended: too little
+# evidence, and the list would reveal what a single reader borrowed
+MIN_READERS = int(os.getenv("RECOMMENDATIONS_MIN_READERS") or 2)
+
+# New loans folded in per run
+BATCH_SIZE = 5000
+# Ids a cursor passes that are not committed yet (a transaction still open, or
+# rolled back) are kept in recommendation_gaps, and each run folds in those that
+# have committed since. Gaps are forgotten after GAP_SECONDS: a loan committing
+# later than that is only counted by the next full rebuild. A jump of more than
+# MAX_GAP ids is the step between id ranges (app.sharding), not open transactions.
+GAP_SECONDS = 600.0
+MAX_GAP = 1000
+# Books re-ranked per query
+RANK_CHUNK = 500
+# A user's recommendations merge the lists of their most recently borrowed books
+USER_HISTORY = 20
+
+def _cursor_id(shard: int) -> int:
+    # One cursor per loan shard (app.sharding); loan ids are per shard
+    return shard + 1
+
+def _next_batch(db: Session, shard: int, after: int) -> List[int]:
+    """Ids of the shard's next batch of loans after `after`, in order."""
+    loan = models.Loan
+    return db.scalars(
+        select(loan.id).where(loan.id > after).order_by(loan.id).limit(BATCH_SIZE),
+        bind_arguments=sharding.on_shard(shard),
+    ).all()
+
+def _holes(ids: List[int], after: int) -> List[int]:
+    """Ids missing between `after` and the sorted `ids`, leaving out jumps between id ranges."""
+    holes, previous = [], after
+    for loan_id in ids:
+        if loan_id - previous <= MAX_GAP:
+            holes.extend(range(previous + 1, loan_id))
+        previous = loan_id
+    return holes
+
+def _committed_gaps(db: Session, shard: int) -> Tuple[List[int], List[int]]:
+    """(gaps committed since, gaps still open) of the shard; forgets both the
+    committed ones, which the caller folds in, and those older than GAP_SECONDS."""
+    table = models.RecommendationGap
+    cursor_id = _cursor_id(shard)
+    gaps = db.scalars(select(table.loan_id).where(table.cursor_id == cursor_id)).all()
+    if not gaps:
+        return [], []
+    loan = models.Loan
+    committed = db.scalars(select(loan.id).where(loan.id.in_(gaps)), bind_arguments=sharding.on_shard(shard)).all()
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=GAP_SECONDS)
+    db.execute(
+        delete(table).where(table.cursor_id == cursor_id, or_(table.loan_id.in_(committed), table.noticed_at < cutoff))
+    )
+    return committed, sorted(set(gaps) - set(committed))
+
+def _add_gaps(db: Session, shard: int, loan_ids: Iterable[int]):
+    rows = [{"cursor_id": _cursor_id(shard), "loan_id": loan_id} for loan_id in loan_ids]
+    if rows:
+        db.execute(insert(models.RecommendationGap.__table__), rows)
+
+def _advance(db: Session, shard: int, expected: int, upto: int) -> bool:
+    """Move the shard's cursor from `expected` to `upto`; False if another worker moved it first.
+
+    The UPDATE also locks the cursor row until commit, so runs never overlap.
+    """
+    table = models.RecommendationCursor
+    result = db.execute(
+        update(table)
+        .where(table.id == _cursor_id(shard), table.last_loan_id == expected)
+        .values(last_loan_id=upto)
+    )
+    return result.rowcount == 1
+
+def _folded_before(other, new, after: int, late: List[int]):
+    """Condition: loan `other` counts as folded in before loan `new`.
+
+    Loans are folded in id order, except that a late one (a gap that has
+    committed since) comes after every loan folded while it was missing.
+    """
+    if not late:
+        return other.id < new.id
+    return or_(other.id < new.id, and_(new.id.in_(late), other.id <= after, other.id.not_in(late)))
+
+def _new_pairs(db: Session, shard: int, after: int, upto: int, late: List[int]) -> Counter:
+    """Co-occurrence increments for loans after..upto and the late ones; only a user's first loan of a book counts."""
+    # New loans are never archived yet; the loans they pair with may be
+    new, earlier, prior = aliased(models.Loan), archive.history("earlier"), archive.history("prior")
+    first = (
+        select(new.id, new.user_id, new.book_id)
+        .where(
+            or_(and_(new.id > after, new.id <= upto), new.id.in_(late)),
+            ~exists().where(
+                earlier.c.user_id == new.user_id,
+                earlier.c.book_id == new.book_id,
+                _folded_before(earlier.c, new, after, late),
+            ),
+        )
+        .subquery()
+    )
+    on_shard = sharding.on_shard(shard)
+    deltas: Counter = Counter()
+    rows = db.execute(select(first.c.book_id, func.count()).group_by(first.c.book_id), bind_arguments=on_shard)
+    for book_id, readers in rows:
+        deltas[book_id, book_id] += readers
+
+    # Each new first loan pairs with every other book the user borrowed before it
+    together = (
+        select(first.c.id, first.c.book_id, prior.c.book_id.label("other_book_id"))
+        .select_from(first)
+        .join(prior, and_(
+            prior.c.user_id == first.c.user_id,
+            _folded_before(prior.c, first.c, after, late),
+            prior.c.book_id != first.c.book_id,
+        ))
+        .distinct()
+        .subquery()
+    )
+    rows = db.execute(
+        select(together.c.book_id, together.c.other_book_id, func.count())
+        .group_by(together.c.book_id, together.c.other_book_id),
+        bind_arguments=on_shard,
+    )
+    for book_id, other_book_id, readers in rows:
+        deltas[book_id, other_book_id] += readers
+        deltas[other_book_id, book_id] += readers
+    return deltas
+
+def _add_pairs(db: Session, deltas: Counter):
+    table = models.BookPair
+    rows = [
+        {"book_id": book_id, "other_book_id": other_book_id, "readers": readers}
+        for (book_id, other_book_id), readers in deltas.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        # Core insert of the table: the ORM's bulk insert does not support sharded sessions
+        stmt = dialect_insert(table.__table__)
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[table.book_id, table.other_book_id],
+                set_={"readers": table.readers + stmt.excluded.readers},
+            ),
+            rows,
+        )
+    else:
+        for row in rows:
+            result = db.execute(
+                update(table)
+                .where(table.book_id == row["book_id"], table.other_book_id == row["other_book_id"])
+                .values(readers=table.readers + row["readers"])
+            )
+            if not result.rowcount:
+                db.execute(insert(table).values(**row))
+
+def rank(db: Session, book_ids: Iterable[int]):
+    """Recompute the top-k lists of the given books from book_pairs."""
+    pair, own, theirs = models.BookPair, aliased(models.BookPair), aliased(models.BookPair)
+    book_ids = sorted(set(book_ids))
+    for start in range(0, len(book_ids), RANK_CHUNK):
+        chunk = book_ids[start:start + RANK_CHUNK]
+        rows = db.execute(
+            select(pair.book_id, pair.other_book_id, pair.readers, own.readers, theirs.readers)
+            .join(own, and_(own.book_id == pair.book_id, own.other_book_id == pair.book_id))
+            .join(theirs, and_(theirs.book_id == pair.other_book_id, theirs.other_book_id == pair.other_book_id))
+            .where(pair.book_id.in_(chunk), pair.other_book_id != pair.book_id, pair.readers >= MIN_READERS)
+        )
+        candidates = defaultdict(list)
+        for book_id, other_book_id, readers, own_readers, their_readers in rows:
+            score = readers / math.sqrt(own_readers * their_readers)
+            candidates[book_id].append((score, readers, -other_book_id))
+
+        db.execute(delete(models.BookRecommendation).where(models.BookRecommendation.book_id.in_(chunk)))
+        ranked = [
+            {
+                "book_id": book_id,
+                "rank": position,
+                "recommended_book_id": -negated_id,
+                "readers": readers,
+                "score": round(score, 6),
+            }
+            for book_id, scored in candidates.items()
+            for position, (score, readers, negated_id) in enumerate(heapq.nlargest(TOP_K, scored))
+        ]
+        if ranked:
+            db.execute(insert(models.BookRecommendation.__table__), ranked)
+
+def update_once(db: Session) -> int:
+    """Fold the next batch of loans of every shard, and its late loans, into book_pairs. Returns the books re-ranked."""
+    table = models.RecommendationCursor
+    cursors = dict(db.execute(select(table.id, table.last_loan_id)).all())
+    if any(_cursor_id(shard) not in cursors for shard in sharding.SHARDS):
+        return rebuild(db)
+    with_gaps = set(db.scalars(select(models.RecommendationGap.cursor_id).distinct()).all())
+    ranked = 0
+    for shard in sharding.SHARDS:
+        after = cursors[_cursor_id(shard)]
+        batch = _next_batch(db, shard, after)
+        upto = batch[-1] if batch else after
+        # With no new loans the cursor stays put, but is still locked while gaps are checked
+        if not (batch or _cursor_id(shard) in with_gaps) or not _advance(db, shard, after, upto):
+            db.rollback()
+            continue
+        late, _ = _committed_gaps(db, shard)
+        _add_gaps(db, shard, _holes(batch, after))
+        deltas = _new_pairs(db, shard, after, upto, late)
+        if deltas:
+            _add_pairs(db, deltas)
+        touched = {book_id for book_id, _ in deltas}
+        rank(db, touched)
+        db.commit()
+        ranked += len(touched)
+    return ranked
+
+def _claim_all(db: Session) -> Optional[Dict[int, int]]:
+    """Move every shard's cursor to its newest loan, creating missing ones, and
+    note the open gaps just below it.
+
+    Returns the new cursors, or None if another worker is rebuilding.
+    """
+    table, loan = models.RecommendationCursor, models.Loan
+    cursors = dict(db.execute(select(table.id, table.last_loan_id)).all())
+    for shard in sharding.SHARDS:
+        on_shard = sharding.on_shard(shard)
+        upto = db.scalar(select(func.max(loan.id)), bind_arguments=on_shard) or 0
+        current = cursors.get(_cursor_id(shard))
+        if current is None:
+            db.add(table(id=_cursor_id(shard), last_loan_id=upto))
+            try:
+                db.flush()
+            except IntegrityError:
+                # Another worker is building it
+                return None
+        elif not _advance(db, shard, current, upto):
+            return None
+        cursors[_cursor_id(shard)] = upto
+        # The rebuild reads every committed loan up to the cursor, so only the
+        # ones still missing stay gaps
+        _, still_open = _committed_gaps(db, shard)
+        recent = db.scalars(
+            select(loan.id).where(loan.id > upto - MAX_GAP, loan.id <= upto).order_by(loan.id), bind_arguments=on_shard
+        ).all()
+        if recent:
+            _add_gaps(db, shard, set(_holes(recent[1:], recent[0])) - set(still_open))
+    # Cursors and gaps of shards that no longer exist
+    cursor_ids = [_cursor_id(shard) for shard in sharding.SHARDS]
+    db.execute(delete(table).where(table.id.not_in(cursor_ids)))
+    db.execute(delete(models.RecommendationGap).where(models.RecommendationGap.cursor_id.not_in(cursor_ids)))
+    return cursors
+
+def rebuild(db: Session) -> int:
+    """Recompute book_pairs and every top-k list from the whole loan history. Returns the books ranked."""
+    cursors = _claim_all(db)
+    if cursors is None:
+        db.rollback()
+        return 0
+
+    def reads(shard: int, name: str):
+        loans = archive.history(f"{name}_loans")
+        upto = cursors[_cursor_id(shard)]
+        return select(loans.c.user_id, loans.c.book_id).where(loans.c.id <= upto).distinct().subquery(name)
+
+    def pairs(shard: int):
+        a, b = reads(shard, "a"), reads(shard, "b")
+        return (
+            select(a.c.book_id, b.c.book_id.label("other_book_id"), func.count())
+            .join(b, a.c.user_id == b.c.user_id)
+            .group_by(a.c.book_id, b.c.book_id)
+        )
+
+    db.execute(delete(models.BookPair))
+    # The home shard's loans are next to book_pairs: one INSERT ... SELECT. A user's
+    # loans are all on one shard, so the other shards' counts just add up
+    db.execute(
+        insert(models.BookPair).from_select(["book_id", "other_book_id", "readers"], pairs(sharding.HOME)),
+        bind_arguments=sharding.on_shard(sharding.HOME),
+    )
+    for shard in sharding.SHARDS:
+        if shard != sharding.HOME:
+            deltas = Counter({
+                (book_id, other_book_id): readers
+                for book_id, other_book_id, readers in db.execute(pairs(shard), bind_arguments=sharding.on_shard(shard))
+            })
+            if deltas:
+                _add_pairs(db, deltas)
+    db.execute(delete(models.BookRecommendation))
+    book_ids = db.scalars(
+        select(models.BookPair.book_id).where(models.BookPair.book_id == models.BookPair.other_book_id)
+    ).all()
+    rank(db, book_ids)
+    db.commit()
+    return len(book_ids)
+
+def for_book(db: Session, book_id: int, limit: int) -> List[models.BookRecommendation]:
+    table = models.BookRecommendation
+    return db.scalars(select(table).where(table.book_id == book_id).order_by(table.rank).limit(limit)).all()
+
+def for_user(db: Session, user_id: int, limit: int) -> List[Tuple[int, float, int]]:
+    """(book_id, score, readers) merged from the lists of the user's recent books, minus books they borrowed."""
+    # The user's books come from their loan shard, the lists from the home database
+    loans = archive.history()
+    borrowed = db.scalars(
+        select(loans.c.book_id)
+        .where(loans.c.user_id == user_id)
+        .group_by(loans.c.book_id)
+        .order_by(desc(func.max(loans.c.issue_date))),
+        bind_arguments=sharding.on_shard(sharding.shard_for_user(user_id)),
+    ).all()
+    if not borrowed:
+        return []
+    table = models.BookRecommendation
+    score = func.sum(table.score).label("score")
+    return db.execute(
+        select(table.recommended_book_id, score, func.max(table.readers))
+        .where(table.book_id.in_(borrowed[:USER_HISTORY]), table.recommended_book_id.not_in(borrowed))
+        .group_by(table.recommended_book_id)
+        .order_by(desc(score), table.recommended_book_id)
+        .limit(limit)
+    ).all()
+
+class Updater:
+    """Background thread folding new loans into the recommendations every INTERVAL seconds."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="recommendations-updater", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with SessionLocal() as db:
+                    update_once(db)
+            except Exception:
+                logger.exception("Recommendations update failed")
+            self._stop.wait(INTERVAL)
+
+updater = Updater()
+
+if __name__ == "__main__":
+    # Full rebuild, e.g. nightly: python -m app.recommendations
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as session:
+        logger.info("Ranked %d books", rebuild(session))
@@ -0,0 +1,131 @@
+"""Loan shard setup and rebalancing (see app.sharding).
+
+Adding a shard or moving buckets:
+
+1. Create the new database and run this tool with the new LOAN_SHARD_URLS and
+   LOAN_SHARD_MAP while the services keep running with the old ones:
+
+       LOAN_SHARD_URLS=... LOAN_SHARD_MAP=... python -m app.reshard --dry-run
+       LOAN_SHARD_URLS=... LOAN_SHARD_MAP=... python -m app.reshard
+
+   Every loan whose user maps to another shard under the new map is copied
+   there and then deleted from its old shard, a few users at a time.
+2. Restart the services with the new configuration.
+3. Run the tool again to move the loans written in between.
+
+Until the last step finishes, a moved user's history can be incomplete.
+Lookups by loan id search every shard, so returns keep working. Runs can be
+interrupted and repeated. Before removing a shard, let the dispatcher empty its
+availability_outbox. The recommendations are rebuilt from the new layout
+afterwards.
+"""
+import argparse
+import json
+import logging
+from collections import Counter
+from typing import Dict
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.engine import Engine
+
+from . import models, sharding
+from .database import engine, shard_engines
+
+logger = logging.getLogger(__name__)
+
+# Users whose loans are moved per transaction
+USER_BATCH = 100
+
+SHARDED_TABLES = [models.Loan.__table__, models.LoanArchive.__table__]
+# Every shard also has an outbox; its rows stay where they were written, since
+# the dispatcher drains every shard
+SHARD_TABLES = SHARDED_TABLES + [models.AvailabilityOutbox.__table__]
+
+def reserve_ids(shard_engine: Engine, shard: int):
+    """Make the shard's `loans` table issue ids from the shard's own range."""
+    floor = shard * sharding.ID_SPACE
+    dialect = shard_engine.dialect.name
+    with shard_engine.begin() as connection:
+        if dialect == "postgresql":
+            # Explicit ids (moved loans) do not advance a sequence
+            sequence = connection.scalar(text("SELECT pg_get_serial_sequence('loans', 'id')"))
+            if connection.scalar(text(f"SELECT last_value FROM {sequence}")) < floor:
+                connection.execute(text("SELECT setval(:sequence, :floor)"), {"sequence": sequence, "floor": floor})
+        elif dialect == "sqlite":
+            # AUTOINCREMENT continues after the highest id ever inserted, and moved
+            # loans can come from a higher range: pin it back into the shard's own range
+            ceiling = floor + sharding.ID_SPACE
+            current = connection.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = 'loans'"))
+            highest = [current if current is not None and floor < current <= ceiling else floor]
+            for table in SHARDED_TABLES:
+                highest.append(connection.scalar(
+                    select(func.max(table.c.id)).where(table.c.id > floor, table.c.id <= ceiling)
+                ) or floor)
+            connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'loans'"))
+            connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('loans', :seq)"), {"seq": max(highest)})
+        elif shard != sharding.HOME:
+            raise ValueError(f"Start the loans id sequence of shard {shard} ({dialect}) at {floor + 1} by hand")
+
+def prepare_shards():
+    """Create the loans and outbox tables on every shard and reserve the shards' id ranges."""
+    for shard, shard_engine in shard_engines.items():
+        if shard != sharding.HOME:
+            models.Base.metadata.create_all(bind=shard_engine, tables=SHARD_TABLES)
+        if len(shard_engines) > 1:
+            reserve_ids(shard_engine, shard)
+
+def rebalance(dry_run: bool = False) -> Dict[str, int]:
+    """Move every loan to the shard its user maps to now. Returns the loans moved per "source->target"."""
+    prepare_shards()
+    moved: Counter = Counter()
+    for source, source_engine in shard_engines.items():
+        for table in SHARDED_TABLES:
+            with source_engine.connect() as connection:
+                users = connection.scalars(select(table.c.user_id).distinct()).all()
+            targets: Dict[int, list] = {}
+            for user_id in users:
+                target = sharding.shard_for_user(user_id)
+                if target != source:
+                    targets.setdefault(target, []).append(user_id)
+            for target, user_ids in targets.items():
+                for start in range(0, len(user_ids), USER_BATCH):
+                    batch = user_ids[start:start + USER_BATCH]
+                    moved[f"{source}->{target}"] += _move(table, source, target, batch, dry_run)
+    if moved and not dry_run:
+        prepare_shards()
+        # Loans changed shards, so the per-shard recommendation cursors no longer
+        # line up; the next update rebuilds them
+        with engine.begin() as connection:
+            connection.execute(delete(models.RecommendationCursor))
+            connection.execute(delete(models.RecommendationGap))
+    return dict(moved)
+
+def _move(table, source: int, target: int, user_ids, dry_run: bool) -> int:
+    with shard_engines[source].connect() as source_connection, shard_engines[target].connect() as target_connection:
+        # Locked until deleted, so a concurrent return or extension waits instead of being lost
+        rows = source_connection.execute(
+            select(table).where(table.c.user_id.in_(user_ids)).with_for_update()
+        ).mappings().all()
+        if dry_run or not rows:
+            return len(rows)
+        ids = [row["id"] for row in rows]
+        # Copied by an interrupted earlier run
+        present = set(target_connection.scalars(select(table.c.id).where(table.c.id.in_(ids))))
+        copies = [dict(row) for row in rows if row["id"] not in present]
+        if copies:
+            target_connection.execute(insert(table), copies)
+        target_connection.commit()
+        source_connection.execute(delete(table).where(table.c.id.in_(ids)))
+        source_connection.commit()
+    logger.info("Moved %d %s rows of %d users from shard %d to %d", len(rows), table.name, len(user_ids), source, target)
+    return len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Move loans to the shards of the current LOAN_SHARD_MAP")
+    parser.add_argument("--dry-run", action="store_true", help="only count the loans that would move")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(rebalance(dry_run=args.dry_run)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from . import metrics
+
+# Timeouts for calls to other services, per target (seconds)
+CONNECT_TIMEOUT = float(os.getenv("OUTBOUND_CONNECT_TIMEOUT") or 0.5)
+READ_TIMEOUTS = {
+    "user-service": float(os.getenv("USER_SERVICE_TIMEOUT") or 2.0),
+    "book-service": float(os.getenv("BOOK_SERVICE_TIMEOUT") or 2.0),
+}
+DEFAULT_READ_TIMEOUT = 2.0
+
+# Whole-request deadline. Callers may shorten it with an X-Request-Timeout header
+# (milliseconds); the remaining time is forwarded to downstream services.
+DEADLINE_HEADER = "x-request-timeout"
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT") or 10.0)
+
+# Idempotent GETs are retried on transport errors and these statuses
+RETRY_ATTEMPTS = int(os.getenv("OUTBOUND_RETRY_ATTEMPTS") or 3)
+RETRY_BACKOFF = float(os.getenv("OUTBOUND_RETRY_BACKOFF") or 0.05)
+RETRY_BACKOFF_MAX = 1.0
+RETRY_STATUSES = {502, 503, 504}
+
+# A target's breaker opens after this many consecutive failures and lets a
+# single trial call through once BREAKER_RESET_TIMEOUT has passed (and another
+# if that trial has not reported back within the same time).
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD") or 5)
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT") or 10.0)
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a target whose breaker is open."""
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised when the incoming request's deadline leaves no time for the call."""
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, target: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.target = target
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.CIRCUIT_BREAKER_OPEN.labels(self.target).set(0 if state == self.CLOSED else 1)
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may proceed."""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # Let exactly one trial call through; opened_at now marks when it started
+                self.opened_at = now
+                self._set_state(self.HALF_OPEN)
+                return
+        raise CircuitOpenError(f"Circuit breaker for {self.target} is open")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(target: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if target not in _breakers:
+            _breakers[target] = CircuitBreaker(target)
+        return _breakers[target]
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None outside a request."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def call_timeout(target: str):
+    """(connect, read) timeout for one attempt, capped by the remaining deadline."""
+    read = READ_TIMEOUTS.get(target, DEFAULT_READ_TIMEOUT)
+    remaining = remaining_time()
+    if remaining is None:
+        return (CONNECT_TIMEOUT, read)
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before calling {target}")
+    return (min(CONNECT_TIMEOUT, remaining), min(read, remaining))
+
+def deadline_headers(headers: dict) -> dict:
+    remaining = remaining_time()
+    if remaining is not None:
+        headers[DEADLINE_HEADER] = str(max(0, int(remaining * 1000)))
+    return headers
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff, trimmed to the remaining deadline."""
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * (2 ** attempt)))
+    remaining = remaining_time()
+    return delay if remaining is None else max(0.0, min(delay, remaining))
+
+def is_failure(response: requests.Response) -> bool:
+    """5xx responses count against the breaker (like transport errors); 4xx are answers."""
+    return response.status_code >= 500
+
+class DeadlineMiddleware:
+    """ASGI middleware that sets the request deadline used by outbound calls."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = REQUEST_TIMEOUT
+        for key, value in scope.get("headers", []):
+            if key == DEADLINE_HEADER.encode():
+                try:
+                    timeout = min(timeout, max(0, int(value)) / 1000)
+                except ValueError:
+                    pass
+                break
+        token = _deadline.set(time.monotonic() + timeout)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
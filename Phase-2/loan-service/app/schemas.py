@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, List
 import datetime
 
@@ -24,6 +24,23 @@ class ReturnCreate(BaseModel):
     loan_id: int
 
 class LoanExtend(BaseModel):
+    extension_days: int = Field(..., ge=1, le=365)
+
+class LoanBulkExtend(BaseModel):
+    """Extend every open loan of a user and/or a book (or, with all_loans, the whole library)."""
+    user_id: Optional[int] = None
+    book_id: Optional[int] = None
+    all_loans: bool = False
+    extension_days: int = Field(..., ge=1, le=365)
+
+    @model_validator(mode="after")
+    def require_filter(self):
+        if self.user_id is None and self.book_id is None and not self.all_loans:
+            raise ValueError("Give user_id and/or book_id, or set all_loans to extend every open loan")
+        return self
+
+class LoanBulkExtendResult(BaseModel):
+    extended: int
     extension_days: int
 
 class Loan(LoanBase):
@@ -36,6 +53,10 @@ class Loan(LoanBase):
     class Config:
         from_attributes = True
 
+class LoanExtended(Loan):
+    original_due_date: datetime.datetime
+    extended_due_date: datetime.datetime
+
 # Open loan-service/app/schemas.py and update the LoanWithDetails class
 class LoanWithDetails(BaseModel):
     id: int
@@ -63,4 +84,61 @@ class LoanHistoryItem(BaseModel):
 
 class PaginatedLoans(BaseModel):
     loans: List[LoanHistoryItem]
-    total: int
\ No newline at end of file
+    total: int
+
+class OverdueLoanItem(BaseModel):
+    id: int
+    user: UserDetail
+    book: BookDetail
+    issue_date: datetime.datetime
+    due_date: datetime.datetime
+    days_overdue: int
+
+class PaginatedOverdueLoans(BaseModel):
+    loans: List[OverdueLoanItem]
+    total: int
+
+class HoldCreate(BaseModel):
+    user_id: int
+    book_id: int
+
+class Hold(BaseModel):
+    id: int
+    user_id: int
+    book_id: int
+    priority: int
+    status: str
+    created_at: datetime.datetime
+    ready_at: Optional[datetime.datetime] = None
+    expires_at: Optional[datetime.datetime] = None
+    position: Optional[int] = None  # place in the book's queue while WAITING
+
+    class Config:
+        from_attributes = True
+
+class RecommendedBook(BaseModel):
+    book: BookDetail
+    score: float  # cosine similarity of the books' readers (summed over the user's books for user recommendations)
+    readers: int  # readers who borrowed both
+
+class UserProfile(UserDetail):
+    role: Optional[str] = None
+
+class DashboardLoan(BaseModel):
+    id: int
+    book_id: int
+    book: Optional[BookDetail] = None  # None when the Book Service could not provide it
+    issue_date: datetime.datetime
+    due_date: datetime.datetime
+    status: str
+    days_overdue: int
+
+class DashboardCounts(BaseModel):
+    open_loans: int
+    overdue_loans: int
+
+class UserDashboard(BaseModel):
+    user: Optional[UserProfile] = None  # None when the User Service could not be reached
+    loans: List[DashboardLoan]  # open loans, earliest due date first
+    counts: DashboardCounts
+    partial: List[str] = []  # sections missing details because a service failed ("user", "books")
@@ -1,7 +1,13 @@
 import os
+import time
+from typing import Any, Callable, Dict, Iterable
+import msgpack
 import requests
+from requests.adapters import HTTPAdapter
 from fastapi import HTTPException, status
 from dotenv import load_dotenv
+from . import metrics, query_budget, resilience, tracing
+from .singleflight import SingleFlight
 
 load_dotenv()
 
@@ -9,17 +15,187 @@ load_dotenv()
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL") or "http://localhost:8001"
 BOOK_SERVICE_URL = os.getenv("BOOK_SERVICE_URL") or "http://localhost:8002"
 
+# "binary" sends lookups and availability updates to the services' /internal API as
+# MessagePack over pooled keep-alive connections, and batches the book lookups of a
+# loan history into one call. "rest" (default) uses the public JSON API. "local"
+# is set by Phase-2/colocated.py, which runs the three services in one process:
+# the clients then call the User and Book services' CRUD functions directly
+# (see colocate()), with no HTTP, encoding or sockets in between.
+INTERNAL_TRANSPORT = (os.getenv("INTERNAL_TRANSPORT") or "rest").lower()
+MSGPACK = "application/msgpack"
+# Keep-alive connections kept per service (one per concurrently calling thread)
+INTERNAL_POOL_SIZE = int(os.getenv("INTERNAL_POOL_SIZE") or 20)
+
 class ServiceError(Exception):
     def __init__(self, message: str, status_code: int = 500):
         self.message = message
         self.status_code = status_code
         super().__init__(self.message)
 
+def _pooled_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=INTERNAL_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_internal_session = _pooled_session()
+
+def _send(target: str, operation: str, method: str, url: str, session: requests.Session = None,
+          **kwargs) -> requests.Response:
+    """Perform an outbound HTTP call with a timeout, the target's circuit breaker and,
+    for idempotent GETs, retries with jittered backoff; latency and outcome are recorded per target."""
+    query_budget.record_outbound(target, operation)
+    breaker = resilience.breaker_for(target)
+    attempts = resilience.RETRY_ATTEMPTS if method == "GET" else 1
+    started = time.perf_counter()
+    outcome = "error"
+    with tracing.start_span(f"{method} {target} {operation}", kind="CLIENT", root=False) as span:
+        headers = tracing.inject_headers(kwargs.pop("headers", None))
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    metrics.OUTBOUND_RETRIES.labels(target, operation).inc()
+                    time.sleep(resilience.backoff(attempt - 1))
+                timeout = resilience.call_timeout(target)
+                try:
+                    breaker.before_call()
+                except resilience.CircuitOpenError:
+                    outcome = "short_circuit"
+                    raise
+                try:
+                    response = (session or requests).request(
+                        method, url, headers=resilience.deadline_headers(headers), timeout=timeout, **kwargs
+                    )
+                except requests.RequestException:
+                    breaker.record_failure()
+                    if attempt == attempts - 1:
+                        raise
+                    continue
+                except BaseException:
+                    # Anything else still ends the call (and a half-open breaker's trial)
+                    breaker.record_failure()
+                    raise
+                if resilience.is_failure(response):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status_code in resilience.RETRY_STATUSES and attempt < attempts - 1:
+                    continue
+                outcome = f"{response.status_code // 100}xx"
+                if span is not None:
+                    span.set_tag("http.status_code", response.status_code)
+                    span.set_tag("retries", attempt)
+                return response
+        finally:
+            metrics.observe_outbound(target, operation, outcome, time.perf_counter() - started)
+
+def _send_binary(target: str, operation: str, method: str, url: str, body: dict = None) -> requests.Response:
+    """Call a service's /internal MessagePack API over the pooled connections."""
+    headers = {"Accept": MSGPACK}
+    kwargs = {}
+    if body is not None:
+        headers["Content-Type"] = MSGPACK
+        kwargs["data"] = msgpack.packb(body)
+    return _send(target, operation, method, url, session=_internal_session, headers=headers, **kwargs)
+
+def _payload(response: requests.Response):
+    """Decode a response body from either transport (errors are always JSON)."""
+    if response.headers.get("content-type", "").startswith(MSGPACK):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+def _fetch_batch(target: str, operation: str, url: str, ids: list, key: str) -> Dict[int, dict]:
+    """Look up ids in one call to a batch endpoint: /internal (MessagePack) with
+    INTERNAL_TRANSPORT=binary, the public JSON API otherwise."""
+    if not ids:
+        return {}
+    try:
+        if INTERNAL_TRANSPORT == "binary":
+            response = _send_binary(target, operation, "POST", url, body={"ids": ids})
+        else:
+            response = _send(target, operation, "POST", url, json={"ids": ids})
+    except requests.RequestException:
+        return {}
+    if response.status_code != 200:
+        return {}
+    return {item["id"]: item for item in _payload(response)[key]}
+
+# Co-located services' app packages by target, set by colocate()
+_colocated: Dict[str, Any] = {}
+
+def colocate(user_service, book_service):
+    """Dispatch to the User and Book services loaded in this process (INTERNAL_TRANSPORT=local)."""
+    global INTERNAL_TRANSPORT
+    INTERNAL_TRANSPORT = "local"
+    _colocated.update({"user-service": user_service, "book-service": book_service})
+
+def _call_local(target: str, operation: str, call: Callable):
+    """Run call(service, db) against a co-located service's CRUD layer, in a session of its own;
+    recorded like an HTTP call, and its HTTPExceptions raised as they would come back over HTTP."""
+    service = _colocated.get(target)
+    if service is None:
+        raise ServiceError(
+            message=f"{target} is not co-located (INTERNAL_TRANSPORT=local is set by Phase-2/colocated.py)",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    query_budget.record_outbound(target, operation)
+    started = time.perf_counter()
+    outcome = "error"
+    with tracing.start_span(f"LOCAL {target} {operation}", kind="CLIENT", root=False):
+        try:
+            with service.database.SessionLocal() as db:
+                result = call(service, db)
+            outcome = "2xx"
+            return result
+        except HTTPException as e:
+            outcome = f"{e.status_code // 100}xx"
+            raise
+        except Exception as e:
+            outcome = "5xx"
+            raise ServiceError(message=f"{target} error: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            metrics.observe_outbound(target, operation, outcome, time.perf_counter() - started)
+
+def _dump(schema, row) -> dict:
+    return schema.model_validate(row).model_dump()
+
+def _local_batch(target: str, operation: str, lookup: Callable, schema_name: str, ids: list) -> Dict[int, dict]:
+    if not ids:
+        return {}
+    try:
+        return _call_local(target, operation, lambda service, db: {
+            row.id: _dump(getattr(service.schemas, schema_name), row) for row in lookup(service, db)
+        })
+    except ServiceError:
+        return {}
+
+# Concurrent lookups of the same user or book share one HTTP call
+_user_lookups = SingleFlight("get_user")
+_book_lookups = SingleFlight("get_book")
+
 class UserServiceClient:
     def get_user(self, user_id: int):
         """Get user details from User Service."""
+        return _user_lookups.do(user_id, lambda: self._fetch_user(user_id))
+
+    def get_users(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        """Get several users keyed by id; users that are missing or cannot be fetched are left out."""
+        user_ids = sorted(set(user_ids))
+        if INTERNAL_TRANSPORT == "local":
+            return _local_batch("user-service", "get_users",
+                                lambda service, db: service.crud.get_users_by_ids(db, user_ids), "User", user_ids)
+        prefix = "internal" if INTERNAL_TRANSPORT == "binary" else "api"
+        return _fetch_batch("user-service", "get_users", f"{USER_SERVICE_URL}/{prefix}/users/batch", user_ids, "users")
+
+    def _fetch_user(self, user_id: int):
+        if INTERNAL_TRANSPORT == "local":
+            return _call_local("user-service", "get_user", lambda service, db: self._local_user(service, db, user_id))
         try:
-            response = requests.get(f"{USER_SERVICE_URL}/api/users/{user_id}")
+            if INTERNAL_TRANSPORT == "binary":
+                response = _send_binary("user-service", "get_user", "GET", f"{USER_SERVICE_URL}/internal/users/{user_id}")
+            else:
+                response = _send("user-service", "get_user", "GET", f"{USER_SERVICE_URL}/api/users/{user_id}")
             
             if response.status_code == 404:
                 raise HTTPException(
@@ -33,7 +209,7 @@ class UserServiceClient:
                     status_code=response.status_code
                 )
             
-            return response.json()
+            return _payload(response)
             
         except requests.RequestException as e:
             raise ServiceError(
@@ -41,11 +217,38 @@ class UserServiceClient:
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
+    @staticmethod
+    def _local_user(service, db, user_id: int) -> dict:
+        user = service.crud.get_user(db, user_id=user_id)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User with ID {user_id} not found"
+            )
+        return _dump(service.schemas.User, user)
+
 class BookServiceClient:
     def get_book(self, book_id: int):
         """Get book details from Book Service."""
+        return _book_lookups.do(book_id, lambda: self._fetch_book(book_id))
+
+    def get_books(self, book_ids: Iterable[int]) -> Dict[int, dict]:
+        """Get several books keyed by id; books that are missing or cannot be fetched are left out."""
+        book_ids = sorted(set(book_ids))
+        if INTERNAL_TRANSPORT == "local":
+            return _local_batch("book-service", "get_books",
+                                lambda service, db: service.crud.get_books_by_ids(db, book_ids), "Book", book_ids)
+        prefix = "internal" if INTERNAL_TRANSPORT == "binary" else "api"
+        return _fetch_batch("book-service", "get_books", f"{BOOK_SERVICE_URL}/{prefix}/books/batch", book_ids, "books")
+
+    def _fetch_book(self, book_id: int):
+        if INTERNAL_TRANSPORT == "local":
+            return _call_local("book-service", "get_book", lambda service, db: self._local_book(service, db, book_id))
         try:
-            response = requests.get(f"{BOOK_SERVICE_URL}/api/books/{book_id}")
+            if INTERNAL_TRANSPORT == "binary":
+                response = _send_binary("book-service", "get_book", "GET", f"{BOOK_SERVICE_URL}/internal/books/{book_id}")
+            else:
+                response = _send("book-service", "get_book", "GET", f"{BOOK_SERVICE_URL}/api/books/{book_id}")
             
             if response.status_code == 404:
                 raise HTTPException(
@@ -59,7 +262,7 @@ class BookServiceClient:
                     status_code=response.status_code
                 )
             
-            return response.json()
+            return _payload(response)
             
         except requests.RequestException as e:
             raise ServiceError(
@@ -67,18 +270,49 @@ class BookServiceClient:
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE
             )
     
-    def update_availability(self, book_id: int, operation: str):
+    @staticmethod
+    def _local_book(service, db, book_id: int) -> dict:
+        book = service.crud.get_book(db, book_id=book_id)
+        if book is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Book with ID {book_id} not found"
+            )
+        return _dump(service.schemas.Book, book)
+
+    def update_availability(self, book_id: int, operation: str, count: int = 1):
         """Update book availability in Book Service."""
+        if INTERNAL_TRANSPORT == "local":
+            def update(service, db):
+                change = service.schemas.AvailabilityUpdate(available_copies=0, operation=operation, count=count)
+                return _dump(service.schemas.Book, service.crud.update_availability(db, book_id=book_id, update=change))
+            try:
+                return _call_local("book-service", "update_availability", update)
+            except HTTPException as e:
+                if e.status_code == status.HTTP_404_NOT_FOUND:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"Book with ID {book_id} not found"
+                    )
+                raise
         try:
-            data = {
-                "available_copies": 1,  # Doesn't matter for increment/decrement operations
-                "operation": operation
-            }
-            
-            response = requests.patch(
-                f"{BOOK_SERVICE_URL}/api/books/{book_id}/availability",
-                json=data
-            )
+            if INTERNAL_TRANSPORT == "binary":
+                response = _send_binary(
+                    "book-service", "update_availability", "POST",
+                    f"{BOOK_SERVICE_URL}/internal/books/{book_id}/availability",
+                    body={"operation": operation, "count": count}
+                )
+            else:
+                data = {
+                    "available_copies": 1,  # Doesn't matter for increment/decrement operations
+                    "operation": operation,
+                    "count": count
+                }
+                response = _send(
+                    "book-service", "update_availability", "PATCH",
+                    f"{BOOK_SERVICE_URL}/api/books/{book_id}/availability",
+                    json=data
+                )
             
             if response.status_code == 404:
                 raise HTTPException(
@@ -90,7 +324,7 @@ class BookServiceClient:
                 # For example, when trying to borrow a book with no available copies
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=response.json().get("detail", "Invalid operation on book")
+                    detail=_payload(response).get("detail", "Invalid operation on book")
                 )
             
             if response.status_code != 200:
@@ -99,7 +333,7 @@ class BookServiceClient:
                     status_code=response.status_code
                 )
             
-            return response.json()
+            return _payload(response)
             
         except requests.RequestException as e:
             raise ServiceError(
@@ -0,0 +1,118 @@
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import inspect
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql.util import find_tables
+
+# Imported by app.database before it loads .env
+load_dotenv()
+
+# Loans are sharded by user. Every user_id hashes to one of BUCKETS buckets and
+# LOAN_SHARD_MAP assigns bucket ranges to shards, e.g. "0-511:0,512-1023:1".
+# Without a map the buckets are split evenly across the shards. Shard 0 is
+# LOAN_DATABASE_URL, the home database: it also keeps the tables shared by all
+# users (holds, recommendations). LOAN_SHARD_URLS lists the other shards (1, 2,
+# ...), which only hold `loans`, `loans_archive` and their own
+# `availability_outbox`. With no LOAN_SHARD_URLS everything lives on shard 0, as
+# before.
+#
+# A user's loans are always read from and written to their shard, and a return
+# commits its availability update in the same shard transaction (app.outbox
+# drains every shard). Queries that span users (overdue loans, bulk extensions by
+# book, recommendations, the archiver) run on every shard and merge the results.
+# Moving buckets to another shard is done by `python -m app.reshard` (see there).
+HOME = 0
+BUCKETS = 1024
+MAX_SHARDS = 16
+# Loan ids stay unique across shards: each shard issues ids from its own range
+# (see app.reshard.reserve_ids), so a loan's id also tells where it was created
+ID_SPACE = 2 ** 31 // MAX_SHARDS
+SHARDED_TABLES = {"loans", "loans_archive", "availability_outbox"}
+
+SHARD_URLS = [url.strip() for url in (os.getenv("LOAN_SHARD_URLS") or "").split(",") if url.strip()]
+SHARDS = list(range(1 + len(SHARD_URLS)))
+
+if len(SHARDS) > MAX_SHARDS:
+    raise ValueError(f"At most {MAX_SHARDS} loan shards are supported")
+
+def parse_map(spec: Optional[str], shards: int = len(SHARDS)) -> List[int]:
+    """Shard of every bucket, from "first-last:shard,..." ranges (evenly split if empty)."""
+    if not spec:
+        return [bucket * shards // BUCKETS for bucket in range(BUCKETS)]
+    buckets: List[Optional[int]] = [None] * BUCKETS
+    for entry in spec.split(","):
+        ranges, _, shard = entry.strip().partition(":")
+        first, _, last = ranges.partition("-")
+        if not 0 <= int(shard) < shards:
+            raise ValueError(f"LOAN_SHARD_MAP entry {entry!r} names an unknown shard")
+        for bucket in range(int(first), int(last or first) + 1):
+            buckets[bucket] = int(shard)
+    missing = [bucket for bucket, shard in enumerate(buckets) if shard is None]
+    if missing:
+        raise ValueError(f"LOAN_SHARD_MAP leaves buckets unassigned, e.g. {missing[0]}")
+    return buckets
+
+SHARD_MAP = parse_map(os.getenv("LOAN_SHARD_MAP"))
+
+def bucket(user_id: int) -> int:
+    return zlib.crc32(int(user_id).to_bytes(8, "big", signed=True)) % BUCKETS
+
+def shard_for_user(user_id: int, shard_map: List[int] = SHARD_MAP) -> int:
+    return shard_map[bucket(user_id)]
+
+def shards_for_loan(loan_id: int) -> List[int]:
+    """Shards to look for a loan on: the one that created it first (it moves only when resharding)."""
+    origin = loan_id // ID_SPACE
+    return ([origin] if origin in SHARDS else []) + [shard for shard in SHARDS if shard != origin]
+
+def shard_of(instance) -> int:
+    """Shard a loaded row came from."""
+    return inspect(instance).identity_token
+
+def on_shard(shard: int) -> Dict[str, int]:
+    """bind_arguments running a statement on one shard, e.g. db.execute(stmt, bind_arguments=on_shard(1))."""
+    return {"shard_id": shard}
+
+def _is_sharded(table) -> bool:
+    return getattr(table, "name", None) in SHARDED_TABLES
+
+def _shard_chooser(mapper, instance, clause=None, **kw) -> int:
+    # Outbox rows are inserted on an explicit shard (app.outbox.enqueue)
+    if instance is not None and _is_sharded(mapper.local_table):
+        return shard_for_user(instance.user_id)
+    return HOME
+
+def _identity_chooser(mapper, primary_key, **kw) -> Iterable[int]:
+    if _is_sharded(mapper.local_table):
+        return shards_for_loan(primary_key[0])
+    return [HOME]
+
+def _execute_chooser(orm_context) -> Iterable[int]:
+    # Statements not given a shard: loan tables on every shard, the rest at home
+    tables = find_tables(orm_context.statement, include_crud=True, include_joins=True)
+    return SHARDS if any(_is_sharded(table) for table in tables) else [HOME]
+
+class LoanSession(ShardedSession):
+    """A session over every shard, with one transaction per shard touched.
+
+    commit() commits those transactions one after the other and is not atomic: there is no
+    two-phase commit, so a failure part way leaves the earlier shards committed. Writes that
+    span shards are ordered so that such a failure can be undone or retried.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            shard_chooser=_shard_chooser,
+            identity_chooser=_identity_chooser,
+            execute_chooser=_execute_chooser,
+            **kwargs,
+        )
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None and mapper is None and instance is None:
+            # Dialect checks and plain SQL; all shards use the same kind of database
+            shard_id = HOME
+        return super().get_bind(mapper, shard_id=shard_id, instance=instance, clause=clause, **kw)
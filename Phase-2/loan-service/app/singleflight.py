@@ -0,0 +1,53 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from . import metrics
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent identical lookups into one.
+
+    The first caller for a key runs the lookup; callers arriving while it is
+    still in flight wait and share its result (or exception). Nothing is cached
+    afterwards, so results are never older than the moment they were read.
+    Only share immutable values (e.g. pydantic models), never ORM objects,
+    which belong to the leader's session.
+    """
+
+    def __init__(self, group: str):
+        self.group = group
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            metrics.SINGLEFLIGHT_CALLS.labels(self.group, "shared").inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.SINGLEFLIGHT_CALLS.labels(self.group, "leader").inc()
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
@@ -0,0 +1,101 @@
+"""Fixtures for the Phase-2 tests.
+
+The three services run in this process as in ``colocated.py``, each on fresh
+SQLite files, with the Loan Service spread over three loan shards and its
+background workers off (tests drive the outbox and updaters themselves).
+
+    cd Phase-2
+    python -m pytest tests
+"""
+import datetime
+import itertools
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_workdir = Path(tempfile.mkdtemp(prefix="phase2-tests-"))
+os.environ.update({
+    "USER_DATABASE_URL": f"sqlite:///{_workdir / 'users.db'}",
+    "BOOK_DATABASE_URL": f"sqlite:///{_workdir / 'books.db'}",
+    "LOAN_DATABASE_URL": f"sqlite:///{_workdir / 'loans-0.db'}",
+    "LOAN_SHARD_URLS": f"sqlite:///{_workdir / 'loans-1.db'},sqlite:///{_workdir / 'loans-2.db'}",
+    "OUTBOX_DISPATCHER": "off",
+    "RECOMMENDATIONS_UPDATER": "off",
+    "LOAN_ARCHIVER": "off",
+    "ADMISSION_CONTROL": "off",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import colocated  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+_unique = itertools.count(1)
+
+@pytest.fixture(scope="session")
+def services():
+    """The service packages by name ("user-service", "book-service", "loan-service")."""
+    return colocated.services
+
+@pytest.fixture(scope="session")
+def loans(services):
+    """The Loan Service package (``loan_service_app``)."""
+    return services["loan-service"]
+
+@pytest.fixture(scope="session")
+def client():
+    """A client for all three services, started like ``uvicorn colocated:app``."""
+    with TestClient(colocated.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def db(loans):
+    with loans.database.SessionLocal() as session:
+        yield session
+
+@pytest.fixture
+def query_budget(services, monkeypatch):
+    """Enforce the route budgets (QUERY_BUDGET_MODE=raise) and return the block guard.
+
+    A request over its route's budget fails with QueryBudgetExceeded, listing the
+    statements and calls it made; ``with query_budget(queries, outbound): ...``
+    does the same for a block of code run in the test.
+    """
+    for package in services.values():
+        monkeypatch.setattr(package.query_budget, "MODE", "raise")
+    return services["loan-service"].query_budget.query_budget
+
+@pytest.fixture
+def make_user(client):
+    def make_user(role: str = "student") -> dict:
+        number = next(_unique)
+        response = client.post("/api/users/", json={
+            "name": f"Reader {number}", "email": f"reader{number}@example.com", "role": role,
+        })
+        response.raise_for_status()
+        return response.json()
+    return make_user
+
+@pytest.fixture
+def make_book(client):
+    def make_book(copies: int = 1) -> dict:
+        number = next(_unique)
+        response = client.post("/api/books/", json={
+            "title": f"Book {number}", "author": f"Author {number}", "isbn": f"test-{number}", "copies": copies,
+        })
+        response.raise_for_status()
+        return response.json()
+    return make_book
+
+@pytest.fixture
+def borrow(client):
+    def borrow(user_id: int, book_id: int, due_in_days: int = 14) -> dict:
+        due = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=due_in_days)
+        response = client.post("/api/loans/", json={
+            "user_id": user_id, "book_id": book_id, "due_date": due.isoformat(),
+        })
+        response.raise_for_status()
+        return response.json()
+    return borrow
@@ -0,0 +1,23 @@
+import msgpack
+
+def test_books_and_users_are_looked_up_in_one_request(client, make_user, make_book):
+    books = [make_book() for _ in range(3)]
+    response = client.post("/api/books/batch", json={"ids": [book["id"] for book in books] + [10 ** 9]})
+    assert sorted(book["id"] for book in response.json()["books"]) == sorted(book["id"] for book in books)
+
+    user = make_user()
+    assert [found["id"] for found in client.post("/api/users/batch", json={"ids": [user["id"]]}).json()["users"]] == [user["id"]]
+
+def test_batch_ids_must_be_integers(client):
+    assert client.post("/api/books/batch", json={"ids": [True]}).status_code == 422
+    assert client.post("/api/users/batch", json={"ids": ["1"]}).status_code == 422
+    assert client.post("/api/books/batch", json={"ids": list(range(1001))}).status_code == 422
+
+def test_internal_api_does_not_take_booleans_for_integers(client, make_book):
+    book = make_book()
+    headers = {"Content-Type": "application/msgpack", "Accept": "application/msgpack"}
+    for path in ("/internal/books/batch", "/internal/users/batch"):
+        assert client.post(path, content=msgpack.packb({"ids": [True]}), headers=headers).status_code == 400
+    update = msgpack.packb({"operation": "decrement", "count": True})
+    assert client.post(f"/internal/books/{book['id']}/availability", content=update, headers=headers).status_code == 400
+    assert client.get(f"/api/books/{book['id']}").json()["available_copies"] == book["available_copies"]
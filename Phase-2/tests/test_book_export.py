@@ -0,0 +1,16 @@
+import csv
+import io
+import json
+
+def test_export_reports_sharded_availability(client, make_book):
+    book = make_book(copies=10)
+    client.put(f"/api/books/{book['id']}/inventory", json={"shards": 4}).raise_for_status()
+    for _ in range(3):
+        client.patch(f"/api/books/{book['id']}/availability", json={"available_copies": 0, "operation": "decrement"}).raise_for_status()
+    assert client.get(f"/api/books/{book['id']}").json()["available_copies"] == 7
+
+    rows = [json.loads(line) for line in client.get("/api/books/export?format=ndjson").text.splitlines()]
+    assert next(row for row in rows if row["id"] == book["id"])["available_copies"] == 7
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/api/books/export?format=csv").text)))
+    assert next(row for row in rows if row["id"] == str(book["id"]))["available_copies"] == "7"
@@ -0,0 +1,71 @@
+import datetime
+
+import pytest
+from sqlalchemy import select
+
+def place_hold(client, user_id: int, book_id: int) -> dict:
+    response = client.post("/api/holds/", json={"user_id": user_id, "book_id": book_id})
+    response.raise_for_status()
+    return response.json()
+
+def statuses(client, holds) -> list:
+    return [client.get(f"/api/holds/{hold['id']}").json()["status"] for hold in holds]
+
+def test_returns_serve_the_queue_by_priority_then_in_order(client, loans, db, make_user, make_book, borrow):
+    book = make_book(copies=2)
+    first, second = (borrow(make_user()["id"], book["id"]) for _ in range(2))
+    queue = [place_hold(client, make_user()["id"], book["id"]) for _ in range(2)]
+    queue.append(place_hold(client, make_user("faculty")["id"], book["id"]))
+
+    client.post("/api/returns/", json={"loan_id": first["id"]}).raise_for_status()
+    # The returned copy reaches the queue through the outbox dispatcher
+    assert statuses(client, queue) == ["WAITING", "WAITING", "WAITING"]
+    loans.outbox.dispatch_once(db)
+    assert statuses(client, queue) == ["WAITING", "WAITING", "READY"]
+
+    client.post("/api/returns/", json={"loan_id": second["id"]}).raise_for_status()
+    loans.outbox.dispatch_once(db)
+    assert statuses(client, queue) == ["READY", "WAITING", "READY"]
+    assert client.get(f"/api/holds/{queue[1]['id']}").json()["position"] == 1
+
+def test_cancelled_and_expired_ready_holds_pass_the_copy_on(client, loans, db, make_user, make_book, borrow):
+    book = make_book(copies=1)
+    loan = borrow(make_user()["id"], book["id"])
+    queue = [place_hold(client, make_user()["id"], book["id"]) for _ in range(3)]
+    client.post("/api/returns/", json={"loan_id": loan["id"]}).raise_for_status()
+    loans.outbox.dispatch_once(db)
+
+    client.delete(f"/api/holds/{queue[0]['id']}").raise_for_status()
+    assert statuses(client, queue) == ["CANCELLED", "READY", "WAITING"]
+
+    db.get(loans.models.Hold, queue[1]["id"]).expires_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1)
+    db.commit()
+    assert loans.holds.expire_ready(db) == []
+    db.commit()
+    assert statuses(client, queue) == ["CANCELLED", "EXPIRED", "READY"]
+
+def test_a_copy_given_to_a_hold_is_not_given_again(client, loans, db, make_user, make_book, borrow, monkeypatch):
+    book = make_book(copies=1)
+    user = make_user()
+    loan = borrow(user["id"], book["id"])
+    queue = [place_hold(client, make_user()["id"], book["id"]) for _ in range(2)]
+    client.post("/api/returns/", json={"loan_id": loan["id"]}).raise_for_status()
+
+    # The hold commits at home, then deleting the row on the loan's shard fails
+    def fail(*args, **kwargs):
+        raise RuntimeError("shard unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(loans.outbox, "_delete", fail)
+        with pytest.raises(RuntimeError):
+            loans.outbox.dispatch_once(db)
+    db.rollback()
+    assert statuses(client, queue) == ["READY", "WAITING"]
+
+    loans.outbox.dispatch_once(db)
+    assert statuses(client, queue) == ["READY", "WAITING"]
+    shard = loans.sharding.shard_for_user(user["id"])
+    table = loans.models.AvailabilityOutbox
+    assert not db.scalars(
+        select(table).where(table.book_id == book["id"]), bind_arguments=loans.sharding.on_shard(shard)
+    ).all()
@@ -0,0 +1,33 @@
+from sqlalchemy import select
+
+def test_refused_batch_drops_only_the_failing_row(client, loans, db, make_user, make_book, borrow):
+    user = make_user()
+    book = make_book(copies=3)
+    for _ in range(2):
+        borrow(user["id"], book["id"])
+    # Three increments for two borrowed copies: sent together they go over the
+    # book's copies and are refused as a whole
+    for _ in range(3):
+        loans.outbox.enqueue(db, book["id"], "increment")
+    db.commit()
+
+    loans.outbox.dispatch_once(db)
+
+    assert client.get(f"/api/books/{book['id']}").json()["available_copies"] == 3
+    assert db.query(loans.models.AvailabilityOutbox).filter_by(book_id=book["id"]).all() == []
+
+def test_return_sends_its_increment_through_the_outbox(client, loans, db, make_user, make_book, borrow):
+    user = make_user()
+    book = make_book(copies=1)
+    loan = borrow(user["id"], book["id"])
+    client.post("/api/returns/", json={"loan_id": loan["id"]}).raise_for_status()
+    assert client.get(f"/api/books/{book['id']}").json()["available_copies"] == 0
+    # Committed with the loan, on its shard
+    shard = loans.sharding.shard_for_user(user["id"])
+    table = loans.models.AvailabilityOutbox
+    rows = db.scalars(select(table).where(table.book_id == book["id"]), bind_arguments=loans.sharding.on_shard(shard))
+    assert [row.operation for row in rows] == ["increment"]
+
+    loans.outbox.dispatch_once(db)
+
+    assert client.get(f"/api/books/{book['id']}").json()["available_copies"] == 1
@@ -0,0 +1,43 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import colocated
+
+def test_loan_routes_stay_within_budget(client, query_budget, make_user, make_book, borrow):
+    user = make_user()
+    books = [make_book(copies=2) for _ in range(3)]
+    loans = [borrow(user["id"], book["id"]) for book in books]
+
+    assert client.get(f"/api/loans/{loans[0]['id']}").status_code == 200
+    history = client.get(f"/api/loans/user/{user['id']}")
+    assert history.json()["total"] == 3
+    assert client.get(f"/api/dashboard/users/{user['id']}").json()["counts"]["open_loans"] == 3
+    assert client.post("/api/returns/", json={"loan_id": loans[0]["id"]}).json()["status"] == "RETURNED"
+    # Cross-user routes run on every loan shard
+    assert client.get("/api/loans/overdue").status_code == 200
+    assert client.post("/api/loans/extend", json={"book_id": books[1]["id"], "extension_days": 1}).status_code == 200
+
+def test_route_over_budget_fails_before_the_response(loans, query_budget, make_user, monkeypatch):
+    user = make_user()
+    monkeypatch.setitem(
+        loans.query_budget.ROUTE_BUDGETS, ("GET", "/api/loans/user/{user_id}"), loans.query_budget.Budget(queries=1)
+    )
+    with TestClient(colocated.app) as client:
+        with pytest.raises(loans.query_budget.QueryBudgetExceeded, match="2/1 SQL statements"):
+            client.get(f"/api/loans/user/{user['id']}")
+    with TestClient(colocated.app, raise_server_exceptions=False) as client:
+        assert client.get(f"/api/loans/user/{user['id']}").status_code == 500
+
+def test_block_budget_reports_repeated_statements(loans, db, query_budget, make_user, make_book, borrow):
+    user = make_user()
+    for _ in range(3):
+        borrow(user["id"], make_book()["id"])
+
+    with query_budget(2, outbound=1):
+        loans.crud.get_user_loans(db, user["id"])
+
+    with pytest.raises(loans.query_budget.QueryBudgetExceeded, match=r"3x SELECT"):
+        with query_budget(3, label="loan details"):
+            for loan in loans.crud.get_user_loans(db, user["id"])["loans"]:
+                db.expunge_all()
+                loans.crud.get_loan(db, loan["id"])
@@ -0,0 +1,39 @@
+import datetime
+
+from sqlalchemy import func, select
+
+def pairs(loans, db, book_ids) -> dict:
+    table = loans.models.BookPair
+    rows = db.execute(
+        select(table.book_id, table.other_book_id, table.readers)
+        .where(table.book_id.in_(book_ids), table.other_book_id.in_(book_ids))
+    )
+    return {(book_id, other_book_id): readers for book_id, other_book_id, readers in rows}
+
+def test_a_loan_committing_behind_the_cursor_is_folded_in_later(loans, db, make_user, make_book):
+    recommendations, sharding = loans.recommendations, loans.sharding
+    user_id = make_user()["id"]
+    first, late, last = (make_book()["id"] for _ in range(3))
+    shard = sharding.shard_for_user(user_id)
+    recommendations.rebuild(db)
+    newest = db.scalar(select(func.max(loans.models.Loan.id)), bind_arguments=sharding.on_shard(shard))
+    newest = newest or shard * sharding.ID_SPACE
+    due = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)
+
+    def add_loan(loan_id: int, book_id: int):
+        db.add(loans.models.Loan(id=loan_id, user_id=user_id, book_id=book_id, due_date=due))
+        db.commit()
+
+    # newest + 2 is still being written when the updater passes it
+    add_loan(newest + 1, first)
+    add_loan(newest + 3, last)
+    recommendations.update_once(db)
+    assert (first, late) not in pairs(loans, db, [first, late, last])
+
+    add_loan(newest + 2, late)
+    recommendations.update_once(db)
+    incremental = pairs(loans, db, [first, late, last])
+    assert incremental[first, late] == incremental[late, last] == incremental[late, late] == 1
+
+    recommendations.rebuild(db)
+    assert pairs(loans, db, [first, late, last]) == incremental
@@ -0,0 +1,170 @@
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+FAKE_SERVICE = Path(__file__).resolve().parents[2] / "benchmarks" / "fake_service.py"
+
+@pytest.fixture(scope="module")
+def fake_url():
+    """benchmarks/fake_service.py, standing in for the User and Book services."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, str(FAKE_SERVICE), "--port", str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                requests.get(url + "/", timeout=1)
+                break
+            except requests.RequestException:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+@pytest.fixture
+def faults(fake_url):
+    """Set the fake service's faults; returns a function giving the calls it served since."""
+    def set_faults(**update):
+        requests.put(f"{fake_url}/__faults__", json={**update, "reset_calls": True}).raise_for_status()
+        return lambda: requests.get(f"{fake_url}/__faults__").json()["calls"]
+    yield set_faults
+    requests.put(f"{fake_url}/__faults__", json={"latency_ms": 0, "error_rate": 0.0, "error_status": 503})
+
+@pytest.fixture
+def rest_clients(loans, fake_url, monkeypatch):
+    """The Loan Service's clients calling the fake service over REST, with fresh breakers and no backoff."""
+    clients = loans.service_clients
+    monkeypatch.setattr(clients, "INTERNAL_TRANSPORT", "rest")
+    monkeypatch.setattr(clients, "USER_SERVICE_URL", fake_url)
+    monkeypatch.setattr(clients, "BOOK_SERVICE_URL", fake_url)
+    monkeypatch.setattr(loans.resilience, "_breakers", {})
+    monkeypatch.setattr(loans.resilience, "RETRY_BACKOFF", 0.001)
+    return clients
+
+def test_timeout_bounds_a_hung_dependency(loans, rest_clients, faults, monkeypatch):
+    calls = faults(latency_ms=2000)
+    monkeypatch.setitem(loans.resilience.READ_TIMEOUTS, "user-service", 0.2)
+
+    started = time.monotonic()
+    with pytest.raises(rest_clients.ServiceError) as error:
+        rest_clients.UserServiceClient().get_user(1)
+    assert error.value.status_code == 503
+    # Three attempts of 0.2 s each instead of waiting for the dependency
+    assert time.monotonic() - started < 1.5
+    assert calls() == loans.resilience.RETRY_ATTEMPTS
+
+def test_rest_lookups_of_many_ids_are_one_call(rest_clients, faults):
+    calls = faults()
+    books = rest_clients.BookServiceClient().get_books(range(1, 51))
+    assert sorted(books) == list(range(1, 51))
+    assert books[7]["title"] == "Book 7"
+    assert calls() == 1
+
+    calls = faults()
+    assert sorted(rest_clients.UserServiceClient().get_users([3, 1, 3, 2])) == [1, 2, 3]
+    assert calls() == 1
+
+def test_gets_are_retried_but_updates_are_not(loans, rest_clients, faults):
+    calls = faults(error_rate=1.0, error_status=503)
+    with pytest.raises(rest_clients.ServiceError):
+        rest_clients.BookServiceClient().get_book(1)
+    assert calls() == loans.resilience.RETRY_ATTEMPTS
+
+    calls = faults(error_rate=1.0, error_status=503)
+    with pytest.raises(rest_clients.ServiceError):
+        rest_clients.BookServiceClient().update_availability(1, "decrement")
+    assert calls() == 1
+
+def test_breaker_opens_short_circuits_and_recovers(loans, rest_clients, faults, monkeypatch):
+    resilience = loans.resilience
+    breaker = resilience.CircuitBreaker("user-service", failure_threshold=2, reset_timeout=0.3)
+    monkeypatch.setitem(resilience._breakers, "user-service", breaker)
+    client = rest_clients.UserServiceClient()
+
+    calls = faults(error_rate=1.0, error_status=500)
+    for user_id in (1, 2):
+        with pytest.raises(rest_clients.ServiceError):
+            client.get_user(user_id)
+    assert breaker.state == breaker.OPEN
+    served = calls()
+
+    # Open: fails at once without calling the dependency
+    with pytest.raises(rest_clients.ServiceError, match="Circuit breaker"):
+        client.get_user(3)
+    assert calls() == served
+
+    # After the reset timeout one trial call goes through and closes it again
+    faults(error_rate=0.0)
+    time.sleep(0.35)
+    assert client.get_user(4)["id"] == 4
+    assert breaker.state == breaker.CLOSED
+
+def test_a_trial_that_never_reports_back_does_not_wedge_the_breaker(loans, rest_clients, faults, monkeypatch):
+    resilience = loans.resilience
+    breaker = resilience.CircuitBreaker("user-service", failure_threshold=1, reset_timeout=0.2)
+    monkeypatch.setitem(resilience._breakers, "user-service", breaker)
+    client = rest_clients.UserServiceClient()
+    faults()
+    breaker.record_failure()
+    time.sleep(0.25)
+
+    # The trial call fails with something other than a requests error
+    def broken(*args, **kwargs):
+        raise ValueError("bad response")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(requests, "request", broken)
+        with pytest.raises(ValueError):
+            client.get_user(1)
+    assert breaker.state == breaker.OPEN
+
+    # A trial whose caller vanished is replaced once the reset timeout passes again
+    time.sleep(0.25)
+    breaker.before_call()
+    assert breaker.state == breaker.HALF_OPEN
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.25)
+    assert client.get_user(2)["id"] == 2
+    assert breaker.state == breaker.CLOSED
+
+def test_request_deadline_caps_outbound_calls(loans, rest_clients, faults):
+    faults(latency_ms=2000)
+    token = loans.resilience._deadline.set(time.monotonic() + 0.3)
+    try:
+        started = time.monotonic()
+        with pytest.raises(rest_clients.ServiceError):
+            rest_clients.UserServiceClient().get_user(1)
+        assert time.monotonic() - started < 1.0
+    finally:
+        loans.resilience._deadline.reset(token)
+
+def test_loan_details_fall_back_while_the_dependency_is_down(loans, rest_clients, faults, db, monkeypatch):
+    monkeypatch.setitem(
+        loans.resilience._breakers, "user-service",
+        loans.resilience.CircuitBreaker("user-service", failure_threshold=1, reset_timeout=60),
+    )
+    faults(error_rate=1.0, error_status=500)
+    db_loan = loans.models.Loan(user_id=7, book_id=3, due_date=loans.crud._utcnow(), status="ACTIVE")
+    db.add(db_loan)
+    db.commit()
+
+    details = loans.crud.get_loan_with_details(db, db_loan.id)
+    assert details["user"]["name"] == "User details unavailable"
+    assert details["status"] == "ACTIVE"
+    # The next lookup does not even try
+    with pytest.raises(rest_clients.ServiceError, match="Circuit breaker"):
+        rest_clients.UserServiceClient().get_user(7)
@@ -0,0 +1,105 @@
+import datetime
+
+from sqlalchemy import select
+
+def users_by_shard(loans, make_user) -> dict:
+    """A new user on every loan shard."""
+    users = {}
+    while len(users) < len(loans.sharding.SHARDS):
+        user = make_user()
+        users.setdefault(loans.sharding.shard_for_user(user["id"]), user)
+    return users
+
+def shard_loan_ids(loans, db, shard: int, user_id: int) -> list:
+    table = loans.models.Loan
+    return db.scalars(
+        select(table.id).where(table.user_id == user_id).order_by(table.id), bind_arguments=loans.sharding.on_shard(shard)
+    ).all()
+
+def test_loans_are_written_to_their_users_shard(client, loans, db, make_user, make_book, borrow):
+    sharding = loans.sharding
+    assert len(sharding.SHARDS) == 3
+    for shard, user in users_by_shard(loans, make_user).items():
+        loan = borrow(user["id"], make_book()["id"])
+        assert shard_loan_ids(loans, db, shard, user["id"]) == [loan["id"]]
+        assert loan["id"] // sharding.ID_SPACE == shard
+        assert sharding.shards_for_loan(loan["id"])[0] == shard
+        assert client.get(f"/api/loans/{loan['id']}").json()["status"] == "ACTIVE"
+        assert client.get(f"/api/loans/user/{user['id']}").json()["total"] == 1
+
+def test_reshard_moves_loans_and_back(client, loans, db, make_user, make_book, borrow):
+    sharding, reshard = loans.sharding, loans.reshard
+    user = make_user()
+    source = sharding.shard_for_user(user["id"])
+    target = (source + 1) % len(sharding.SHARDS)
+    loan_ids = [borrow(user["id"], make_book()["id"])["id"] for _ in range(2)]
+    original = list(sharding.SHARD_MAP)
+    try:
+        # shard_for_user reads this list, so it is changed in place
+        sharding.SHARD_MAP[sharding.bucket(user["id"])] = target
+        assert reshard.rebalance(dry_run=True) == {f"{source}->{target}": 2}
+        assert shard_loan_ids(loans, db, target, user["id"]) == []
+
+        assert reshard.rebalance() == {f"{source}->{target}": 2}
+        assert shard_loan_ids(loans, db, source, user["id"]) == []
+        assert shard_loan_ids(loans, db, target, user["id"]) == loan_ids
+        assert client.get(f"/api/loans/user/{user['id']}").json()["total"] == 2
+        # Found by id on the shard it moved to
+        client.post("/api/returns/", json={"loan_id": loan_ids[0]}).raise_for_status()
+        assert reshard.rebalance() == {}
+    finally:
+        sharding.SHARD_MAP[:] = original
+    assert reshard.rebalance() == {f"{target}->{source}": 2}
+    assert shard_loan_ids(loans, db, source, user["id"]) == loan_ids
+    assert client.get(f"/api/loans/{loan_ids[0]}").json()["status"] == "RETURNED"
+
+def test_overdue_listing_pages_through_every_shard(client, loans, make_user, make_book, borrow):
+    ours = set()
+    for days, user in enumerate(users_by_shard(loans, make_user).values(), start=3):
+        for extra in range(2):
+            ours.add(borrow(user["id"], make_book()["id"], due_in_days=-days - extra)["id"])
+
+    full = client.get("/api/loans/overdue", params={"limit": 500}).json()
+    assert full["total"] == len(full["loans"])
+    assert ours <= {loan["id"] for loan in full["loans"]}
+    order = [(datetime.datetime.fromisoformat(loan["due_date"]), loan["id"]) for loan in full["loans"]]
+    assert order == sorted(order)
+
+    paged = []
+    for skip in range(0, full["total"], 4):
+        page = client.get("/api/loans/overdue", params={"skip": skip, "limit": 4}).json()
+        assert page["total"] == full["total"]
+        paged.extend(loan["id"] for loan in page["loans"])
+    assert paged == [loan["id"] for loan in full["loans"]]
+
+def test_a_borrow_whose_hold_cannot_be_fulfilled_is_undone(client, loans, db, make_user, make_book, borrow, monkeypatch):
+    book = make_book(copies=1)
+    lender = make_user()
+    loan = borrow(lender["id"], book["id"])
+    user = next(user for shard, user in users_by_shard(loans, make_user).items() if shard != loans.sharding.HOME)
+    hold = client.post("/api/holds/", json={"user_id": user["id"], "book_id": book["id"]}).json()
+    client.post("/api/returns/", json={"loan_id": loan["id"]}).raise_for_status()
+    loans.outbox.dispatch_once(db)
+    shard = loans.sharding.shard_for_user(user["id"])
+
+    # The loan commits on the user's shard, then the hold fails to commit at home
+    def home_down():
+        session = loans.database.SessionLocal()
+        def commit():
+            raise RuntimeError("home unavailable")
+        session.commit = commit
+        return session
+
+    due = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)).isoformat()
+    with monkeypatch.context() as patch:
+        patch.setattr(loans.crud, "SessionLocal", home_down)
+        response = client.post("/api/loans/", json={"user_id": user["id"], "book_id": book["id"], "due_date": due})
+    assert response.status_code == 503
+    assert shard_loan_ids(loans, db, shard, user["id"]) == []
+    assert client.get(f"/api/holds/{hold['id']}").json()["status"] == "READY"
+
+    loan = borrow(user["id"], book["id"])
+    assert shard_loan_ids(loans, db, shard, user["id"]) == [loan["id"]]
+    db.expire_all()
+    fulfilled = db.get(loans.models.Hold, hold["id"])
+    assert (fulfilled.status, fulfilled.loan_id) == ("FULFILLED", loan["id"])
@@ -0,0 +1,145 @@
+import codecs
+import csv
+import json
+import tempfile
+from typing import IO, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, schemas
+
+# The Phase-1 monolith has its own copy of this module (Phase-1/bulk.py); keep
+# the two in step.
+#
+# Per-row outcomes are written, in line order, to a temporary file as each chunk
+# is committed; only the first SPOOL_BYTES of them are kept in memory. The
+# response streams them back from there.
+SPOOL_BYTES = 1024 * 1024
+
+def detect_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    """Pick the import format from the explicit query parameter or the Content-Type header."""
+    if fmt:
+        fmt = fmt.lower()
+    elif content_type and "csv" in content_type:
+        fmt = "csv"
+    elif content_type and ("ndjson" in content_type or "jsonl" in content_type or "json" in content_type):
+        fmt = "ndjson"
+
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported format. Use 'csv' or 'ndjson'."
+        )
+    return fmt
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split an incoming byte stream into text lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[Dict]]]:
+    """Yield (line number, raw record) pairs parsed incrementally from a CSV or NDJSON stream."""
+    header = None
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_no, None
+                continue
+            yield line_no, record if isinstance(record, dict) else None
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield line_no, dict(zip(header, values))
+
+async def import_users(db, chunks: AsyncIterator[bytes], fmt: str, batch_size: int) -> Tuple[Dict, IO[str]]:
+    """Register users streamed from the request body in chunks.
+
+    Returns the counts and a file holding the JSON outcome of every row, one per line.
+    """
+    counts = {"received": 0, "created": 0, "duplicates": 0, "invalid": 0}
+    results = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="w+", encoding="utf-8")
+    # Rows since the last flush, in line order: users to create, or the outcome of a rejected row
+    pending: List[Tuple[int, Union[schemas.UserCreate, Dict]]] = []
+
+    def write(line_no: int, email: Optional[str], outcome: str, user_id: Optional[int] = None, detail: Optional[str] = None):
+        results.write(json.dumps({"line": line_no, "email": email, "status": outcome, "id": user_id, "detail": detail}) + "\n")
+
+    async def flush():
+        users = [row for _, row in pending if isinstance(row, schemas.UserCreate)]
+        created = await run_in_threadpool(crud.bulk_create_users, db, users) if users else {}
+        for line_no, row in pending:
+            if not isinstance(row, schemas.UserCreate):
+                write(line_no, **row)
+                continue
+            user_id = created.pop(row.email, None)
+            if user_id is not None:
+                counts["created"] += 1
+                write(line_no, row.email, "created", user_id=user_id)
+            else:
+                counts["duplicates"] += 1
+                write(line_no, row.email, "duplicate", detail="Email already registered")
+        pending.clear()
+
+    async for line_no, record in iter_records(chunks, fmt):
+        counts["received"] += 1
+        try:
+            if record is None:
+                raise ValueError("Malformed record")
+            user = schemas.UserCreate(**record)
+        except (ValidationError, ValueError, TypeError) as e:
+            if isinstance(e, ValidationError):
+                detail = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            else:
+                detail = str(e)
+            counts["invalid"] += 1
+            # Echo the email only if it is one (an NDJSON row may carry a number or an object)
+            email = record.get("email") if record else None
+            pending.append((line_no, {
+                "email": email if isinstance(email, str) else None,
+                "outcome": "invalid",
+                "detail": detail
+            }))
+        else:
+            pending.append((line_no, user))
+        if len(pending) >= batch_size:
+            await flush()
+
+    if pending:
+        await flush()
+    results.seek(0)
+    return counts, results
+
+def summary_body(counts: Dict, results: IO[str]) -> Iterator[str]:
+    """The BulkUserSummary JSON document: the counts, then the outcomes read back from the results file."""
+    try:
+        yield json.dumps(counts)[:-1] + ', "results": ['
+        separator, lines = "", []
+        for line in results:
+            lines.append(line.rstrip("\n"))
+            if len(lines) == 1000:
+                yield separator + ", ".join(lines)
+                separator, lines = ", ", []
+        if lines:
+            yield separator + ", ".join(lines)
+        yield "]}"
+    finally:
+        results.close()
@@ -1,10 +1,28 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import select, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from fastapi import HTTPException, status
+from typing import Dict, List, Optional
 from . import models, schemas
+from .singleflight import SingleFlight
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+_user_lookups = SingleFlight("get_user")
+
+def get_user_coalesced(db: Session, user_id: int) -> Optional[schemas.User]:
+    """Like get_user, but concurrent lookups of the same user share a single query."""
+    def load():
+        db_user = get_user(db, user_id=user_id)
+        return None if db_user is None else schemas.User.model_validate(db_user)
+    return _user_lookups.do(user_id, load)
+
+def get_users_by_ids(db: Session, user_ids: List[int]) -> List[models.User]:
+    if not user_ids:
+        return []
+    return db.query(models.User).filter(models.User.id.in_(user_ids)).all()
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
@@ -23,6 +41,40 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
+def bulk_create_users(db: Session, users: List[schemas.UserCreate]) -> Dict[str, int]:
+    """Insert a chunk of users in one statement, skipping emails that are already registered.
+
+    Returns a mapping of email to new user id for the rows that were created.
+    """
+    # Dedupe within the chunk first; the first occurrence of an email wins
+    rows = {}
+    for user in users:
+        rows.setdefault(user.email, user.dict())
+    if not rows:
+        return {}
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (
+            dialect_insert(models.User)
+            .values(list(rows.values()))
+            .on_conflict_do_nothing(index_elements=[models.User.email])
+            .returning(models.User.email, models.User.id)
+        )
+        created = {email: user_id for email, user_id in db.execute(stmt)}
+    else:
+        # Generic fallback: one set query for existing emails, then insert the rest
+        existing = set(db.scalars(select(models.User.email).where(models.User.email.in_(list(rows)))))
+        new_rows = [row for email, row in rows.items() if email not in existing]
+        created = {}
+        if new_rows:
+            result = db.execute(insert(models.User).returning(models.User.email, models.User.id), new_rows)
+            created = {email: user_id for email, user_id in result}
+
+    db.commit()
+    return created
+
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     db_user = get_user(db, user_id=user_id)
     if not db_user:
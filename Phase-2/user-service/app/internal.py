@@ -0,0 +1,64 @@
+from typing import Any, Dict
+
+import msgpack
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+from .database import get_db
+
+# Service-to-service API used by the Loan Service when INTERNAL_TRANSPORT=binary.
+# Bodies are MessagePack maps with the same fields as the public JSON API; errors
+# keep FastAPI's JSON {"detail": ...} body. nginx only proxies /api/*, so these
+# routes are reachable on the service network only.
+MEDIA_TYPE = "application/msgpack"
+
+# Largest batch lookup accepted in one request
+MAX_BATCH = 1000
+
+router = APIRouter(prefix="/internal/users", include_in_schema=False)
+
+class MsgpackResponse(Response):
+    media_type = MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+async def msgpack_body(request: Request) -> Dict[str, Any]:
+    """Decode a MessagePack map request body."""
+    try:
+        body = msgpack.unpackb(await request.body())
+    except (ValueError, msgpack.UnpackException):
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Request body must be a MessagePack map"
+        )
+    return body
+
+def _dump(user) -> Dict[str, Any]:
+    return schemas.User.model_validate(user).model_dump(mode="json")
+
+@router.get("/{user_id}")
+def get_user(user_id: int, db: Session = Depends(get_db)):
+    user = crud.get_user_coalesced(db, user_id=user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return MsgpackResponse(user.model_dump(mode="json"))
+
+@router.post("/batch")
+def get_users(body: Dict[str, Any] = Depends(msgpack_body), db: Session = Depends(get_db)):
+    """Look up several users in one query; unknown ids are left out of the result."""
+    user_ids = body.get("ids")
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'ids' must be a list of integers"
+        )
+    if len(user_ids) > MAX_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH} ids per batch"
+        )
+    return MsgpackResponse({"users": [_dump(user) for user in crud.get_users_by_ids(db, user_ids)]})
@@ -1,18 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, models, schemas
+from typing import List, Optional
+from . import bulk, crud, database, internal, metrics, models, openapi, query_budget, schemas, tracing
 from .database import engine, get_db
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="Smart Library System - User Service",
     description="Microservice for managing library users",
     version="1.0.0",
 )
 
+# Pre-generated OpenAPI document (OPENAPI_FILE, see app/openapi.py)
+openapi.load(app)
+
+_tables_created = False
+
+def create_tables():
+    """Create missing tables, once per process (gunicorn workers inherit it from the master, see gunicorn.conf.py)."""
+    global _tables_created
+    if database.CREATE_TABLES and not _tables_created:
+        models.Base.metadata.create_all(bind=engine)
+    _tables_created = True
+
+# First database contact, before the worker accepts requests (see database.py)
+@app.on_event("startup")
+def prepare_database():
+    create_tables()
+    database.warm_up([engine])
+
+# Prometheus metrics: per-route latency, SQL statements per request and pool waits
+metrics.instrument_engine(engine)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
+
+# Distributed tracing: continue the caller's traceparent, with a span per SQL statement
+tracing.instrument_engine(engine)
+app.add_middleware(tracing.TracingMiddleware)
+
+# Per-route SQL statement budgets (QUERY_BUDGET_MODE=warn|raise)
+query_budget.instrument_engine(engine)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+# MessagePack API for the Loan Service (INTERNAL_TRANSPORT=binary), not proxied by nginx
+app.include_router(internal.router)
+
 @app.get("/", tags=["Root"])
 def read_root():
     return {"message": "Welcome to the User Service API"}
@@ -22,13 +54,30 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Create/register a new user."""
     return crud.create_user(db=db, user=user)
 
+@app.post("/api/users/bulk", response_model=schemas.BulkUserSummary)
+async def bulk_create_users(
+    request: Request,
+    format: Optional[str] = Query(None, description="'csv' or 'ndjson'; defaults to the request Content-Type"),
+    batch_size: int = Query(1000, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """Register many users from a streamed CSV/NDJSON body, returning an outcome for every row."""
+    fmt = bulk.detect_format(format, request.headers.get("content-type"))
+    counts, results = await bulk.import_users(db, request.stream(), fmt, batch_size)
+    return StreamingResponse(bulk.summary_body(counts, results), media_type="application/json")
+
+@app.post("/api/users/batch", response_model=schemas.UserBatch)
+def read_users_by_ids(lookup: schemas.BatchLookup, db: Session = Depends(get_db)):
+    """Look up several users by id in one query; unknown ids are left out."""
+    return {"users": crud.get_users_by_ids(db, lookup.ids)}
+
 @app.get("/api/users/{user_id}", response_model=schemas.User)
 def read_user(user_id: int, db: Session = Depends(get_db)):
     """Fetch user profile by ID."""
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
+    user = crud.get_user_coalesced(db, user_id=user_id)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return user
 
 @app.put("/api/users/{user_id}", response_model=schemas.User)
 def update_user(user_id: int, user: schemas.UserUpdate, db: Session = Depends(get_db)):
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, StrictInt
+from typing import Optional, List
 import datetime
 
 class UserBase(BaseModel):
@@ -21,4 +21,24 @@ class User(UserBase):
     updated_at: Optional[datetime.datetime] = None
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class BatchLookup(BaseModel):
+    ids: List[StrictInt] = Field(..., max_length=1000)
+
+class UserBatch(BaseModel):
+    users: List[User]  # unknown ids are left out
+
+class BulkUserResult(BaseModel):
+    line: int
+    email: Optional[str] = None
+    status: str  # "created", "duplicate" or "invalid"
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkUserSummary(BaseModel):
+    received: int
+    created: int
+    duplicates: int
+    invalid: int
+    results: List[BulkUserResult]
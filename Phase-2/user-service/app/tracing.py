@@ -0,0 +1,259 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+# Spans are exported in the Zipkin v2 JSON format, either appended as JSON lines
+# to TRACE_EXPORT_FILE ("{pid}" is replaced so every worker gets its own file)
+# or POSTed in batches to a local collector (e.g. http://zipkin:9411/api/v2/spans).
+SERVICE_NAME = os.getenv("SERVICE_NAME") or "user-service"
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE") or 1.0)
+ENABLED = bool(TRACE_EXPORT_FILE or TRACE_COLLECTOR_URL)
+
+# Long SQL is truncated in span tags
+MAX_STATEMENT_LENGTH = 500
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled", "start", "duration", "tags")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, kind: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start = time.time()
+        self.duration = None
+        self.tags: Dict[str, str] = {}
+
+    def set_tag(self, key: str, value):
+        self.tags[key] = str(value)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self):
+        self.duration = time.time() - self.start
+        if self.sampled and ENABLED:
+            _exporter.submit(self)
+
+    def to_zipkin(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.start * 1_000_000),
+            "duration": max(1, int(self.duration * 1_000_000)),
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+            "tags": self.tags,
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        if self.kind:
+            span["kind"] = self.kind
+        return span
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+# When this service does not export spans, the caller's traceparent is passed through unchanged
+_incoming_traceparent = contextvars.ContextVar("incoming_traceparent", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def parse_traceparent(header: Optional[str]):
+    """Return (trace_id, parent_span_id, sampled) from a W3C traceparent header, or None."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+@contextmanager
+def start_span(name: str, kind: Optional[str] = None, traceparent: Optional[str] = None, root: bool = True):
+    """Open a span as a child of the current one (or of an incoming traceparent).
+
+    With root=False nothing is recorded unless a trace is already in progress,
+    which keeps startup and background work from producing orphan traces.
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled, kind)
+    else:
+        incoming = parse_traceparent(traceparent)
+        if incoming:
+            span = Span(name, incoming[0], incoming[1], incoming[2], kind)
+        elif root:
+            span = Span(name, "%032x" % random.getrandbits(128), None, random.random() < TRACE_SAMPLE_RATE, kind)
+        else:
+            yield None
+            return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.set_tag("error", type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.finish()
+
+def inject_headers(headers: Optional[Dict] = None) -> Dict:
+    """Add the current trace context to outgoing request headers."""
+    headers = dict(headers or {})
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    elif _incoming_traceparent.get():
+        headers["traceparent"] = _incoming_traceparent.get()
+    return headers
+
+class _Exporter:
+    """Background thread that batches finished spans to a file and/or a collector."""
+
+    def __init__(self, max_batch: int = 256, interval: float = 1.0):
+        self.max_batch = max_batch
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=10000)
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def submit(self, span: Span):
+        if self.pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(span.to_zipkin())
+        except queue.Full:
+            pass  # Drop spans rather than slow down requests
+
+    def _start(self):
+        # Started lazily so every forked worker runs its own exporter thread
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        if not batch:
+            return
+        if TRACE_EXPORT_FILE:
+            with open(TRACE_EXPORT_FILE.replace("{pid}", str(os.getpid())), "a") as f:
+                f.write("".join(json.dumps(span) + "\n" for span in batch))
+        if TRACE_COLLECTOR_URL:
+            # Imported here: it adds tens of milliseconds to startup, and most replicas export nothing
+            import requests
+            try:
+                requests.post(TRACE_COLLECTOR_URL, json=batch, timeout=2)
+            except requests.RequestException:
+                pass
+
+    def flush(self):
+        batch = self._drain()
+        while batch:
+            self._export(batch)
+            batch = self._drain()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+_exporter = _Exporter()
+
+def instrument_engine(engine):
+    """Record a child span for every SQL statement executed inside a trace."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is None:
+            conn.info.setdefault("trace_spans", []).append(None)
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+        span = Span(f"db {operation}", parent.trace_id, parent.span_id, parent.sampled, "CLIENT")
+        span.set_tag("db.system", engine.dialect.name)
+        span.set_tag("db.statement", statement[:MAX_STATEMENT_LENGTH])
+        conn.info.setdefault("trace_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = conn.info["trace_spans"].pop()
+        if span is not None:
+            span.finish()
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        spans = exception_context.connection.info.get("trace_spans") if exception_context.connection else None
+        if spans:
+            span = spans.pop()
+            if span is not None:
+                span.set_tag("error", type(exception_context.original_exception).__name__)
+                span.finish()
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope["path"]
+
+class TracingMiddleware:
+    """ASGI middleware that continues the caller's trace (W3C traceparent) for each request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        if not ENABLED:
+            token = _incoming_traceparent.set(traceparent)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _incoming_traceparent.reset(token)
+            return
+
+        with start_span(scope["method"], kind="SERVER", traceparent=traceparent) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_tag("http.status_code", message["status"])
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"traceparent", span.traceparent.encode())]
+                await send(message)
+
+            span.set_tag("http.method", scope["method"])
+            span.set_tag("http.path", scope["path"])
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                span.name = f"{scope['method']} {_route_template(scope)}"
@@ -0,0 +1,52 @@
+# Production serving configuration (gunicorn master + uvicorn workers)
+# Usage: gunicorn app.main:app -c gunicorn.conf.py
+import multiprocessing
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+
+# One uvicorn worker per core by default; uvicorn picks uvloop/httptools when installed
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+# database.py sizes each worker's connection pool from this
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master so workers fork with modules already loaded
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Graceful shutdown: on SIGTERM workers stop accepting and finish in-flight requests
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+
+# Prometheus multiprocess mode: every worker writes samples under this directory
+# and /metrics aggregates them. Start each run from an empty directory.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+def on_starting(server):
+    # With the app preloaded, the master creates missing tables once before
+    # forking, rather than every worker at startup (app.main.create_tables)
+    if preload_app:
+        from app.main import create_tables
+        create_tables()
+
+def post_fork(server, worker):
+    # Pooled connections opened by the master (e.g. create_all before forking)
+    # must not be shared with the forked worker processes.
+    from app.database import engine
+    engine.dispose(close=False)
+
+def child_exit(server, worker):
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,200 @@
+"""Loan Service admission control while its dependencies slow down.
+
+Starts ``fake_service.py`` (standing in for the User and Book services) and the
+Loan Service under uvicorn, once with ``ADMISSION_CONTROL=off`` and once with
+it on. Client threads keep three kinds of traffic going:
+
+- ``writes``: borrow a book (``POST /api/loans/``), then return it;
+- ``history``: ``GET /api/loans/user/{id}``;
+- ``overdue``: ``GET /api/loans/overdue``.
+
+After ``--normal-seconds`` the fake dependency starts answering after
+``--latency-ms``, for ``--slow-seconds``. For each mode, phase and kind of
+request the report has the successful requests and their latency, the 503s and
+how fast they came back, and the timeouts and other errors seen by clients
+(``--client-timeout``).
+
+    python benchmarks/admission.py --latency-ms 1500 --slow-seconds 20
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import PHASE2_ROOT, emit, latency_summary
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+def wait_until_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+class Recorder:
+    """Outcomes per (phase, kind): ok and 503 latencies, timeouts and other errors."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phase = "normal"
+        self.outcomes = {}
+
+    def record(self, kind: str, outcome: str, milliseconds: float):
+        with self.lock:
+            entry = self.outcomes.setdefault((self.phase, kind), {"ok": [], "rejected": [], "timeout": 0, "error": 0})
+            if outcome in ("ok", "rejected"):
+                entry[outcome].append(milliseconds)
+            else:
+                entry[outcome] += 1
+
+    def report(self) -> dict:
+        results = {}
+        for (phase, kind), entry in sorted(self.outcomes.items()):
+            results.setdefault(phase, {})[kind] = {
+                "ok": latency_summary(entry["ok"]),
+                "rejected_503": latency_summary(entry["rejected"]),
+                "timeouts": entry["timeout"],
+                "errors": entry["error"],
+            }
+        return results
+
+def call(recorder: Recorder, kind: str, session: requests.Session, method: str, url: str, timeout: float, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=timeout, **kwargs)
+    except requests.Timeout:
+        recorder.record(kind, "timeout", 0)
+        return None
+    except requests.RequestException:
+        recorder.record(kind, "error", 0)
+        return None
+    elapsed = (time.perf_counter() - started) * 1000
+    if response.status_code == 503 and response.headers.get("retry-after"):
+        recorder.record(kind, "rejected", elapsed)
+        return None
+    if response.status_code >= 400:
+        recorder.record(kind, "error", elapsed)
+        return None
+    recorder.record(kind, "ok", elapsed)
+    return response
+
+def run(mode: str, args, fake_url: str) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-admission-{mode}-"))
+    loan_url = f"http://127.0.0.1:{args.port}"
+    env = {
+        **os.environ,
+        "LOAN_DATABASE_URL": f"sqlite:///{workdir / 'loans.db'}",
+        "USER_SERVICE_URL": fake_url,
+        "BOOK_SERVICE_URL": fake_url,
+        "INTERNAL_TRANSPORT": "rest",
+        "ADMISSION_CONTROL": mode,
+        "QUERY_BUDGET_MODE": "off",
+        "RECOMMENDATIONS_UPDATER": "off",
+        "LOAN_ARCHIVER": "off",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=PHASE2_ROOT / "loan-service", env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    recorder = Recorder()
+    stop = threading.Event()
+    due = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)).isoformat()
+
+    def writer(number: int):
+        session = requests.Session()
+        while not stop.is_set():
+            response = call(recorder, "writes", session, "POST", f"{loan_url}/api/loans/", args.client_timeout,
+                            json={"user_id": number % 50 + 1, "book_id": number % 20 + 1, "due_date": due})
+            if response is not None:
+                call(recorder, "writes", session, "POST", f"{loan_url}/api/returns/", args.client_timeout,
+                     json={"loan_id": response.json()["id"]})
+
+    def reader(kind: str, number: int):
+        session = requests.Session()
+        while not stop.is_set():
+            if kind == "history":
+                call(recorder, kind, session, "GET", f"{loan_url}/api/loans/user/{number % 50 + 1}?limit=10",
+                     args.client_timeout)
+            else:
+                call(recorder, kind, session, "GET", f"{loan_url}/api/loans/overdue?limit=20", args.client_timeout)
+
+    try:
+        wait_until_ready(loan_url)
+        requests.put(f"{fake_url}/__faults__", json={"latency_ms": 0})
+        threads = (
+            [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+            + [threading.Thread(target=reader, args=("history", i)) for i in range(args.readers)]
+            + [threading.Thread(target=reader, args=("overdue", i)) for i in range(args.stats)]
+        )
+        for thread in threads:
+            thread.start()
+        time.sleep(args.normal_seconds)
+        recorder.phase = "slow"
+        requests.put(f"{fake_url}/__faults__", json={"latency_ms": args.latency_ms})
+        time.sleep(args.slow_seconds)
+        recorder.phase = "recovery"
+        requests.put(f"{fake_url}/__faults__", json={"latency_ms": 0})
+        time.sleep(args.normal_seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            # Still working through requests queued while the dependency was slow
+            server.kill()
+            server.wait()
+    return recorder.report()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["off", "on"], choices=["off", "on"])
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=32, help="threads reading loan histories")
+    parser.add_argument("--stats", type=int, default=16, help="threads reading the overdue listing")
+    parser.add_argument("--latency-ms", type=int, default=1500, help="dependency latency while slow")
+    parser.add_argument("--normal-seconds", type=float, default=5.0)
+    parser.add_argument("--slow-seconds", type=float, default=20.0)
+    parser.add_argument("--client-timeout", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=18601)
+    parser.add_argument("--fake-port", type=int, default=18602)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "fake_service.py"), "--port", str(args.fake_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(fake_url)
+        results = {mode: run(mode, args, fake_url) for mode in args.modes}
+    finally:
+        fake.terminate()
+        fake.wait(timeout=30)
+
+    emit("admission", {
+        "latency_ms": args.latency_ms,
+        "threads": {"writes": args.writers, "history": args.readers, "overdue": args.stats},
+        "admission_control": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Book availability pushed over Server-Sent Events to many idle catalog clients.
+
+Starts the Book Service through ``serve.py`` and connects ``--subscribers``
+streams to ``GET /api/books/availability/stream``, each watching a few of
+``--books`` books. It then reports:
+
+- the server's resident memory per connected stream;
+- delivery delay, from an availability update returning to every watching
+  stream receiving the new value (updates spaced out so none are coalesced);
+- coalescing, as events received per stream for a burst of ``--burst`` updates
+  to one book;
+- the ``GET /api/books/{id}`` requests the same clients would have sent polling
+  once per ``--poll-interval`` instead.
+
+    python benchmarks/availability_stream.py --subscribers 2000 --books 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import emit, latency_summary
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+class Stream:
+    """One raw HTTP/1.1 SSE connection recording when each value arrives."""
+
+    def __init__(self, book_ids):
+        self.book_ids = book_ids
+        self.received = []  # (perf_counter, book_id, available_copies)
+
+    async def run(self, port: int, connected: asyncio.Event):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        query = ",".join(map(str, self.book_ids))
+        writer.write(
+            f"GET /api/books/availability/stream?ids={query} HTTP/1.1\r\n"
+            f"Host: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n".encode()
+        )
+        await reader.readuntil(b"\r\n\r\n")
+        connected.set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                # Chunk-size lines of the chunked encoding are skipped along with event names
+                if line.startswith(b"data: "):
+                    event = json.loads(line[6:])
+                    self.received.append((time.perf_counter(), event["book_id"], event.get("available_copies")))
+        finally:
+            writer.close()
+
+async def run_benchmark(args, base_url: str, server_pid: int, book_ids):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(7)
+
+    def patch(book_id: int, operation: str):
+        response = requests.patch(
+            f"{base_url}/api/books/{book_id}/availability",
+            json={"available_copies": 0, "operation": operation},
+        )
+        response.raise_for_status()
+        return response.json()["available_copies"]
+
+    rss_before = rss_kb(server_pid)
+    streams = [Stream(rng.sample(book_ids, args.watch)) for _ in range(args.subscribers)]
+    started = time.perf_counter()
+    tasks = []
+    for stream in streams:
+        connected = asyncio.Event()
+        tasks.append(asyncio.create_task(stream.run(args.port, connected)))
+        await connected.wait()
+    connect_seconds = time.perf_counter() - started
+    await asyncio.sleep(1.0)  # initial snapshots
+    rss_after = rss_kb(server_pid)
+
+    # Spaced-out updates, a borrow then a return per book: every watcher should see each one
+    delays = []
+    for i in range(args.updates):
+        book_id = book_ids[i // 2 % len(book_ids)]
+        value = await loop.run_in_executor(None, patch, book_id, "decrement" if i % 2 == 0 else "increment")
+        changed_at = time.perf_counter()
+        await asyncio.sleep(args.settle)
+        for stream in streams:
+            if book_id not in stream.book_ids:
+                continue
+            arrivals = [at for at, bid, available in stream.received if bid == book_id and available == value and at >= changed_at]
+            if arrivals:
+                delays.append((arrivals[0] - changed_at) * 1000)
+    expected = sum(
+        1 for i in range(args.updates) for stream in streams if book_ids[i // 2 % len(book_ids)] in stream.book_ids
+    )
+
+    # A burst of borrows of one book: coalesced into a few events per watcher
+    hot = book_ids[0]
+    before = {id(stream): sum(1 for _, bid, _ in stream.received if bid == hot) for stream in streams}
+    for _ in range(args.burst):
+        await loop.run_in_executor(None, patch, hot, "decrement")
+    await asyncio.sleep(args.settle)
+    burst_events = [
+        sum(1 for _, bid, _ in stream.received if bid == hot) - before[id(stream)]
+        for stream in streams if hot in stream.book_ids
+    ]
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "subscribers": args.subscribers,
+        "books_per_stream": args.watch,
+        "connect_seconds": round(connect_seconds, 2),
+        "server_rss_kb_per_stream": round((rss_after - rss_before) / args.subscribers, 2),
+        "delivery": {"expected": expected, "delivered": len(delays), **latency_summary(delays)},
+        "burst": {
+            "updates": args.burst,
+            "watchers": len(burst_events),
+            "max_events_per_watcher": max(burst_events, default=0),
+            "mean_events_per_watcher": round(sum(burst_events) / (len(burst_events) or 1), 2),
+        },
+        "equivalent_polling_requests_per_second": round(args.subscribers * args.watch / args.poll_interval),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=1000, help="connected streams")
+    parser.add_argument("--books", type=int, default=50, help="books in the catalog")
+    parser.add_argument("--watch", type=int, default=3, help="books watched by each stream")
+    parser.add_argument("--updates", type=int, default=20, help="spaced-out availability updates")
+    parser.add_argument("--burst", type=int, default=50, help="back-to-back borrows of one book (at most 100)")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait for deliveries after updates")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="polling interval the streams replace")
+    parser.add_argument("--port", type=int, default=18502)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    # One descriptor per stream on each side of the connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < 2 * args.subscribers + 256:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, 2 * args.subscribers + 256), hard))
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-availability-"))
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "serve.py"), "book-service", "--port", str(args.port),
+         "--db", f"sqlite:///{workdir / 'books.db'}"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(base_url)
+        book_ids = [
+            requests.post(base_url + "/api/books/", json={
+                "title": f"Book {i}", "author": "Author", "isbn": f"stream-{time.time_ns()}-{i}",
+                "genre": "Fiction", "copies": 100,
+            }).json()["id"]
+            for i in range(args.books)
+        ]
+        results = asyncio.run(run_benchmark(args, base_url, server.pid, book_ids))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    emit("availability_stream", results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Throughput of one-by-one user registration versus the streaming bulk endpoint.
+
+Runs in-process against throwaway SQLite databases by default; pass
+``--user-db``/``--phase1-db`` to point at local Postgres instead.
+
+    python benchmarks/bulk_users.py --rows 20000
+"""
+import argparse
+import json
+import tempfile
+import warnings
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from common import Timer, emit, load_phase1, load_service
+
+def make_rows(count: int, prefix: str):
+    roles = ("student", "student", "student", "faculty")
+    return [
+        {"name": f"Student {i}", "email": f"{prefix}{i}@example.edu", "role": roles[i % len(roles)]}
+        for i in range(count)
+    ]
+
+def run_single(client: TestClient, rows) -> float:
+    with Timer() as timer:
+        for row in rows:
+            response = client.post("/api/users/", json=row)
+            assert response.status_code == 201, response.text
+    return timer.seconds
+
+def run_bulk(client: TestClient, rows, batch_size: int) -> float:
+    body = "".join(json.dumps(row) + "\n" for row in rows).encode()
+    with Timer() as timer:
+        response = client.post(
+            f"/api/users/bulk?batch_size={batch_size}",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+    assert response.status_code == 200, response.text
+    assert response.json()["created"] == len(rows), response.json()
+    return timer.seconds
+
+def measure(client: TestClient, rows: int, single_rows: int, batch_size: int, label: str) -> dict:
+    single = run_single(client, make_rows(single_rows, f"{label}-single-"))
+    bulk = run_bulk(client, make_rows(rows, f"{label}-bulk-"), batch_size)
+    return {
+        "single_rows": single_rows,
+        "single_seconds": round(single, 3),
+        "single_rows_per_sec": round(single_rows / single, 1),
+        "bulk_rows": rows,
+        "bulk_seconds": round(bulk, 3),
+        "bulk_rows_per_sec": round(rows / bulk, 1),
+        "speedup": round((rows / bulk) / (single_rows / single), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="rows sent through the bulk endpoint")
+    parser.add_argument("--single-rows", type=int, default=1000, help="rows registered one request at a time")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--user-db", help="USER_DATABASE_URL for the Phase-2 User Service")
+    parser.add_argument("--phase1-db", help="DATABASE_URL for the Phase-1 monolith")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-bulk-users-"))
+    user_db = args.user_db or f"sqlite:///{workdir / 'users.db'}"
+    phase1_db = args.phase1_db or f"sqlite:///{workdir / 'phase1.db'}"
+
+    results = {}
+    user_service = load_service("user-service", {"USER_DATABASE_URL": user_db})
+    with TestClient(user_service.app) as client:
+        results["phase2_user_service"] = measure(client, args.rows, args.single_rows, args.batch_size, "p2")
+    phase1 = load_phase1({"DATABASE_URL": phase1_db})
+    with TestClient(phase1.app) as client:
+        results["phase1_monolith"] = measure(client, args.rows, args.single_rows, args.batch_size, "p1")
+
+    emit("bulk_users", results, args.output)
+
+if __name__ == "__main__":
+    main()
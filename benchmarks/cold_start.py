@@ -0,0 +1,127 @@
+"""Cold start of the Phase-2 services: time until a new process answers.
+
+Starts each service with ``uvicorn app.main:app`` from its directory, the way a
+new replica starts, ``--runs`` times per configuration, and reports medians of:
+
+- ``import_s``: importing ``app.main`` in a fresh interpreter (no database
+  contact happens here);
+- ``ready_s``: from spawning the server to the first ``GET /`` answered, which
+  includes the startup hooks (table creation, pool warm-up);
+- ``first_db_request_ms``: the first request that needs the database;
+- ``first_openapi_ms``: the first ``GET /openapi.json``.
+
+Configurations: ``default``; ``no_create_tables`` (``DB_CREATE_TABLES=off``);
+``warm_pool`` (``DB_WARMUP_CONNECTIONS=5``); ``openapi_file`` (``OPENAPI_FILE``
+generated beforehand with ``python -m app.openapi``). The databases are created
+by a first, untimed start.
+
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py --db-template postgresql://localhost/{service}
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import PHASE2_ROOT, emit
+
+SERVICES = {
+    "user-service": ("USER_DATABASE_URL", "/api/users/1"),
+    "book-service": ("BOOK_DATABASE_URL", "/api/books/1"),
+    "loan-service": ("LOAN_DATABASE_URL", "/api/loans/1"),
+}
+CONFIGURATIONS = {
+    "default": {},
+    "no_create_tables": {"DB_CREATE_TABLES": "off"},
+    "warm_pool": {"DB_WARMUP_CONNECTIONS": "5"},
+    "openapi_file": {"OPENAPI_FILE": "{openapi}"},
+}
+
+def timed_get(url: str) -> float:
+    started = time.perf_counter()
+    requests.get(url, timeout=30)
+    return (time.perf_counter() - started) * 1000
+
+def import_seconds(service_dir: Path, env: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"],
+        cwd=service_dir, env=env, capture_output=True, text=True, check=True,
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+def start(service_dir: Path, env: dict, port: int, timeout: float = 60.0):
+    """Spawn the service; returns (process, seconds until GET / answered)."""
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=service_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    while time.perf_counter() - started < timeout:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return server, time.perf_counter() - started
+        except requests.RequestException:
+            pass
+        if server.poll() is not None:
+            raise RuntimeError(f"{service_dir.name} exited with {server.returncode}")
+        time.sleep(0.005)
+    server.kill()
+    raise RuntimeError(f"{service_dir.name} did not become ready")
+
+def stop(server):
+    server.terminate()
+    server.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", nargs="+", default=list(SERVICES), choices=list(SERVICES))
+    parser.add_argument("--runs", type=int, default=5, help="starts per service and configuration")
+    parser.add_argument("--db-template", help="database URL with {service}, e.g. postgresql://localhost/{service} "
+                                              "(defaults to throwaway SQLite files)")
+    parser.add_argument("--port", type=int, default=18701)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-cold-start-"))
+    results = {}
+    for service in args.services:
+        service_dir = PHASE2_ROOT / service
+        url_variable, db_path = SERVICES[service]
+        database_url = (args.db_template.format(service=service.split("-")[0]) if args.db_template
+                        else f"sqlite:///{workdir / service}.db")
+        base_env = {**os.environ, url_variable: database_url, "QUERY_BUDGET_MODE": "off",
+                    "OUTBOX_DISPATCHER": "off", "RECOMMENDATIONS_UPDATER": "off", "LOAN_ARCHIVER": "off"}
+        base_env.pop("OPENAPI_FILE", None)
+        openapi_path = workdir / f"{service}-openapi.json"
+        subprocess.run([sys.executable, "-m", "app.openapi", str(openapi_path)], cwd=service_dir, env=base_env, check=True)
+        # Creates the tables, so every timed start finds them
+        server, _ = start(service_dir, base_env, args.port)
+        stop(server)
+
+        results[service] = {}
+        for name, overrides in CONFIGURATIONS.items():
+            env = {**base_env, **{key: value.format(openapi=openapi_path) for key, value in overrides.items()}}
+            samples = {"import_s": [], "ready_s": [], "first_db_request_ms": [], "first_openapi_ms": []}
+            for _ in range(args.runs):
+                samples["import_s"].append(import_seconds(service_dir, env))
+                server, ready = start(service_dir, env, args.port)
+                try:
+                    samples["ready_s"].append(ready)
+                    samples["first_db_request_ms"].append(timed_get(f"http://127.0.0.1:{args.port}{db_path}"))
+                    samples["first_openapi_ms"].append(timed_get(f"http://127.0.0.1:{args.port}/openapi.json"))
+                finally:
+                    stop(server)
+            results[service][name] = {key: round(statistics.median(values), 3) for key, values in samples.items()}
+
+    emit("cold_start", results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Co-located deployment versus three services talking HTTP.
+
+Runs the Phase-2 system three ways on fresh SQLite files, each behind one
+uvicorn worker per process:
+
+- ``distributed_rest``: the three services as separate processes, the Loan
+  Service calling the others' public JSON API (the default);
+- ``distributed_binary``: the same with ``INTERNAL_TRANSPORT=binary``;
+- ``colocated``: ``Phase-2/colocated.py``, all three in one process with
+  in-process calls.
+
+For each it seeds ``--users`` users and ``--books`` books over HTTP, then times
+borrowing, loan details, loan history (``--history`` loans per user) and
+returning, one request at a time, plus a plain book lookup that makes no
+internal call. It also reports the resident memory of the server processes.
+
+    python benchmarks/colocated.py --iterations 300
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import PHASE2_ROOT, emit, latency_summary
+
+def wait_until_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+def rss_mb(pids) -> float:
+    """Resident memory of the given processes (Linux /proc; 0 elsewhere)."""
+    total_kb = 0
+    for pid in pids:
+        try:
+            status = Path(f"/proc/{pid}/status").read_text()
+        except OSError:
+            return 0.0
+        total_kb += next(int(line.split()[1]) for line in status.splitlines() if line.startswith("VmRSS:"))
+    return round(total_kb / 1024, 1)
+
+def uvicorn(target: str, cwd: Path, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+def start(mode: str, workdir: Path, port: int):
+    """Start the system for mode; returns (processes, user URL, book URL, loan URL)."""
+    env = {
+        **os.environ,
+        "USER_DATABASE_URL": f"sqlite:///{workdir / 'users.db'}",
+        "BOOK_DATABASE_URL": f"sqlite:///{workdir / 'books.db'}",
+        "LOAN_DATABASE_URL": f"sqlite:///{workdir / 'loans.db'}",
+        "QUERY_BUDGET_MODE": "off",
+        "RECOMMENDATIONS_UPDATER": "off",
+        "LOAN_ARCHIVER": "off",
+    }
+    if mode == "colocated":
+        url = f"http://127.0.0.1:{port}"
+        processes = [uvicorn("colocated:app", PHASE2_ROOT, port, env)]
+        wait_until_ready(url)
+        return processes, url, url, url
+    urls = [f"http://127.0.0.1:{port + offset}" for offset in range(3)]
+    env.update({
+        "USER_SERVICE_URL": urls[0],
+        "BOOK_SERVICE_URL": urls[1],
+        "INTERNAL_TRANSPORT": mode.split("_", 1)[1],
+    })
+    processes = [
+        uvicorn("app.main:app", PHASE2_ROOT / service, port + offset, env)
+        for offset, service in enumerate(("user-service", "book-service", "loan-service"))
+    ]
+    for url in urls:
+        wait_until_ready(url)
+    return processes, *urls
+
+def timed(session: requests.Session, requests_to_send) -> dict:
+    latencies = []
+    for method, url, body in requests_to_send:
+        started = time.perf_counter()
+        response = session.request(method, url, json=body)
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+    return latency_summary(latencies)
+
+def run(mode: str, args, workdir: Path) -> dict:
+    processes, user_url, book_url, loan_url = start(mode, workdir, args.port)
+    try:
+        session = requests.Session()
+        user_ids = [
+            session.post(f"{user_url}/api/users/", json={
+                "name": f"Reader {i}", "email": f"reader{i}@example.com", "role": "student",
+            }).json()["id"]
+            for i in range(args.users)
+        ]
+        book_ids = [
+            session.post(f"{book_url}/api/books/", json={
+                "title": f"Book {i}", "author": f"Author {i % 50}", "isbn": f"colocated-{i}",
+                "genre": "Fiction", "copies": args.iterations + args.history * args.users,
+            }).json()["id"]
+            for i in range(args.books)
+        ]
+        due = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)).isoformat()
+        for user_id in user_ids:
+            for i in range(args.history):
+                session.post(f"{loan_url}/api/loans/", json={
+                    "user_id": user_id, "book_id": book_ids[(user_id + i) % len(book_ids)], "due_date": due,
+                }).raise_for_status()
+        rss_seeded = rss_mb(process.pid for process in processes)
+
+        n = args.iterations
+        borrows = [
+            ("POST", f"{loan_url}/api/loans/", {"user_id": user_ids[i % len(user_ids)],
+                                                "book_id": book_ids[i % len(book_ids)], "due_date": due})
+            for i in range(n)
+        ]
+        results = {"borrow": timed(session, borrows)}
+        loans = session.get(f"{loan_url}/api/loans/user/{user_ids[0]}", params={"limit": 100}).json()["loans"]
+        loan_ids = [loan["id"] for loan in loans]
+        results["loan_details"] = timed(session, [("GET", f"{loan_url}/api/loans/{loan_ids[i % len(loan_ids)]}", None)
+                                                  for i in range(n)])
+        results["loan_history"] = timed(session, [
+            ("GET", f"{loan_url}/api/loans/user/{user_ids[i % len(user_ids)]}?limit={args.history}", None)
+            for i in range(n)
+        ])
+        active = [
+            loan["id"]
+            for user_id in user_ids
+            for loan in session.get(f"{loan_url}/api/loans/user/{user_id}",
+                                    params={"active_only": True, "limit": 100}).json()["loans"]
+        ][:n]
+        results["return"] = timed(session, [("POST", f"{loan_url}/api/returns/", {"loan_id": loan_id})
+                                            for loan_id in active])
+        results["book_lookup"] = timed(session, [("GET", f"{book_url}/api/books/{book_ids[i % len(book_ids)]}", None)
+                                                 for i in range(n)])
+        results["processes"] = len(processes)
+        results["rss_mb"] = {"seeded": rss_seeded, "end": rss_mb(process.pid for process in processes)}
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["distributed_rest", "distributed_binary", "colocated"],
+                        choices=["distributed_rest", "distributed_binary", "colocated"])
+    parser.add_argument("--iterations", type=int, default=300, help="requests per operation")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--books", type=int, default=50)
+    parser.add_argument("--history", type=int, default=20, help="loans per user before timing")
+    parser.add_argument("--port", type=int, default=18801, help="first port (distributed modes use three)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    results = {}
+    for mode in args.modes:
+        results[mode] = run(mode, args, Path(tempfile.mkdtemp(prefix=f"bench-{mode}-")))
+    if "colocated" in results:
+        operations = ("borrow", "loan_details", "loan_history", "return", "book_lookup")
+        results["p50_speedup_colocated_vs"] = {
+            mode: {name: round(results[mode][name]["p50_ms"] / (results["colocated"][name]["p50_ms"] or 1), 2)
+                   for name in operations}
+            for mode in results if mode.startswith("distributed")
+        }
+    emit("colocated", results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Shared helpers for the benchmark scripts.
+
+Every Phase-2 service ships its code as a package literally called ``app``,
+so the loaders below import each one under its own module name. That lets a
+single benchmark process host several services side by side (metrics they all
+define are shared, see ``metrics._shared``).
+"""
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PHASE2_ROOT = REPO_ROOT / "Phase-2"
+
+def load_service(service: str, env: dict):
+    """Import ``Phase-2/<service>/app`` as ``<service>_app`` and return its ``main`` module."""
+    os.environ.update(env)
+    package = service.replace("-", "_") + "_app"
+    if package not in sys.modules:
+        app_dir = PHASE2_ROOT / service / "app"
+        spec = importlib.util.spec_from_file_location(
+            package, app_dir / "__init__.py", submodule_search_locations=[str(app_dir)]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[package] = module
+        spec.loader.exec_module(module)
+    return importlib.import_module(f"{package}.main")
+
+def load_phase1(env: dict):
+    """Import the monolith (``Phase-1.main``) with the given environment."""
+    os.environ.update(env)
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    return importlib.import_module("Phase-1.main")
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def latency_summary(samples_ms) -> dict:
+    return {
+        "count": len(samples_ms),
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+    }
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+
+def emit(name: str, results: dict, output: str = None):
+    """Print results as JSON (and optionally write them to a file) for machine consumption."""
+    payload = {"benchmark": name, "results": results}
+    text = json.dumps(payload, indent=2, default=str)
+    print(text)
+    if output:
+        Path(output).write_text(text + "\n")
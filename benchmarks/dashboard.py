@@ -0,0 +1,143 @@
+"""A user dashboard from separate calls versus the aggregate endpoint.
+
+Starts the three Phase-2 services (one uvicorn process each, on fresh SQLite
+files), gives a user ``--loans`` open loans, then renders their dashboard two
+ways, ``--iterations`` times each:
+
+- ``separate``: what a client does without the aggregate endpoint:
+  ``GET /api/users/{id}``, ``GET /api/loans/user/{id}?active_only=true`` and
+  ``GET /api/books/{id}`` per loan, one after the other;
+- ``aggregate``: ``GET /api/dashboard/users/{id}``.
+
+Every client round trip also waits ``--rtt-ms``, standing in for a slow mobile
+link. The report has latency, round trips and response bytes per dashboard.
+
+    python benchmarks/dashboard.py --loans 10 --rtt-ms 100 --transport binary
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import PHASE2_ROOT, emit, latency_summary
+
+SERVICES = ("user-service", "book-service", "loan-service")
+
+def wait_until_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+class Client:
+    """A requests session that waits one simulated round trip per request and counts them."""
+
+    def __init__(self, rtt_ms: float):
+        self.session = requests.Session()
+        self.rtt = rtt_ms / 1000
+        self.round_trips = 0
+        self.bytes = 0
+
+    def get(self, url: str, **kwargs):
+        time.sleep(self.rtt)
+        response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        self.round_trips += 1
+        self.bytes += len(response.content)
+        return response.json()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=10, help="open loans of the user")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--rtt-ms", type=float, default=100.0, help="simulated client round-trip time")
+    parser.add_argument("--transport", choices=["rest", "binary"], default="binary", help="Loan Service INTERNAL_TRANSPORT")
+    parser.add_argument("--port", type=int, default=18901, help="first of three ports")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-dashboard-"))
+    user_url, book_url, loan_url = (f"http://127.0.0.1:{args.port + offset}" for offset in range(3))
+    env = {
+        **os.environ,
+        "USER_DATABASE_URL": f"sqlite:///{workdir / 'users.db'}",
+        "BOOK_DATABASE_URL": f"sqlite:///{workdir / 'books.db'}",
+        "LOAN_DATABASE_URL": f"sqlite:///{workdir / 'loans.db'}",
+        "USER_SERVICE_URL": user_url,
+        "BOOK_SERVICE_URL": book_url,
+        "INTERNAL_TRANSPORT": args.transport,
+        "QUERY_BUDGET_MODE": "off",
+    }
+    servers = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port + offset), "--log-level", "warning"],
+            cwd=PHASE2_ROOT / service, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for offset, service in enumerate(SERVICES)
+    ]
+    try:
+        for url in (user_url, book_url, loan_url):
+            wait_until_ready(url)
+        user_id = requests.post(f"{user_url}/api/users/", json={
+            "name": "Dashboard Reader", "email": "dashboard@example.com", "role": "student",
+        }).json()["id"]
+        due = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)
+        for i in range(args.loans):
+            book_id = requests.post(f"{book_url}/api/books/", json={
+                "title": f"Dashboard Book {i}", "author": f"Author {i}", "isbn": f"dashboard-{i}", "copies": 1,
+            }).json()["id"]
+            # A few of them overdue
+            due_date = due - datetime.timedelta(days=21) if i % 4 == 0 else due
+            requests.post(f"{loan_url}/api/loans/", json={
+                "user_id": user_id, "book_id": book_id, "due_date": due_date.isoformat(),
+            }).raise_for_status()
+
+        def separate(client: Client):
+            client.get(f"{user_url}/api/users/{user_id}")
+            loans = client.get(f"{loan_url}/api/loans/user/{user_id}", params={"active_only": True})["loans"]
+            for loan in loans:
+                client.get(f"{book_url}/api/books/{loan['book']['id']}")
+
+        def aggregate(client: Client):
+            client.get(f"{loan_url}/api/dashboard/users/{user_id}")
+
+        results = {"loans": args.loans, "rtt_ms": args.rtt_ms, "transport": args.transport}
+        for name, render in (("separate", separate), ("aggregate", aggregate)):
+            client = Client(args.rtt_ms)
+            render(client)  # warm up connections
+            client.round_trips = client.bytes = 0
+            latencies = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                render(client)
+                latencies.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                "latency": latency_summary(latencies),
+                "round_trips": client.round_trips // args.iterations,
+                "response_bytes": client.bytes // args.iterations,
+            }
+        results["p50_speedup"] = round(
+            results["separate"]["latency"]["p50_ms"] / (results["aggregate"]["latency"]["p50_ms"] or 1), 2
+        )
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait(timeout=30)
+
+    emit("dashboard", results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Faceted catalog search: genre and author counts next to the search results.
+
+Loads the Book Service in-process on a throwaway SQLite file (or ``--db``)
+with ``--books`` generated books, then times ``GET /api/books/`` for a set of
+searches three ways:
+
+- ``plain``: results and total only;
+- ``facets_cold``: with ``facets=true`` and the facet cache dropped before
+  every request;
+- ``facets_cached``: with ``facets=true`` while the counts are cached.
+
+It also reports the SQL statements each kind of request runs.
+
+    python benchmarks/facets.py --books 100000
+"""
+import argparse
+import random
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from common import emit, latency_summary, load_service
+
+WORDS = "river night garden silent empire shadow winter city golden stone ocean fire glass dream".split()
+GENRES = ["Fiction", "Science Fiction", "History", "Poetry", "Biography", "Programming", "Travel", None]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--authors", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5, help="passes over the searches per mode")
+    parser.add_argument("--db", help="database URL (defaults to a throwaway SQLite file)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    db_url = args.db or f"sqlite:///{Path(tempfile.mkdtemp(prefix='bench-facets-')) / 'books.db'}"
+    main_module = load_service("book-service", {"BOOK_DATABASE_URL": db_url, "QUERY_BUDGET_MODE": "off"})
+    main_module.create_tables()
+    package = main_module.__name__.rsplit(".", 1)[0]
+    crud, schemas, facets = (__import__(f"{package}.{name}", fromlist=[name]) for name in ("crud", "schemas", "facets"))
+    SessionLocal = main_module.get_db.__globals__["SessionLocal"]
+    engine = main_module.engine
+
+    rng = random.Random(11)
+    with SessionLocal() as db:
+        for start in range(0, args.books, 5000):
+            crud.bulk_create_books(db, [
+                schemas.BookCreate(
+                    title=f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {number}",
+                    author=f"Author {rng.randrange(args.authors)}",
+                    isbn=f"isbn-{number}",
+                    genre=rng.choice(GENRES),
+                    copies=1,
+                )
+                for number in range(start, min(start + 5000, args.books))
+            ])
+    searches = [None] + WORDS[:6] + ["author 1", "history"]
+
+    statements = [0]
+    event.listen(engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+    results = {"books": args.books, "searches": len(searches)}
+    # Without the startup hooks: the typeahead indexer's scan would compete with the searches
+    client = TestClient(main_module.app)
+    for mode in ("plain", "facets_cold", "facets_cached"):
+        if mode == "facets_cached":
+            for search in searches:
+                client.get("/api/books/", params={"search": search, "facets": True}).raise_for_status()
+        latencies, queries = [], []
+        for _ in range(args.rounds):
+            for search in searches:
+                if mode == "facets_cold":
+                    facets.cache.invalidate()
+                params = {"search": search, "limit": 20, "facets": mode != "plain"}
+                statements[0] = 0
+                started = time.perf_counter()
+                response = client.get("/api/books/", params=params)
+                latencies.append((time.perf_counter() - started) * 1000)
+                queries.append(statements[0])
+                response.raise_for_status()
+        results[mode] = {"latency": latency_summary(latencies), "sql_statements_per_request": max(queries)}
+
+    emit("facets", results, args.output)
+
+if __name__ == "__main__":
+    main()
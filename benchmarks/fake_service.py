@@ -0,0 +1,92 @@
+"""Stand-in for the User and Book services with injectable latency and errors.
+
+Serves ``GET /api/users/{id}``, ``GET /api/books/{id}``, the batch lookups
+``POST /api/users/batch`` and ``POST /api/books/batch``, and
+``PATCH /api/books/{id}/availability`` with canned data. Faults are set on the
+command line or changed while running with ``PUT /__faults__``, and
+``GET /__faults__`` returns the current faults plus the number of calls served.
+
+    python benchmarks/fake_service.py --port 18201 --latency-ms 3000 --error-rate 0.5
+"""
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import Body, FastAPI
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake dependency")
+
+faults = {"latency_ms": 0, "error_rate": 0.0, "error_status": 503}
+calls = {"total": 0}
+
+async def inject():
+    """Apply the configured latency, then maybe answer with an error instead."""
+    calls["total"] += 1
+    if faults["latency_ms"]:
+        await asyncio.sleep(faults["latency_ms"] / 1000)
+    if random.random() < faults["error_rate"]:
+        return JSONResponse({"detail": "injected failure"}, status_code=faults["error_status"])
+    return None
+
+@app.get("/")
+def read_root():
+    return {"message": "Fake dependency"}
+
+@app.get("/__faults__")
+def read_faults():
+    return {**faults, "calls": calls["total"]}
+
+@app.put("/__faults__")
+def update_faults(update: dict = Body(...)):
+    faults.update({key: value for key, value in update.items() if key in faults})
+    if update.get("reset_calls"):
+        calls["total"] = 0
+    return {**faults, "calls": calls["total"]}
+
+def user(user_id: int) -> dict:
+    return {
+        "id": user_id, "name": f"User {user_id}", "email": f"user{user_id}@example.edu",
+        "role": "student", "created_at": "2024-01-01T00:00:00", "updated_at": None,
+    }
+
+@app.post("/api/users/batch")
+async def read_users(lookup: dict = Body(...)):
+    return await inject() or {"users": [user(user_id) for user_id in lookup["ids"]]}
+
+@app.get("/api/users/{user_id}")
+async def read_user(user_id: int):
+    return await inject() or user(user_id)
+
+def book(book_id: int) -> dict:
+    return {
+        "id": book_id, "title": f"Book {book_id}", "author": "Fake Author", "isbn": f"fake-{book_id}",
+        "genre": None, "copies": 5, "available_copies": 5,
+        "created_at": "2024-01-01T00:00:00", "updated_at": None,
+    }
+
+@app.post("/api/books/batch")
+async def read_books(lookup: dict = Body(...)):
+    return await inject() or {"books": [book(book_id) for book_id in lookup["ids"]]}
+
+@app.get("/api/books/{book_id}")
+async def read_book(book_id: int):
+    return await inject() or book(book_id)
+
+@app.patch("/api/books/{book_id}/availability")
+async def update_availability(book_id: int):
+    return await inject() or book(book_id)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+    faults.update(latency_ms=args.latency_ms, error_rate=args.error_rate, error_status=args.error_status)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Loan Service behaviour when its dependencies are slow or failing.
+
+Runs the Loan Service in-process against ``fake_service.py`` (standing in for
+both the User and Book services). It injects latency and errors and checks
+the per-target timeouts, request deadlines, GET retries and circuit breaker.
+For every scenario it reports the request latency, how many book lookups fell
+back to "details unavailable", and how many calls reached the dependency.
+
+    python benchmarks/fault_injection.py --output fault_injection.json
+"""
+import argparse
+import datetime
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import emit, latency_summary, load_service
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"fake service at {base_url} did not become ready")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=18201, help="port for the fake dependency")
+    parser.add_argument("--loans", type=int, default=5, help="loans in the user's history")
+    parser.add_argument("--requests", type=int, default=10, help="history requests per scenario")
+    parser.add_argument("--timeout", type=float, default=0.5, help="per-target read timeout (seconds)")
+    parser.add_argument("--reset-timeout", type=float, default=1.0, help="circuit breaker reset timeout (seconds)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    fake_url = f"http://127.0.0.1:{args.port}"
+    fake = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "fake_service.py"), "--port", str(args.port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(fake_url)
+        db_path = Path(tempfile.mkdtemp(prefix="bench-faults-")) / "loans.db"
+        loans_main = load_service("loan-service", {
+            "LOAN_DATABASE_URL": f"sqlite:///{db_path}",
+            "USER_SERVICE_URL": fake_url,
+            "BOOK_SERVICE_URL": fake_url,
+            "USER_SERVICE_TIMEOUT": str(args.timeout),
+            "BOOK_SERVICE_TIMEOUT": str(args.timeout),
+            "BREAKER_RESET_TIMEOUT": str(args.reset_timeout),
+        })
+        loans_main.create_tables()
+        resilience = sys.modules["loan_service_app.resilience"]
+        from fastapi.testclient import TestClient
+
+        db = sys.modules["loan_service_app.database"].SessionLocal()
+        due = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)
+        for book_id in range(1, args.loans + 1):
+            db.add(loans_main.models.Loan(user_id=1, book_id=book_id, due_date=due, status="ACTIVE"))
+        db.commit()
+        db.close()
+        client = TestClient(loans_main.app)
+
+        def set_faults(**faults):
+            requests.put(fake_url + "/__faults__", json={**faults, "reset_calls": True}).raise_for_status()
+
+        def run(name, headers=None, fresh_breaker=True):
+            if fresh_breaker:
+                resilience._breakers.clear()
+            latencies, fallbacks = [], 0
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = client.get("/api/loans/user/1", headers=headers or {})
+                latencies.append((time.perf_counter() - started) * 1000)
+                fallbacks += sum(
+                    loan["book"]["title"] == "Book details unavailable" for loan in response.json()["loans"]
+                )
+            breaker = resilience._breakers.get("book-service")
+            return name, {
+                "fallback_lookups": fallbacks,
+                "lookups": args.requests * args.loans,
+                "calls_reaching_dependency": requests.get(fake_url + "/__faults__").json()["calls"],
+                "breaker_state": breaker.state if breaker else "closed",
+                **latency_summary(latencies),
+                "max_ms": round(max(latencies), 3),
+            }
+
+        scenarios = {}
+        set_faults(latency_ms=0, error_rate=0.0)
+        scenarios.update([run("healthy")])
+        # Slower than the read timeout: calls time out, are retried, then the breaker opens
+        set_faults(latency_ms=int(args.timeout * 4000), error_rate=0.0)
+        scenarios.update([run("hung_dependency")])
+        # The caller's deadline caps every outbound call, even before the breaker trips
+        set_faults(latency_ms=int(args.timeout * 4000), error_rate=0.0)
+        scenarios.update([run("hung_dependency_with_300ms_deadline", headers={"X-Request-Timeout": "300"})])
+        # Every call fails fast with 503: retried, then short-circuited once the breaker opens
+        set_faults(latency_ms=0, error_rate=1.0)
+        scenarios.update([run("failing_dependency")])
+        # The dependency recovers: after the reset timeout a trial call closes the breaker again
+        set_faults(latency_ms=0, error_rate=0.0)
+        time.sleep(args.reset_timeout)
+        scenarios.update([run("recovered_dependency", fresh_breaker=False)])
+    finally:
+        fake.terminate()
+        fake.wait(timeout=30)
+
+    emit("fault_injection", {
+        "read_timeout_s": args.timeout,
+        "retry_attempts": resilience.RETRY_ATTEMPTS,
+        "breaker_failure_threshold": resilience.BREAKER_FAILURE_THRESHOLD,
+        "scenarios": scenarios,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
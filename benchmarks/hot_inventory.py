@@ -0,0 +1,130 @@
+"""Borrow/return throughput for one hot book: single row versus sharded inventory.
+
+Loads the Book Service in-process and runs threads that borrow and return
+copies of the same book through ``crud.update_availability``, each with its own
+session. It runs once with the plain ``books.available_copies`` row and once per
+requested shard count. For each mode it reports operations/second, latency
+percentiles and whether the final availability matches the completed borrows.
+
+Row-lock contention only shows on PostgreSQL (``--db``); SQLite serialises
+every write on the database file, whatever the mode.
+
+    python benchmarks/hot_inventory.py --threads 16 --shards 4 16 --db postgresql://...
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from common import emit, latency_summary, load_service
+
+def run_mode(main_module, crud, schemas, book_id: int, shards: int, threads: int, duration: float) -> dict:
+    SessionLocal = sys.modules["book_service_app.database"].SessionLocal
+    db = SessionLocal()
+    crud.set_inventory(db, book_id, schemas.InventoryUpdate(shards=shards))
+    initial = crud.get_inventory(db, book_id)["available_copies"]
+    db.close()
+
+    latencies, rejected, errors, outstanding = [], [0], [0], [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        session = SessionLocal()
+        local_latencies, local_rejected, local_errors, held = [], 0, 0, 0
+        barrier.wait()
+        while time.perf_counter() < stop:
+            # Return a copy when holding one, so the book never runs dry for long
+            operation = "increment" if held else "decrement"
+            started = time.perf_counter()
+            try:
+                crud.update_availability(session, book_id, schemas.AvailabilityUpdate(available_copies=0, operation=operation))
+                held += 1 if operation == "decrement" else -1
+                local_latencies.append((time.perf_counter() - started) * 1000)
+            except HTTPException:
+                local_rejected += 1
+                session.rollback()
+            except Exception:
+                local_errors += 1
+                session.rollback()
+        session.close()
+        with lock:
+            latencies.extend(local_latencies)
+            rejected[0] += local_rejected
+            errors[0] += local_errors
+            outstanding[0] += held
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    final = crud.get_inventory(db, book_id)
+    # Fold the shards back so the next mode starts from the book row
+    crud.set_inventory(db, book_id, schemas.InventoryUpdate(shards=0))
+    db.close()
+    return {
+        "shards": shards,
+        "ops_per_sec": round(len(latencies) / elapsed, 1),
+        "rejected": rejected[0],
+        "errors": errors[0],
+        "final_available": final["available_copies"],
+        "expected_available": initial - outstanding[0],
+        "consistent": final["available_copies"] == initial - outstanding[0],
+        **latency_summary(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--shards", type=int, nargs="+", default=[4, 16], help="shard counts to compare")
+    parser.add_argument("--copies", type=int, default=64, help="copies of the hot book")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per mode")
+    parser.add_argument("--db", help="database URL (defaults to a throwaway SQLite file)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    db_url = args.db or f"sqlite:///{Path(tempfile.mkdtemp(prefix='bench-inventory-')) / 'books.db'}"
+    main_module = load_service("book-service", {
+        "BOOK_DATABASE_URL": db_url,
+        "DB_POOL_SIZE": str(args.threads),
+        "QUERY_BUDGET_MODE": "off",
+    })
+    main_module.create_tables()
+    crud, schemas = main_module.crud, main_module.schemas
+
+    db = sys.modules["book_service_app.database"].SessionLocal()
+    book = crud.create_book(db, schemas.BookCreate(
+        title="Launch Day", author="Someone Famous", isbn=f"hot-{time.time_ns()}", copies=args.copies,
+    ))
+    book_id = book.id
+    db.close()
+
+    modes = {"single_row": run_mode(main_module, crud, schemas, book_id, 0, args.threads, args.duration)}
+    for shards in args.shards:
+        modes[f"{shards}_shards"] = run_mode(main_module, crud, schemas, book_id, shards, args.threads, args.duration)
+
+    baseline = modes["single_row"]["ops_per_sec"] or 1
+    emit("hot_inventory", {
+        "database": db_url.split(":", 1)[0],
+        "threads": args.threads,
+        "copies": args.copies,
+        "modes": modes,
+        "speedup_vs_single_row": {
+            name: round(mode["ops_per_sec"] / baseline, 2) for name, mode in modes.items() if name != "single_row"
+        },
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
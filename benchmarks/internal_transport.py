@@ -0,0 +1,132 @@
+"""Loan Service calls to the User/Book services: public JSON API versus the binary transport.
+
+Starts the User and Book services through ``serve.py``, loads the Loan Service
+client in-process and times each internal call with ``INTERNAL_TRANSPORT=rest``
+and ``binary`` (MessagePack over pooled keep-alive connections):
+``get_user``, ``get_book``, a batched ``get_books`` page, availability updates
+and a whole loan-history enrichment. It also reports the encoded size of one
+book in JSON and MessagePack.
+
+    python benchmarks/internal_transport.py --iterations 500 --page 20
+"""
+import argparse
+import datetime
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import msgpack
+import requests
+
+from common import emit, latency_summary, load_service
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+def timed(fn, iterations: int) -> dict:
+    latencies = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latency_summary(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=300, help="calls per operation and transport")
+    parser.add_argument("--page", type=int, default=20, help="books per batched lookup and loans in the history")
+    parser.add_argument("--user-port", type=int, default=18401)
+    parser.add_argument("--book-port", type=int, default=18402)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-transport-"))
+    user_url = f"http://127.0.0.1:{args.user_port}"
+    book_url = f"http://127.0.0.1:{args.book_port}"
+    servers = [
+        subprocess.Popen(
+            [sys.executable, str(BENCH_DIR / "serve.py"), service, "--port", str(port),
+             "--db", f"sqlite:///{workdir / (service + '.db')}"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for service, port in (("user-service", args.user_port), ("book-service", args.book_port))
+    ]
+    try:
+        wait_until_ready(user_url)
+        wait_until_ready(book_url)
+        user = requests.post(user_url + "/api/users/", json={
+            "name": "Bench Reader", "email": f"reader-{time.time_ns()}@example.com", "role": "student",
+        }).json()
+        book_ids = [
+            requests.post(book_url + "/api/books/", json={
+                "title": f"Book {i}", "author": "Author", "isbn": f"transport-{time.time_ns()}-{i}",
+                "genre": "Fiction", "copies": 1000,
+            }).json()["id"]
+            for i in range(args.page)
+        ]
+
+        loans_main = load_service("loan-service", {
+            "LOAN_DATABASE_URL": f"sqlite:///{workdir / 'loans.db'}",
+            "USER_SERVICE_URL": user_url,
+            "BOOK_SERVICE_URL": book_url,
+        })
+        loans_main.create_tables()
+        service_clients = sys.modules["loan_service_app.service_clients"]
+        crud = loans_main.crud
+        db = sys.modules["loan_service_app.database"].SessionLocal()
+        due = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=14)
+        for book_id in book_ids:
+            db.add(loans_main.models.Loan(user_id=user["id"], book_id=book_id, due_date=due, status="ACTIVE"))
+        db.commit()
+
+        operations = {
+            "get_user": lambda i: crud.user_client.get_user(user["id"]),
+            "get_book": lambda i: crud.book_client.get_book(book_ids[i % len(book_ids)]),
+            "get_books_batch": lambda i: crud.book_client.get_books(book_ids),
+            # Borrow then return the same book, so availability ends where it started
+            "update_availability": lambda i: crud.book_client.update_availability(
+                book_ids[i // 2 % len(book_ids)], "increment" if i % 2 else "decrement"
+            ),
+            "loan_history": lambda i: crud.get_user_loans(db, user_id=user["id"]),
+        }
+        transports = {}
+        for transport in ("rest", "binary"):
+            service_clients.INTERNAL_TRANSPORT = transport
+            crud.get_user_loans(db, user_id=user["id"])  # warm up connections
+            transports[transport] = {name: timed(fn, args.iterations) for name, fn in operations.items()}
+        db.close()
+
+        book = requests.get(f"{book_url}/api/books/{book_ids[0]}").json()
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait(timeout=30)
+
+    emit("internal_transport", {
+        "iterations": args.iterations,
+        "page": args.page,
+        "book_bytes": {"json": len(json.dumps(book).encode()), "msgpack": len(msgpack.packb(book))},
+        "transports": transports,
+        "p50_speedup_binary_vs_rest": {
+            name: round(transports["rest"][name]["p50_ms"] / (transports["binary"][name]["p50_ms"] or 1), 2)
+            for name in operations
+        },
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Loan Service sharded by user across several databases, with a resharding check.
+
+For every shard count in ``--shards`` it starts the Loan Service through
+``serve.py`` with that many SQLite files (or ``--db-template`` URLs such as
+``postgresql://localhost/loans_{shard}``), next to ``fake_service.py`` as the
+User and Book services. ``--threads`` clients then borrow books for random
+users for ``--duration`` seconds. It reports:
+
+- loans created per second and their latency;
+- the loans on each shard, and any that are not on their user's shard;
+- whether every sampled user's ``GET /api/loans/user/{id}`` matches the loans
+  created for them, and whether ``GET /api/loans/{id}`` finds a sample of loans.
+
+The last configuration is then resharded onto one more database with
+``python -m app.reshard``. The service is restarted with the new map and the
+same checks are run again, plus a check that new loan ids do not collide.
+
+    python benchmarks/loan_shards.py --shards 1 2 4 --threads 16
+"""
+import argparse
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import requests
+from sqlalchemy import create_engine, text
+
+from common import PHASE2_ROOT, emit, latency_summary
+
+BENCH_DIR = Path(__file__).resolve().parent
+LOAN_SERVICE_DIR = PHASE2_ROOT / "loan-service"
+DUE_DATE = "2031-01-01T00:00:00"
+# Every tenth loan is created already overdue, for the cross-shard overdue listing
+OVERDUE_EVERY = 10
+
+def load_sharding():
+    """The Loan Service's routing module on its own (it imports nothing from the service)."""
+    spec = importlib.util.spec_from_file_location("loan_service_sharding", LOAN_SERVICE_DIR / "app" / "sharding.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+sharding = load_sharding()
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+def shard_env(urls, shard_map: str = "") -> dict:
+    return {
+        "LOAN_SHARD_URLS": ",".join(urls[1:]),
+        "LOAN_SHARD_MAP": shard_map,
+        # The background workers would compete with the load for the databases
+        "OUTBOX_DISPATCHER": "off",
+        "RECOMMENDATIONS_UPDATER": "off",
+        "LOAN_ARCHIVER": "off",
+    }
+
+def start_loan_service(args, urls, fake_url: str, shard_map: str = ""):
+    env = {**os.environ, **shard_env(urls, shard_map), "USER_SERVICE_URL": fake_url, "BOOK_SERVICE_URL": fake_url,
+           "DB_POOL_SIZE": str(args.threads), "QUERY_BUDGET_MODE": "off"}
+    server = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "serve.py"), "loan-service", "--port", str(args.port), "--db", urls[0]],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_until_ready(f"http://127.0.0.1:{args.port}")
+    return server
+
+def stop(server):
+    server.terminate()
+    server.wait(timeout=30)
+
+def borrow(args, base_url: str, users: int):
+    """Create loans from --threads clients for --duration seconds. Returns (loans by user, latencies, errors)."""
+    created, latencies, errors, overdue = defaultdict(list), [], Counter(), set()
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.duration
+
+    def client(seed: int):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.perf_counter() < stop_at:
+            user_id = rng.randrange(1, users + 1)
+            late = rng.randrange(OVERDUE_EVERY) == 0
+            due_date = f"2020-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T00:00:00" if late else DUE_DATE
+            started = time.perf_counter()
+            response = session.post(base_url + "/api/loans/", json={
+                "user_id": user_id, "book_id": rng.randrange(1, 500), "due_date": due_date,
+            })
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if response.status_code == 201:
+                    created[user_id].append(response.json()["id"])
+                    latencies.append(elapsed)
+                    if late:
+                        overdue.add(response.json()["id"])
+                else:
+                    errors[response.status_code] += 1
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return created, latencies, errors, overdue
+
+def placement(urls, shard_map):
+    """Loans per shard, and loans on a shard other than their user's."""
+    counts, misplaced, ids = {}, 0, []
+    for shard, url in enumerate(urls):
+        engine = create_engine(url)
+        with engine.connect() as connection:
+            rows = connection.execute(text("SELECT id, user_id FROM loans")).all()
+        engine.dispose()
+        counts[shard] = len(rows)
+        misplaced += sum(1 for _, user_id in rows if sharding.shard_for_user(user_id, shard_map) != shard)
+        ids.extend(loan_id for loan_id, _ in rows)
+    return {"loans_per_shard": counts, "misplaced": misplaced, "duplicate_ids": len(ids) - len(set(ids))}
+
+def check_reads(base_url: str, created, samples: int, rng: random.Random) -> dict:
+    users = rng.sample(sorted(created), min(samples, len(created)))
+    histories_ok = 0
+    for user_id in users:
+        history = requests.get(f"{base_url}/api/loans/user/{user_id}", params={"limit": 100}).json()
+        if sorted(loan["id"] for loan in history["loans"]) == sorted(created[user_id]):
+            histories_ok += 1
+    loan_ids = rng.sample([loan_id for ids in created.values() for loan_id in ids], min(samples, sum(map(len, created.values()))))
+    found = sum(1 for loan_id in loan_ids if requests.get(f"{base_url}/api/loans/{loan_id}").status_code == 200)
+    return {"histories_checked": len(users), "histories_ok": histories_ok, "loans_checked": len(loan_ids), "loans_found": found}
+
+def check_overdue(base_url: str, overdue) -> dict:
+    """Page through GET /api/loans/overdue, merged from every shard."""
+    listed, total, skip = [], None, 0
+    while total is None or skip < total:
+        page = requests.get(base_url + "/api/loans/overdue", params={"skip": skip, "limit": 100}).json()
+        total = page["total"]
+        if not page["loans"]:
+            break
+        listed.extend(page["loans"])
+        skip += len(page["loans"])
+    order = [(loan["due_date"], loan["id"]) for loan in listed]
+    return {
+        "overdue_expected": len(overdue),
+        "overdue_total": total,
+        "overdue_listed_ok": sorted(loan["id"] for loan in listed) == sorted(overdue) and order == sorted(order),
+    }
+
+def database_urls(args, workdir: Path, label: str, count: int):
+    if args.db_template:
+        return [args.db_template.format(shard=shard) for shard in range(count)]
+    return [f"sqlite:///{workdir / f'{label}-shard{shard}.db'}" for shard in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="shard counts to compare")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of borrowing per configuration")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=100, help="users and loans read back per check")
+    parser.add_argument("--db-template", help="database URL with {shard}, e.g. postgresql://localhost/loans_{shard} "
+                                              "(empty databases; defaults to throwaway SQLite files)")
+    parser.add_argument("--port", type=int, default=18603)
+    parser.add_argument("--fake-port", type=int, default=18601)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+    if args.db_template and len(args.shards) > 1:
+        parser.error("--db-template databases are reused, so give a single --shards count")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-loan-shards-"))
+    base_url = f"http://127.0.0.1:{args.port}"
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    rng = random.Random(3)
+    fake = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "fake_service.py"), "--port", str(args.fake_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    results = {"configurations": {}}
+    try:
+        wait_until_ready(fake_url)
+        for count in args.shards:
+            urls = database_urls(args, workdir, f"{count}", count)
+            server = start_loan_service(args, urls, fake_url)
+            try:
+                created, latencies, errors, overdue = borrow(args, base_url, args.users)
+                reads = check_reads(base_url, created, args.samples, rng)
+                reads.update(check_overdue(base_url, overdue))
+            finally:
+                stop(server)
+            loans = sum(map(len, created.values()))
+            results["configurations"][f"{count}_shards"] = {
+                "loans_per_sec": round(loans / args.duration, 1),
+                "errors": dict(errors),
+                "latency": latency_summary(latencies),
+                **placement(urls, sharding.parse_map("", count)),
+                **reads,
+            }
+
+        # One more database for the last configuration, taking over half of the
+        # last shard's buckets
+        old_map = sharding.parse_map("", count)
+        last = [bucket for bucket, shard in enumerate(old_map) if shard == count - 1]
+        moved_buckets = last[len(last) // 2:]
+        new_map = old_map[:moved_buckets[0]] + [count] * len(moved_buckets)
+        spec = f"0-{moved_buckets[0] - 1}:0,{moved_buckets[0]}-{sharding.BUCKETS - 1}:{count}" if count == 1 else ",".join(
+            f"{bucket}:{shard}" for bucket, shard in enumerate(new_map)
+        )
+        new_urls = urls + database_urls(args, workdir, f"{count}", count + 1)[count:]
+        reshard = subprocess.run(
+            [sys.executable, "-m", "app.reshard"], cwd=LOAN_SERVICE_DIR, capture_output=True, text=True,
+            env={**os.environ, **shard_env(new_urls, spec), "LOAN_DATABASE_URL": new_urls[0]},
+        )
+        server = start_loan_service(args, new_urls, fake_url, spec)
+        try:
+            reads = check_reads(base_url, created, args.samples, rng)
+            # New loans on every shard after the move: their ids must not collide with moved ones
+            more, _, more_errors, more_overdue = borrow(
+                argparse.Namespace(**{**vars(args), "duration": 1.0}), base_url, args.users
+            )
+            reads.update(check_overdue(base_url, overdue | more_overdue))
+        finally:
+            stop(server)
+        results["reshard"] = {
+            "from_shards": count,
+            "to_shards": count + 1,
+            "buckets_moved": len(moved_buckets),
+            "tool_exit_code": reshard.returncode,
+            "tool_output": (reshard.stdout or reshard.stderr).strip().splitlines()[-1:],
+            "loans_after_move": sum(map(len, more.values())),
+            "errors_after_move": dict(more_errors),
+            **placement(new_urls, new_map),
+            **reads,
+        }
+    finally:
+        fake.terminate()
+        fake.wait(timeout=30)
+
+    emit("loan_shards", results, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Serve Phase-1 or one Phase-2 service with SQL statement accounting for load tests.
+
+Every response gets an ``X-DB-Queries`` header with the number of SQL statements
+executed while serving it. Outbound calls made with ``requests`` (the Loan
+Service talking to the User and Book services) add the downstream service's
+header to the caller's count, so the header is the system-wide cost of the
+request. ``GET /__bench__/stats`` returns the process totals.
+
+    python benchmarks/serve.py loan-service --port 18003 --db sqlite:////tmp/loans.db
+"""
+import argparse
+import contextvars
+import warnings
+
+import requests
+import uvicorn
+from sqlalchemy import event
+from starlette.responses import JSONResponse
+
+from common import load_phase1, load_service
+
+TARGETS = {
+    "phase1": "DATABASE_URL",
+    "user-service": "USER_DATABASE_URL",
+    "book-service": "BOOK_DATABASE_URL",
+    "loan-service": "LOAN_DATABASE_URL",
+}
+
+STATS_PATH = "/__bench__/stats"
+
+_queries = contextvars.ContextVar("bench_queries", default=None)
+_totals = {"requests": 0, "queries": 0}
+
+def count_queries(engine):
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter = _queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+def count_downstream_queries():
+    """Fold the X-DB-Queries header of outbound responses into the current request."""
+    original_send = requests.Session.send
+
+    def send(self, request, **kwargs):
+        response = original_send(self, request, **kwargs)
+        counter = _queries.get()
+        if counter is not None:
+            counter[0] += int(response.headers.get("x-db-queries", 0))
+        return response
+
+    requests.Session.send = send
+
+class QueryCountMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] == STATS_PATH:
+            await JSONResponse(_totals)(scope, receive, send)
+            return
+
+        counter = [0]
+        token = _queries.set(counter)
+        reported = [0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-db-queries", str(counter[0]).encode())]
+                # Count the request before the client sees the response, so totals read
+                # right after a run are complete
+                _totals["requests"] += 1
+                _totals["queries"] += counter[0]
+                reported[0] = counter[0]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _queries.reset(token)
+            # Statements run while streaming the body
+            _totals["queries"] += counter[0] - reported[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", choices=sorted(TARGETS))
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--db", required=True, help="database URL for the target")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    env = {TARGETS[args.target]: args.db}
+    main_module = load_phase1(env) if args.target == "phase1" else load_service(args.target, env)
+    count_queries(main_module.engine)
+    count_downstream_queries()
+    uvicorn.run(QueryCountMiddleware(main_module.app), host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
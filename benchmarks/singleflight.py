@@ -0,0 +1,111 @@
+"""Request coalescing for a hot book under a burst of identical reads.
+
+Starts the Book Service through ``serve.py`` and fires bursts of concurrent
+``GET /api/books/{id}`` for the same id. Reports latency, SQL statements per
+request and the single-flight hit ratio taken from ``/metrics``.
+
+    python benchmarks/singleflight.py --concurrency 64 --bursts 50
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import emit, latency_summary
+
+BENCH_DIR = Path(__file__).resolve().parent
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+def singleflight_counts(base_url: str) -> dict:
+    counts = {"leader": 0.0, "shared": 0.0}
+    for line in requests.get(base_url + "/metrics").text.splitlines():
+        if line.startswith("singleflight_calls_total{") and 'group="get_book"' in line:
+            role = "shared" if 'role="shared"' in line else "leader"
+            counts[role] += float(line.rsplit(" ", 1)[1])
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32, help="identical requests per burst")
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--port", type=int, default=18301)
+    parser.add_argument("--db", help="database URL (defaults to a throwaway SQLite file)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    db_url = args.db or f"sqlite:///{Path(tempfile.mkdtemp(prefix='bench-singleflight-')) / 'books.db'}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "serve.py"), "book-service", "--port", str(args.port), "--db", db_url],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(base_url)
+        book = requests.post(base_url + "/api/books/", json={
+            "title": "Viral Book", "author": "Someone Famous", "isbn": f"viral-{time.time_ns()}", "copies": 10,
+        }).json()
+        url = f"{base_url}/api/books/{book['id']}"
+        sessions = [requests.Session() for _ in range(args.concurrency)]
+        for session in sessions:
+            session.get(url)  # open keep-alive connections before measuring
+
+        before_stats = requests.get(base_url + "/__bench__/stats").json()
+        before_flight = singleflight_counts(base_url)
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        for _ in range(args.bursts):
+            barrier = threading.Barrier(args.concurrency)
+
+            def client(session):
+                barrier.wait()
+                started = time.perf_counter()
+                ok = session.get(url).status_code == 200
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if ok:
+                        latencies.append(elapsed)
+                    else:
+                        errors[0] += 1
+
+            threads = [threading.Thread(target=client, args=(session,)) for session in sessions]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        after_stats = requests.get(base_url + "/__bench__/stats").json()
+        after_flight = singleflight_counts(base_url)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    served = len(latencies) + errors[0]
+    leaders = after_flight["leader"] - before_flight["leader"]
+    shared = after_flight["shared"] - before_flight["shared"]
+    emit("singleflight", {
+        "concurrency": args.concurrency,
+        "bursts": args.bursts,
+        "errors": errors[0],
+        "db_queries_per_request": round((after_stats["queries"] - before_stats["queries"]) / (served or 1), 3),
+        "singleflight_hit_ratio": round(shared / ((leaders + shared) or 1), 3),
+        **latency_summary(latencies),
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Typeahead suggestions from the Book Service's in-memory prefix index.
+
+Loads the Book Service in-process on a throwaway SQLite file (or ``--db``),
+imports ``--books`` generated books and builds the index the way a worker
+does at startup. It reports:
+
+- build time and the Python memory held by the index, per book;
+- latency of ``suggest()`` for prefixes of 1 to 6 characters taken from real
+  titles, authors and ISBNs, next to the ``?search=`` query it replaces;
+- freshness: the time from a title edit committing to the new title being
+  suggested, with the background indexer running.
+
+    python benchmarks/suggest.py --books 100000
+"""
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+from common import emit, latency_summary, load_service
+
+WORDS = (
+    "river night garden silent empire shadow winter city golden stone last house ocean "
+    "fire glass dream north song wolf iron secret paper storm machine little forest light"
+).split()
+NAMES = "ada grace alan edsger barbara donald frances john margaret ken linus guido".split()
+
+def generate(count: int, rng: random.Random):
+    for number in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(2, 7))).title()
+        author = f"{rng.choice(NAMES).title()} {rng.choice(WORDS).title()}son"
+        yield {"title": f"{title} {number}", "author": author, "isbn": f"978-{number:010d}", "copies": 1}
+
+def timed(function, samples):
+    latencies = []
+    for sample in samples:
+        started = time.perf_counter()
+        function(sample)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latency_summary(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--search-queries", type=int, default=200, help="?search= queries to compare against")
+    parser.add_argument("--db", help="database URL (defaults to a throwaway SQLite file)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    db_url = args.db or f"sqlite:///{Path(tempfile.mkdtemp(prefix='bench-suggest-')) / 'books.db'}"
+    main_module = load_service("book-service", {"BOOK_DATABASE_URL": db_url, "QUERY_BUDGET_MODE": "off"})
+    main_module.create_tables()
+    package = main_module.__name__.rsplit(".", 1)[0]
+    crud, schemas, suggest = (__import__(f"{package}.{name}", fromlist=[name]) for name in ("crud", "schemas", "suggest"))
+    SessionLocal = main_module.get_db.__globals__["SessionLocal"]
+
+    rng = random.Random(7)
+    books = list(generate(args.books, rng))
+    with SessionLocal() as db:
+        for start in range(0, len(books), 5000):
+            crud.bulk_create_books(db, [schemas.BookCreate(**book) for book in books[start:start + 5000]])
+
+    started = time.perf_counter()
+    suggest.indexer._build()
+    build_seconds = time.perf_counter() - started
+    # Again under tracemalloc (slower) for the memory it keeps
+    suggest.index.load([])
+    tracemalloc.start()
+    suggest.indexer._build()
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    def prefix(book):
+        text = rng.choice([book["title"], book["title"].split()[rng.randrange(2)], book["author"], book["isbn"]])
+        return text[:rng.randrange(1, 7)]
+
+    prefixes = [prefix(rng.choice(books)) for _ in range(args.queries)]
+    suggest_latency = timed(lambda query: suggest.index.suggest(query, 8), prefixes)
+    empty = sum(1 for query in prefixes[:500] if not suggest.index.suggest(query, 8))
+    with SessionLocal() as db:
+        search_latency = timed(lambda query: crud.get_books(db, search=query, limit=8), prefixes[:args.search_queries])
+
+    suggest.indexer.start()
+    freshness = []
+    try:
+        with SessionLocal() as db:
+            # The first edit also waits for the import's changes queued before
+            # the indexer started, so it is left out
+            for attempt in range(21):
+                book_id = rng.randrange(1, args.books + 1)
+                title = f"Zebra Quartz {attempt}"
+                crud.update_book(db, book_id, schemas.BookUpdate(title=title))
+                committed = time.perf_counter()
+                while not any(hit["id"] == book_id for hit in suggest.index.suggest(title, 8)):
+                    time.sleep(0.005)
+                if attempt:
+                    freshness.append((time.perf_counter() - committed) * 1000)
+    finally:
+        suggest.indexer.stop()
+
+    emit("suggest", {
+        "books": len(suggest.index.books),
+        "index_keys": len(suggest.index),
+        "build_seconds": round(build_seconds, 2),
+        "index_mb": round(index_bytes / 2 ** 20, 1),
+        "index_bytes_per_book": round(index_bytes / max(1, len(suggest.index.books))),
+        "suggest_latency": suggest_latency,
+        "suggest_empty_results_of_500": empty,
+        "search_latency": search_latency,
+        "edit_to_suggestion_ms": latency_summary(freshness),
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
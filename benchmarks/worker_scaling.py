@@ -0,0 +1,151 @@
+"""Throughput of a Phase-2 service as the number of gunicorn/uvicorn workers grows.
+
+Starts the service with ``gunicorn -c gunicorn.conf.py`` for each worker count,
+drives ``GET /api/books/{id}`` (or ``/api/users/{id}``) from several load-generator
+processes, and reports requests/second and latency percentiles per worker count.
+
+    python benchmarks/worker_scaling.py --workers 1 2 4 8 --duration 15
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+import requests
+
+from common import PHASE2_ROOT, emit, latency_summary
+
+SERVICES = {
+    "book-service": ("BOOK_DATABASE_URL", "/api/books/"),
+    "user-service": ("USER_DATABASE_URL", "/api/users/"),
+}
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {base_url} did not become ready")
+
+def seed(base_url: str, service: str, rows: int):
+    if service == "book-service":
+        body = "".join(
+            json.dumps({"title": f"Book {i}", "author": f"Author {i % 500}", "isbn": f"bench-{i}", "copies": 3}) + "\n"
+            for i in range(rows)
+        )
+        url = base_url + "/api/books/bulk"
+    else:
+        body = "".join(
+            json.dumps({"name": f"User {i}", "email": f"bench{i}@example.edu", "role": "student"}) + "\n"
+            for i in range(rows)
+        )
+        url = base_url + "/api/users/bulk"
+    response = requests.post(url, data=body.encode(), headers={"Content-Type": "application/x-ndjson"})
+    response.raise_for_status()
+
+def load_process(url_prefix: str, rows: int, threads: int, duration: float, queue):
+    """One load-generator process: ``threads`` keep-alive clients hammering random ids."""
+    latencies, errors = [], [0]
+    stop_at = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        local, local_errors = [], 0
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                ok = session.get(f"{url_prefix}{random.randint(1, rows)}").status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local.append((time.perf_counter() - started) * 1000)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    pool = [threading.Thread(target=client) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    queue.put((latencies, errors[0]))
+
+def run(service: str, workers: int, args, db_url: str) -> dict:
+    env_var, path = SERVICES[service]
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(args.port), ACCESS_LOG="/dev/null")
+    env[env_var] = db_url
+    server = subprocess.Popen(
+        ["gunicorn", "app.main:app", "-c", "gunicorn.conf.py"],
+        cwd=PHASE2_ROOT / service, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_ready(base_url)
+        seed(base_url, service, args.rows)
+        queue = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=load_process,
+                args=(base_url + path, args.rows, args.threads, args.duration, queue),
+            )
+            for _ in range(args.clients)
+        ]
+        for proc in procs:
+            proc.start()
+        latencies, errors = [], 0
+        for _ in procs:
+            samples, failed = queue.get()
+            latencies.extend(samples)
+            errors += failed
+        for proc in procs:
+            proc.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        "workers": workers,
+        "requests_per_sec": round(len(latencies) / args.duration, 1),
+        "errors": errors,
+        **latency_summary(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(SERVICES), default="book-service")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per worker count")
+    parser.add_argument("--clients", type=int, default=max(2, multiprocessing.cpu_count() // 2),
+                        help="load-generator processes")
+    parser.add_argument("--threads", type=int, default=8, help="keep-alive connections per load process")
+    parser.add_argument("--rows", type=int, default=5000, help="records seeded before the run")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--db", help="database URL (defaults to a throwaway SQLite file)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    db_url = args.db or f"sqlite:///{Path(tempfile.mkdtemp(prefix='bench-workers-')) / 'service.db'}"
+    runs = [run(args.service, workers, args, db_url) for workers in args.workers]
+    baseline = runs[0]["requests_per_sec"] or 1
+    for entry in runs:
+        entry["scaling"] = round(entry["requests_per_sec"] / baseline, 2)
+    emit("worker_scaling", {"service": args.service, "cpu_count": multiprocessing.cpu_count(), "runs": runs}, args.output)
+
+if __name__ == "__main__":
+    main()